@@ -0,0 +1,166 @@
+from logical_classes import *
+from util import *
+
+verbose = 0
+
+def bind(pattern, statement, env):
+    """Extend variable bindings so that pattern matches a ground statement
+
+    Args:
+        pattern (Statement): statement possibly containing variables
+        statement (Statement): ground statement to match against
+        env (dictof Term): variable name to bound term
+
+    Returns:
+        dictof Term|None: the extended bindings, or None if there is no match
+    """
+    env = dict(env)
+    for p, s in zip(pattern.terms, statement.terms):
+        if is_var(p):
+            bound = env.setdefault(p.term.element, s)
+            if bound != s:
+                return None
+        elif p != s:
+            return None
+    return env
+
+def substitute(statement, env):
+    """Replace the bound variables of a statement
+
+    Args:
+        statement (Statement): statement to substitute into
+        env (dictof Term): variable name to bound term
+
+    Returns:
+        Statement
+    """
+    return Statement([statement.predicate] +
+        [env.get(t.term.element, t) if is_var(t) else t for t in statement.terms])
+
+class TabledProver(object):
+    """Goal-directed (backward-chaining) prover over the facts of a KB and a
+        set of rules, with tabling: each subgoal, up to variable renaming, is
+        evaluated once into a table of answers that other calls reuse. A call
+        to a subgoal still being evaluated (recursion) gets the answers found
+        so far, and evaluation is repeated until no table grows, so recursive
+        rules terminate.
+
+    Attributes:
+        kb (KnowledgeBase): KB whose facts are the base answers
+        rules (dictof listof Rule): rules by the index key of their RHS
+        tables (dictof dictof Fact): answers by variant key of the subgoal
+    """
+    def __init__(self, kb, rules):
+        """Constructor for TabledProver
+
+        Args:
+            kb (KnowledgeBase): KB whose facts are the base answers
+            rules (iterable of Rule): rules to chain backwards through
+        """
+        super(TabledProver, self).__init__()
+        self.kb = kb
+        self.rules = {}
+        for rule in rules:
+            self.rules.setdefault(index_key(rule.rhs), []).append(rule)
+        self.tables = {}
+        self._complete = set()
+        self._active = set()
+        self._changed = False
+
+    def prove(self, statement):
+        """Find all the ground instances of a statement that are KB facts or
+            follow from them through the rules
+
+        Args:
+            statement (Statement): goal, possibly containing variables
+
+        Returns:
+            listof Fact: answers, KB facts or inferred Facts supported by the
+                answers and rule they were inferred from
+        """
+        printv('Proving {!r}', 0, verbose, [statement])
+        while True:
+            self._changed = False
+            self._active = set()
+            table = self._solve(statement)
+            if not self._changed:
+                break
+        self._complete.update(self.tables)
+        return list(table.values())
+
+    def _solve(self, goal):
+        """Evaluate a subgoal once and return its (possibly incomplete) table.
+            The subgoals it calls are evaluated on an explicit stack of
+            evaluations rather than by recursion, so chains of subgoals of any
+            length are proved without running out of Python stack.
+        """
+        stack = []
+        table = self._call(goal, stack)
+        while stack:
+            try:
+                subgoal = stack[-1].send(table)
+            except StopIteration as stop:
+                stack.pop()
+                table = stop.value
+            else:
+                table = self._call(subgoal, stack)
+        return table
+
+    def _call(self, goal, stack):
+        """Get the table of a subgoal if it is complete or being evaluated;
+            otherwise push its evaluation on the stack and return None
+        """
+        key = variant_key(goal)
+        table = self.tables.setdefault(key, {})
+        if key in self._complete or key in self._active:
+            return table
+        self._active.add(key)
+        stack.append(self._evaluate(goal, table))
+        return None
+
+    def _evaluate(self, goal, table):
+        """Evaluate a subgoal into its table: a generator yielding each
+            subgoal it calls, to be sent back that subgoal's table, and
+            returning the table
+        """
+        for fact in list(self.kb._facts_for(goal)):
+            if fact.statement not in table and match(goal, fact.statement):
+                table[fact.statement] = fact
+                self._changed = True
+
+        for rule in self.rules.get(index_key(goal), ()):
+            # bind the rule variables to the constants of the goal; goal
+            # variables are left free and checked on the answers
+            env = {}
+            for h, g in zip(rule.rhs.terms, goal.terms):
+                if is_var(h):
+                    if not is_var(g) and env.setdefault(h.term.element, g) != g:
+                        break
+                elif not is_var(g) and h != g:
+                    break
+            else:
+                proofs = yield from self._prove_body(rule, env)
+                for env, support in proofs:
+                    answer = substitute(rule.rhs, env)
+                    if answer not in table and match(goal, answer):
+                        table[answer] = Fact(answer, [support + [rule]])
+                        self._changed = True
+        return table
+
+    def _prove_body(self, rule, env):
+        """Enumerate the bindings and supporting answers proving the LHS of
+            rule: a generator yielding the subgoals to evaluate, like
+            _evaluate, and returning the list of them
+        """
+        partial = [(env, [])]
+        for condition in rule.lhs:
+            extended = []
+            for env, support in partial:
+                subgoal = substitute(condition, env)
+                answers = yield subgoal
+                for answer in list(answers.values()):
+                    env2 = bind(subgoal, answer.statement, env)
+                    if env2 is not None:
+                        extended.append((env2, support + [answer]))
+            partial = extended
+        return partial
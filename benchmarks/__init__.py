@@ -0,0 +1,3 @@
+"""Benchmarks for the knowledge base and its inference engines. Run a module
+from the repository root, e.g. `python -m benchmarks.engines`.
+"""
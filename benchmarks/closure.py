@@ -0,0 +1,37 @@
+"""Compare materializing an isa chain with a forward engine against keeping
+isa and inst lazy and answering asks from the closure index.
+
+Usage: python -m benchmarks.closure [size]
+"""
+import contextlib, os, sys, time
+from logical_classes import *
+from student_code import KnowledgeBase
+from tokens import TokenEngine
+from benchmarks.generators import isa_chain
+
+def run(kb, size):
+    """Assert an isa chain, then ask about every tenth class and the
+    instance; return (assert seconds, ask seconds, facts in the KB, answers)
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for item in isa_chain(size):
+            kb.kb_assert(item)
+        asserted = time.perf_counter() - start
+        start = time.perf_counter()
+        answers = 0
+        for i in range(0, size, 10):
+            answers += len(kb.kb_ask(Fact(['isa', 'c%d' % i, '?X'])) or [])
+        answers += len(kb.kb_ask(Fact(['inst', 'thing', '?X'])) or [])
+        asked = time.perf_counter() - start
+    return asserted, asked, len(kb.facts), answers
+
+def main(size=150):
+    for name, make in [('tokens', lambda: KnowledgeBase([], [], engine=TokenEngine())),
+                       ('closure', lambda: KnowledgeBase([], [], lazy=['inst', 'isa']))]:
+        asserted, asked, facts, answers = run(make(), size)
+        print('{:8} assert {:8.3f}s  ask {:8.4f}s  {:6} facts  {} answers'.format(
+            name, asserted, asked, facts, answers))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
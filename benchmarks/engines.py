@@ -0,0 +1,45 @@
+"""Compare the inference engines on materializing the same KBs: the default
+curried-rule engine, the Rete network, semi-naive Datalog evaluation and
+per-rule token memories.
+
+Usage: python -m benchmarks.engines [size]
+"""
+import contextlib, os, sys, time
+from logical_classes import *
+from student_code import KnowledgeBase
+from rete import ReteEngine
+from datalog import DatalogEngine
+from tokens import TokenEngine
+from benchmarks.generators import isa_chain, family
+
+ENGINES = [
+    ('curried', lambda: None),
+    ('rete', ReteEngine),
+    ('datalog', DatalogEngine),
+    ('tokens', TokenEngine),
+]
+
+def run(name, make_engine, items, bulk):
+    """Build a KB from items and return (seconds, number of facts)
+    """
+    kb = KnowledgeBase([], [], engine=make_engine())
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if bulk:
+            kb.kb_assert_many(items)
+        else:
+            for item in items:
+                kb.kb_assert(item)
+    return time.perf_counter() - start, len(kb.facts)
+
+def main(size=100):
+    for workload, items in [('isa chain', isa_chain(size)), ('family', family(size * 10))]:
+        print('{} ({} statements)'.format(workload, len(items)))
+        for name, make_engine in ENGINES:
+            for bulk in (False, True):
+                seconds, facts = run(name, make_engine, items, bulk)
+                print('  {:8} {:11} {:8.3f}s  {} facts'.format(
+                    name, 'bulk' if bulk else 'incremental', seconds, facts))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
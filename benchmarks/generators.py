@@ -0,0 +1,33 @@
+"""Synthetic KBs of any size for the benchmarks, shaped like the statement
+files: each generator returns the statements to assert, rules first.
+"""
+from logical_classes import *
+
+def isa_chain(n):
+    """Statements for a chain of n isa links with a transitive isa rule and
+    an inheriting inst rule, like statements_kb2.txt
+    """
+    items = [Rule([[['isa', '?x', '?y'], ['isa', '?y', '?z']], ['isa', '?x', '?z']]),
+             Rule([[['inst', '?x', '?y'], ['isa', '?y', '?z']], ['inst', '?x', '?z']])]
+    items += [Fact(['isa', 'c%d' % i, 'c%d' % (i + 1)]) for i in range(n)]
+    items.append(Fact(['inst', 'thing', 'c0']))
+    return items
+
+def family(n):
+    """Statements for n mother links forming a forest of depth 4, with the
+    rules of statements_kb4.txt
+    """
+    items = [Rule([[['motherof', '?x', '?y']], ['parentof', '?x', '?y']]),
+             Rule([[['parentof', '?x', '?y'], ['motherof', '?z', '?x']], ['grandmotherof', '?z', '?y']]),
+             Rule([[['grandmotherof', '?x', '?y']], ['cooksfor', '?x', '?y']])]
+    items += [Fact(['motherof', 'p%d' % (i // 4), 'p%d' % (i + 1)]) for i in range(n)]
+    return items
+
+def fan_out(n, width=10):
+    """Statements for n nodes, each matched by width rules inferring a
+    property of it, and a rule joining two of the properties
+    """
+    items = [Rule([[['node', '?x']], ['prop%d' % k, '?x']]) for k in range(width)]
+    items.append(Rule([[['prop0', '?x'], ['prop1', '?x']], ['both', '?x']]))
+    items += [Fact(['node', 'n%d' % i]) for i in range(n)]
+    return items
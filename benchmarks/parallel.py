@@ -0,0 +1,42 @@
+"""Measure how materializing a KB with ParallelDatalogEngine scales with the
+number of worker processes, against the sequential DatalogEngine, and check
+that every run gives the same facts.
+
+Usage: python -m benchmarks.parallel [size] [max processes]
+"""
+import multiprocessing, sys, time
+from logical_classes import *
+from student_code import KnowledgeBase
+from datalog import DatalogEngine
+from parallel import ParallelDatalogEngine
+from benchmarks.generators import isa_chain, family
+
+def run(engine, items):
+    """Build a KB from items and return (seconds, facts)
+    """
+    kb = KnowledgeBase([], [], engine=engine)
+    start = time.perf_counter()
+    kb.kb_assert_many(items)
+    seconds = time.perf_counter() - start
+    return seconds, [f.statement for f in kb.facts]
+
+def main(size=100, processes=None):
+    processes = processes or multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= processes:
+        counts.append(counts[-1] * 2)
+    for workload, make in [('isa chain', lambda: isa_chain(size)),
+                           ('family', lambda: family(size * 50))]:
+        seconds, facts = run(DatalogEngine(), make())
+        print('{} ({} facts)'.format(workload, len(facts)))
+        print('  {:12} {:8.3f}s'.format('sequential', seconds))
+        for n in counts:
+            engine = ParallelDatalogEngine(n)
+            parallel_seconds, parallel_facts = run(engine, make())
+            engine.close()
+            print('  {:12} {:8.3f}s  x{:.2f}{}'.format(
+                '{} process{}'.format(n, 'es' if n > 1 else ''), parallel_seconds,
+                seconds / parallel_seconds, '' if parallel_facts == facts else '  DIFFERENT FACTS'))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,169 @@
+"""Benchmark suite: assert, ask and retract throughput, peak memory and
+derived-fact counts of each engine on synthetic KBs, with baselines to
+catch regressions.
+
+Usage: python -m benchmarks.suite [--size N] [--engine NAME] [--save FILE]
+                                  [--compare FILE] [--tolerance T]
+
+--save writes the results as a JSON baseline; --compare checks them against
+one and exits with status 1 if a count changed, a throughput dropped or the
+peak memory grew by more than the tolerance (a fraction, 0.5 by default,
+as timings easily vary by tens of percent between runs).
+Timings only compare across runs on the same machine.
+"""
+import argparse, contextlib, json, os, platform, sys, time, tracemalloc
+from logical_classes import *
+from student_code import KnowledgeBase
+from benchmarks.engines import ENGINES
+from benchmarks.generators import isa_chain, family, fan_out
+
+# higher is better for throughputs, lower for memory; counts must not change
+THROUGHPUTS = ['assert_per_s', 'ask_per_s', 'retract_per_s']
+COUNTS = ['facts', 'derived', 'facts_after_retract']
+
+def workloads(size):
+    """Workloads at a size: (name, function making the statements, asks,
+    facts to retract). Statements are made afresh for each run, since
+    asserting them changes them.
+    """
+    n = size * 10
+    yield ('family', lambda: family(n),
+           [['grandmotherof', 'p%d' % i, '?X'] for i in range(0, n // 16)] +
+           [['cooksfor', '?X', 'p%d' % i] for i in range(0, n, 4)],
+           [['motherof', 'p%d' % (i // 4), 'p%d' % (i + 1)] for i in range(0, n, 16)])
+    yield ('isa chain', lambda: isa_chain(size),
+           [['isa', 'c%d' % i, '?X'] for i in range(size)] + [['inst', 'thing', '?X']],
+           [['isa', 'c%d' % i, 'c%d' % (i + 1)] for i in range(size - 1, size // 2, -size // 10 or -1)])
+    yield ('fan out', lambda: fan_out(n),
+           [['prop%d' % (i % 10), 'n%d' % i] for i in range(n)] + [['both', '?X']],
+           [['node', 'n%d' % i] for i in range(0, n, 8)])
+
+def measure(make_engine, make_items, asks, retractions):
+    """Build a KB, ask and retract, and return the results
+    """
+    kb = KnowledgeBase([], [], engine=make_engine(), ask_cache_size=0)
+    items = make_items()
+    start = time.perf_counter()
+    for item in items:
+        kb.kb_assert(item)
+    assert_seconds = time.perf_counter() - start
+    facts = len(kb.facts)
+    derived = sum(1 for f in kb.facts if not f.asserted)
+
+    start = time.perf_counter()
+    for ask in asks:
+        kb.kb_ask(Fact(ask))
+    ask_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for retraction in retractions:
+        kb.kb_retract(Fact(retraction))
+    retract_seconds = time.perf_counter() - start
+
+    return {'assert_per_s': len(items) / assert_seconds,
+            'ask_per_s': len(asks) / ask_seconds,
+            'retract_per_s': len(retractions) / retract_seconds,
+            'facts': facts,
+            'derived': derived,
+            'facts_after_retract': len(kb.facts)}
+
+def peak_memory(make_engine, make_items):
+    """Peak memory in KiB allocated while building a KB
+    """
+    tracemalloc.start()
+    try:
+        kb = KnowledgeBase([], [], engine=make_engine())
+        for item in make_items():
+            kb.kb_assert(item)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+def run(size, engines, repeat):
+    """Run every workload on every engine; throughputs are the best of
+    repeat runs
+
+    Returns:
+        dictof (dictof dict): results by workload then engine
+    """
+    results = {}
+    for workload, make_items, asks, retractions in workloads(size):
+        results[workload] = {}
+        for name, make_engine in ENGINES:
+            if name not in engines:
+                continue
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                runs = [measure(make_engine, make_items, asks, retractions) for _ in range(repeat)]
+                result = dict(runs[0])
+                for key in THROUGHPUTS:
+                    result[key] = max(r[key] for r in runs)
+                result['peak_kib'] = peak_memory(make_engine, make_items)
+            results[workload][name] = result
+    return results
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline
+
+    Returns:
+        listof str: the regressions found
+    """
+    regressions = []
+    for workload, by_engine in results.items():
+        for name, result in by_engine.items():
+            base = baseline.get(workload, {}).get(name)
+            if base is None:
+                continue
+            where = '{} / {}'.format(workload, name)
+            for key in COUNTS:
+                if result[key] != base[key]:
+                    regressions.append('{}: {} is {}, was {}'.format(where, key, result[key], base[key]))
+            for key in THROUGHPUTS:
+                if result[key] < base[key] * (1 - tolerance):
+                    regressions.append('{}: {} is {:.0f}, was {:.0f}'.format(
+                        where, key, result[key], base[key]))
+            if result['peak_kib'] > base['peak_kib'] * (1 + tolerance):
+                regressions.append('{}: peak_kib is {}, was {}'.format(
+                    where, result['peak_kib'], base['peak_kib']))
+    return regressions
+
+def report(results):
+    """Print the results as a table
+    """
+    print('{:10} {:8} {:>10} {:>10} {:>10} {:>9} {:>8} {:>8} {:>8}'.format(
+        'workload', 'engine', 'assert/s', 'ask/s', 'retract/s', 'peak KiB', 'facts', 'derived', 'after'))
+    for workload, by_engine in results.items():
+        for name, r in by_engine.items():
+            print('{:10} {:8} {:10.0f} {:10.0f} {:10.0f} {:9} {:8} {:8} {:8}'.format(
+                workload, name, r['assert_per_s'], r['ask_per_s'], r['retract_per_s'],
+                r['peak_kib'], r['facts'], r['derived'], r['facts_after_retract']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the knowledge base.')
+    parser.add_argument('--size', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engine', action='append', choices=[name for name, _ in ENGINES],
+                        help='engine to run (repeatable), all by default')
+    parser.add_argument('--save', help='write the results as a baseline')
+    parser.add_argument('--compare', help='baseline to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.engine or [name for name, _ in ENGINES], args.repeat)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'size': args.size, 'python': platform.python_version(),
+                       'results': results}, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['size'] != args.size:
+            parser.error('baseline is for --size {}'.format(baseline['size']))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Compare the truth maintenance strategies on retract-heavy workloads: the
+time to retract a share of the asserted facts one by one, and how many facts
+are left that a KB built without them would not have.
+
+Usage: python -m benchmarks.tms [size]
+"""
+import contextlib, os, random, sys, time
+from logical_classes import *
+from student_code import KnowledgeBase
+from tokens import TokenEngine
+from tms import SupportCounting, DRed
+from benchmarks.generators import isa_chain, family
+
+STRATEGIES = [('counting', SupportCounting), ('dred', DRed)]
+
+def isa_graph(n, links, seed=0):
+    """Statements for random isa links among n classes, cycles included,
+    with the transitive isa rule
+    """
+    r = random.Random(seed)
+    items = [Rule([[['isa', '?x', '?y'], ['isa', '?y', '?z']], ['isa', '?x', '?z']])]
+    items += [Fact(['isa', 'c%d' % r.randrange(n), 'c%d' % r.randrange(n)]) for _ in range(links)]
+    return items
+
+def run(make_tms, make_items, every):
+    """Build a KB with the token engine, retract every every-th asserted fact;
+    return (seconds, facts left, facts a KB built without them has)
+    """
+    kb = KnowledgeBase([], [], engine=TokenEngine(), tms=make_tms())
+    for item in make_items():
+        kb.kb_assert(item)
+    retracted = [item for item in make_items() if isinstance(item, Fact)][::every]
+    start = time.perf_counter()
+    for fact in retracted:
+        kb.kb_retract(fact)
+    seconds = time.perf_counter() - start
+
+    gone = set(fact.statement for fact in retracted)
+    rebuilt = KnowledgeBase([], [], engine=TokenEngine())
+    for item in make_items():
+        if not (isinstance(item, Fact) and item.statement in gone):
+            rebuilt.kb_assert(item)
+    return seconds, len(kb.facts), len(rebuilt.facts)
+
+def main(size=60):
+    workloads = [('family', lambda: family(size * 20), 4),
+                 ('isa chain', lambda: isa_chain(size), 6),
+                 ('isa graph', lambda: isa_graph(size // 2, size), 4)]
+    with open(os.devnull, 'w') as devnull:
+        for workload, make_items, every in workloads:
+            print(workload)
+            for name, make_tms in STRATEGIES:
+                with contextlib.redirect_stdout(devnull):
+                    seconds, left, expected = run(make_tms, make_items, every)
+                print('  {:9} {:8.3f}s  {:6} facts left, {} too many'.format(
+                    name, seconds, left, left - expected))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
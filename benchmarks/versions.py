@@ -0,0 +1,52 @@
+"""Measure how long asks wait while a writer asserts into the KB: readers
+either take the writer lock and ask the KB, or ask the current published
+version without locking.
+
+Usage: python -m benchmarks.versions [size]
+"""
+import contextlib, os, sys, threading, time
+from logical_classes import *
+from student_code import KnowledgeBase
+from benchmarks.generators import family
+
+def run(locked, size, readers=2, batch=50):
+    """Assert family(size) in batches while reader threads ask about it;
+    return (writer seconds, asks, mean and worst ask latency in seconds)
+    """
+    kb = KnowledgeBase([], [], versioned=True)
+    ask = Fact(['grandmotherof', 'p0', '?X'])
+    stop, latencies = [], []
+
+    def read():
+        while not stop:
+            start = time.perf_counter()
+            if locked:
+                with kb.versions.lock:
+                    kb.kb_ask(ask)
+            else:
+                kb.versions.current.kb_ask(ask)
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.001)
+
+    items = family(size)
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        for i in range(0, len(items), batch):
+            kb.kb_assert_many(items[i:i + batch])
+        seconds = time.perf_counter() - start
+        stop.append(True)
+        for thread in threads:
+            thread.join()
+    return seconds, len(latencies), sum(latencies) / len(latencies), max(latencies)
+
+def main(size=1000):
+    for name, locked in [('locked', True), ('versions', False)]:
+        seconds, asks, mean, worst = run(locked, size)
+        print('{:9} write {:7.3f}s  {:6} asks  mean {:8.5f}s  worst {:8.5f}s'.format(
+            name, seconds, asks, mean, worst))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
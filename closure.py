@@ -0,0 +1,231 @@
+from collections import deque
+from logical_classes import *
+from util import *
+
+verbose = 0
+
+def transitive(rule):
+    """Recognize a transitivity rule, ((p ?x ?y) (p ?y ?z)) -> (p ?x ?z), with
+        the conditions in either order
+
+    Args:
+        rule (Rule): rule to check
+
+    Returns:
+        str|None: the predicate p, or None if it is not one
+    """
+    step = _step(rule)
+    if step is not None and step[0] == step[1] == rule.rhs.predicate:
+        return rule.rhs.predicate
+    return None
+
+def inheritance(rule):
+    """Recognize an inheritance rule, ((q ?x ?y) (p ?y ?z)) -> (q ?x ?z) with
+        q and p different, like the inst/isa rule of statements_kb.txt
+
+    Args:
+        rule (Rule): rule to check
+
+    Returns:
+        (str, str)|None: the predicates q and p, or None if it is not one
+    """
+    step = _step(rule)
+    if step is not None and step[0] == rule.rhs.predicate != step[1]:
+        return step
+    return None
+
+def _step(rule):
+    """Predicates (q, p) of a rule ((q ?x ?y) (p ?y ?z)) -> (q ?x ?z), in
+        either order of the conditions, or None
+    """
+    if len(rule.lhs) != 2 or len(rule.rhs.terms) != 2:
+        return None
+    if any(len(s.terms) != 2 or not all(is_var(t) for t in s.terms) for s in rule.lhs):
+        return None
+    x, z = [t.term.element for t in rule.rhs.terms]
+    for first, second in (rule.lhs, reversed(rule.lhs)):
+        a, y = [t.term.element for t in first.terms]
+        y2, c = [t.term.element for t in second.terms]
+        if a == x and c == z and y == y2 and len(set([x, y, z])) == 3:
+            return first.predicate, second.predicate
+    return None
+
+class ClosureIndex(object):
+    """Reachability index answering asks about lazy predicates defined by
+        transitivity and inheritance rules, without materializing the closure
+        and without backward chaining. It keeps the facts of the predicates
+        those rules mention as graphs, updated as facts are stored and
+        removed; asks walk the graphs.
+
+        A lazy predicate q is answered here when every lazy rule concluding q
+        is a transitivity rule for q or an inheritance rule from q through
+        some p, where p is either not lazy or lazy with only a transitivity
+        rule. Then q holds for (x, z) when there is a q fact (x, y) and z is
+        reachable from y through facts of q (if transitive) and the p's.
+
+    Attributes:
+        rules (dictof Rule): recognized rules
+        graphs (dictof (dict, dict)): for the index key of each predicate in
+            the rules, its facts as successor and predecessor maps, node ->
+            node -> fact
+    """
+    def __init__(self):
+        """Constructor for ClosureIndex with no rules
+        """
+        super(ClosureIndex, self).__init__()
+        self.rules = {}
+        self.graphs = {}
+        # lazy rules concluding each predicate that are not recognized
+        self._other = {}
+
+    def add_rule(self, rule, kb):
+        """Take in a lazy rule of a KB, building the graphs it needs from the
+            KB facts
+
+        Args:
+            rule (Rule): the lazy rule
+            kb (KnowledgeBase): the KB
+        """
+        step = _step(rule)
+        if step is None or step[0] != rule.rhs.predicate:
+            predicate = rule.rhs.predicate
+            self._other[predicate] = self._other.get(predicate, 0) + 1
+            return
+        self.rules[rule] = rule
+        for predicate in step:
+            key = (predicate, 2)
+            if key not in self.graphs:
+                self.graphs[key] = ({}, {})
+                for fact in kb._fact_index.get(key, ()):
+                    self.add_fact(fact)
+
+    def remove_rule(self, rule):
+        """Drop a lazy rule that was retracted
+
+        Args:
+            rule (Rule): the lazy rule
+        """
+        if self.rules.pop(rule, None) is None:
+            predicate = rule.rhs.predicate
+            if self._other.get(predicate):
+                self._other[predicate] -= 1
+            return
+        used = set()
+        for other in self.rules:
+            used.update((p, 2) for p in _step(other))
+        for key in list(self.graphs):
+            if key not in used:
+                del self.graphs[key]
+
+    def add_fact(self, fact):
+        """Add a stored fact of one of the graphs
+
+        Args:
+            fact (Fact): the fact
+        """
+        successors, predecessors = self.graphs[index_key(fact.statement)]
+        x, y = fact.statement.terms
+        successors.setdefault(x, {})[y] = fact
+        predecessors.setdefault(y, {})[x] = fact
+
+    def remove_fact(self, fact):
+        """Remove a fact of one of the graphs
+
+        Args:
+            fact (Fact): the fact
+        """
+        successors, predecessors = self.graphs[index_key(fact.statement)]
+        x, y = fact.statement.terms
+        for graph, a, b in ((successors, x, y), (predecessors, y, x)):
+            nodes = graph.get(a)
+            if nodes is not None:
+                nodes.pop(b, None)
+                if not nodes:
+                    del graph[a]
+
+    def steps(self, predicate, kb):
+        """Predicates whose facts extend a q fact (x, y) to the q facts
+            (x, z) that follow, if this index can answer asks about q
+
+        Args:
+            predicate (str): the predicate q
+            kb (KnowledgeBase): the KB
+
+        Returns:
+            listof str|None: the predicates, or None if q is not answered here
+        """
+        if predicate not in kb.lazy_predicates or self._other.get(predicate):
+            return None
+        steps = []
+        for rule in self.rules:
+            if rule.rhs.predicate != predicate:
+                continue
+            p = _step(rule)[1]
+            if p != predicate and p in kb.lazy_predicates:
+                # p must hold just for paths of its own facts
+                if self._other.get(p) or any(r.rhs.predicate == p and transitive(r) is None
+                                             for r in self.rules):
+                    return None
+            if p not in steps:
+                steps.append(p)
+        return steps if steps else None
+
+    def answer(self, statement, kb):
+        """Find the facts matching a statement about a predicate answered here
+
+        Args:
+            statement (Statement): the statement asked, possibly with variables
+            kb (KnowledgeBase): the KB
+
+        Returns:
+            listof Fact|None: KB facts or inferred Facts matching the
+                statement, or None if it is not answered here
+        """
+        if len(statement.terms) != 2:
+            return None
+        steps = self.steps(statement.predicate, kb)
+        if steps is None:
+            return None
+        printv('Answering {!r} by reachability over {}', 1, verbose, [statement, steps])
+        graphs = [self.graphs[(p, 2)] for p in steps]
+        base = self.graphs[(statement.predicate, 2)][0]
+        x, z = statement.terms
+        pairs = []
+        if not is_var(x) or is_var(z):
+            sources = [x] if not is_var(x) else list(base)
+            for source in sources:
+                for node in self._reach(list(base.get(source, ())), graphs, 0):
+                    pairs.append((source, node))
+        else:
+            # walk back from z, then take the q facts into what reaches it
+            for node in self._reach([z], graphs, 1):
+                for source in self.graphs[(statement.predicate, 2)][1].get(node, ()):
+                    pairs.append((source, z))
+
+        plan = compile_pattern(statement)
+        facts = {}
+        for source, node in pairs:
+            answer = Statement([statement.predicate, source, node])
+            if answer in facts or not plan.match(answer):
+                continue
+            fact = kb._get_fact(Fact(answer))
+            if fact is None:
+                fact = Fact(answer)
+                fact.asserted = False
+            facts[answer] = fact
+        return list(facts.values())
+
+    def _reach(self, starts, graphs, direction):
+        """Nodes reachable from starts (included) along the graphs, forwards
+            (0) or backwards (1), breadth first
+        """
+        seen = dict.fromkeys(starts)
+        queue = deque(seen)
+        while queue:
+            node = queue.popleft()
+            for graph in graphs:
+                for other in graph[direction].get(node, ()):
+                    if other not in seen:
+                        seen[other] = None
+                        queue.append(other)
+        return list(seen)
@@ -0,0 +1,317 @@
+from logical_classes import *
+from util import *
+from student_code import InferenceEngine
+
+verbose = 0
+
+class Relation(object):
+    """Facts sharing a predicate and arity, with hash indexes on the term
+        positions bound when joining, built the first time they are needed
+
+    Attributes:
+        facts (dictof Fact): the facts of this relation
+        indexes (dictof dict): for a tuple of positions, maps the terms at
+            those positions to the facts having them
+    """
+    def __init__(self):
+        """Constructor for Relation creating an empty relation
+        """
+        super(Relation, self).__init__()
+        self.facts = {}
+        self.indexes = {}
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Relation({!r})'.format(list(self.facts))
+
+    def __len__(self):
+        """Define behavior of len, the number of facts in the relation
+        """
+        return len(self.facts)
+
+    def add(self, fact):
+        """Add a fact to the relation and its indexes
+
+        Args:
+            fact (Fact): fact to add
+        """
+        self.facts[fact] = fact
+        terms = fact.statement.terms
+        for positions, index in self.indexes.items():
+            index.setdefault(tuple(terms[p] for p in positions), {})[fact] = fact
+
+    def remove(self, fact):
+        """Remove a fact from the relation and its indexes, if it is there
+
+        Args:
+            fact (Fact): fact to remove
+        """
+        if self.facts.pop(fact, None) is None:
+            return
+        terms = fact.statement.terms
+        for positions, index in self.indexes.items():
+            index.get(tuple(terms[p] for p in positions), {}).pop(fact, None)
+
+    def lookup(self, positions, key):
+        """Get the facts whose terms at positions are key
+
+        Args:
+            positions (tupleof int): positions to look at
+            key (tupleof Term): terms expected at those positions
+
+        Returns:
+            iterable of Fact: matching facts
+        """
+        if not positions:
+            return self.facts
+        index = self.indexes.get(positions)
+        if index is None:
+            index = {}
+            for fact in self.facts:
+                terms = fact.statement.terms
+                index.setdefault(tuple(terms[p] for p in positions), {})[fact] = fact
+            self.indexes[positions] = index
+        return index.get(key, ())
+
+class CompiledRule(object):
+    """A rule compiled for joining: variables are numbered slots of a binding
+        vector, and each condition knows which positions to look up in the
+        hash index of its relation and which slots it binds
+
+    Attributes:
+        rule (Rule): the rule
+        conditions (listof tuple): per LHS statement, its index key, the
+            positions looked up, how to build the lookup key (constant Terms
+            or slots), the (position, slot) pairs it binds and the
+            (position, position) pairs that must hold the same term
+        rhs (listof Term|int): RHS terms, constants or slots
+        size (int): number of slots
+    """
+    def __init__(self, rule):
+        """Constructor for CompiledRule
+
+        Args:
+            rule (Rule): rule to compile
+        """
+        super(CompiledRule, self).__init__()
+        self.rule = rule
+        self.conditions = []
+        slots = {}
+        for statement in rule.lhs:
+            positions, key, binds, checks = [], [], [], []
+            seen = {}
+            for pos, term in enumerate(statement.terms):
+                if not is_var(term):
+                    positions.append(pos)
+                    key.append(term)
+                    continue
+                name = term.term.element
+                if name in seen:
+                    checks.append((pos, seen[name]))
+                elif name in slots:
+                    positions.append(pos)
+                    key.append(slots[name])
+                else:
+                    seen[name] = pos
+                    binds.append((pos, len(slots)))
+                    slots[name] = len(slots)
+                seen.setdefault(name, pos)
+            self.conditions.append((index_key(statement), tuple(positions), key, binds, checks))
+        self.rhs = [slots.get(t.term.element, t) if is_var(t) else t for t in rule.rhs.terms]
+        self.size = len(slots)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'CompiledRule({!r})'.format(self.rule)
+
+    def instantiate(self, values):
+        """Build the RHS statement for a binding vector
+
+        Args:
+            values (list): binding vector
+
+        Returns:
+            Statement
+        """
+        return Statement([self.rule.rhs.predicate] +
+            [values[t] if isinstance(t, int) else t for t in self.rhs])
+
+    def join(self, sources, part=None):
+        """Enumerate the combinations of facts matching the LHS, taking the
+            facts for each condition from the given source
+
+        Args:
+            sources (listof (dictof Relation)): for each condition, the
+                relations to draw facts from (e.g. the old ones and the delta)
+            part ((int, int)|None): (k, n) to only enumerate the k-th of n
+                contiguous slices of the candidates for the first condition;
+                the n parts enumerate everything, in order
+
+        Yields:
+            (listof Fact, list): the matching facts and binding vector
+        """
+        values = [None] * self.size
+        matched = [None] * len(self.conditions)
+        # iterative depth-first join: stack of iterators over candidate facts
+        first = self._candidates(0, sources[0], values)
+        if part is not None:
+            first = list(first)
+            k, n = part
+            first = iter(first[len(first) * k // n:len(first) * (k + 1) // n])
+        stack = [first]
+        while stack:
+            depth = len(stack) - 1
+            fact = next(stack[-1], None)
+            if fact is None:
+                stack.pop()
+                continue
+            _, _, _, binds, checks = self.conditions[depth]
+            terms = fact.statement.terms
+            if any(terms[p] != terms[q] for p, q in checks):
+                continue
+            for pos, slot in binds:
+                values[slot] = terms[pos]
+            matched[depth] = fact
+            if depth + 1 == len(self.conditions):
+                yield list(matched), values
+            else:
+                stack.append(self._candidates(depth + 1, sources[depth + 1], values))
+
+    def _candidates(self, i, relations, values):
+        """Iterator over the facts of the relations that can match condition i
+            given the values bound so far
+        """
+        key, positions, lookup, _, _ = self.conditions[i]
+        lookup = tuple(values[k] if isinstance(k, int) else k for k in lookup)
+        def candidates():
+            for relation in relations:
+                r = relation.get(key)
+                if r is not None:
+                    for fact in list(r.lookup(positions, lookup)):
+                        yield fact
+        return candidates()
+
+class DatalogEngine(InferenceEngine):
+    """Inference engine evaluating rules bottom-up and semi-naively, as plain
+        Datalog. New facts and rules are only collected as they come off the
+        KB agenda; when it runs dry, one round joins each rule against the
+        facts with hash joins, using at least one fact new since the previous
+        round (or any facts for a new rule), so no combination of facts is
+        joined twice. What the round infers comes back through the agenda as
+        the next delta, until a fixpoint.
+
+        No rules are curried: inferred facts are supported by the facts that
+        matched the LHS plus the rule, as with rete.ReteEngine. Facts are
+        expected to be ground (free of variables).
+
+    Attributes:
+        old (dictof Relation): facts known before the current round, by index key
+        delta (dictof Relation): facts new since the last round, by index key
+        rules (dictof CompiledRule): rules already joined against all facts
+        new_rules (dictof CompiledRule): rules added since the last round
+    """
+    def __init__(self):
+        """Constructor for DatalogEngine
+        """
+        super(DatalogEngine, self).__init__()
+        self.old = {}
+        self.delta = {}
+        self.rules = {}
+        self.new_rules = {}
+
+    def infer_from_fact(self, fact, kb):
+        """Add a new fact to the delta of the next round
+
+        Args:
+            fact (Fact) - A new fact in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        self.delta.setdefault(index_key(fact.statement), Relation()).add(fact)
+
+    def infer_from_rule(self, rule, kb):
+        """Compile a new rule, to be joined against all facts next round
+
+        Args:
+            rule (Rule) - A new rule in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        self.new_rules[rule] = CompiledRule(rule)
+
+    def forget(self, fact_rule, kb):
+        """Drop a retracted fact or rule
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that was removed
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if isinstance(fact_rule, Rule):
+            self.rules.pop(fact_rule, None)
+            self.new_rules.pop(fact_rule, None)
+            return
+        key = index_key(fact_rule.statement)
+        for relations in (self.old, self.delta):
+            if key in relations:
+                relations[key].remove(fact_rule)
+
+    def restore(self, kb):
+        """Take the facts and rules of a KB whose facts were all inferred
+        already as joined, so only what changes later is evaluated
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        for fact in kb.facts:
+            self.old.setdefault(index_key(fact.statement), Relation()).add(fact)
+        for rule in kb.rules:
+            self.rules[rule] = CompiledRule(rule)
+
+    def recall(self, fact_rule, kb):
+        """Take back a fact or rule that is in the KB again as joined
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that is back
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if isinstance(fact_rule, Rule):
+            self.rules[fact_rule] = CompiledRule(fact_rule)
+        else:
+            self.old.setdefault(index_key(fact_rule.statement), Relation()).add(fact_rule)
+
+    def saturate(self, kb):
+        """Run one semi-naive round and assert what it infers
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if not self.delta and not self.new_rules:
+            return
+        delta, self.delta = self.delta, {}
+        new_rules, self.new_rules = self.new_rules, {}
+        printv('Semi-naive round: {} new facts, {} new rules', 1, verbose,
+            [sum(len(r) for r in delta.values()), len(new_rules)])
+
+        inferred = []
+        for compiled in self.rules.values():
+            n = len(compiled.conditions)
+            for i in range(n):
+                # the i-th condition is the first one matched by a new fact
+                if compiled.conditions[i][0] not in delta:
+                    continue
+                sources = [(self.old,)] * i + [(delta,)] + [(self.old, delta)] * (n - i - 1)
+                for facts, values in compiled.join(sources):
+                    inferred.append((compiled.instantiate(values), facts, compiled.rule))
+        for compiled in new_rules.values():
+            sources = [(self.old, delta)] * len(compiled.conditions)
+            for facts, values in compiled.join(sources):
+                inferred.append((compiled.instantiate(values), facts, compiled.rule))
+
+        for key, relation in delta.items():
+            old = self.old.setdefault(key, Relation())
+            for fact in relation.facts:
+                old.add(fact)
+        self.rules.update(new_rules)
+
+        for statement, facts, rule in inferred:
+            self.derive(statement, facts, rule, kb)
@@ -1,5 +1,70 @@
+import threading, weakref
 from util import is_var
 
+class SymbolTable(object):
+    """Interns the strings used as predicates, constants and variable names,
+        giving each a small integer id
+
+    Attributes:
+        ids (dictof int): id of each interned string
+        names (listof str): interned string of each id
+    """
+    __slots__ = ('ids', 'names')
+
+    def __init__(self):
+        """Constructor for SymbolTable creating an empty table
+        """
+        self.ids = {}
+        self.names = []
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'SymbolTable({} symbols)'.format(len(self.names))
+
+    def __len__(self):
+        """Define behavior of len, the number of interned strings
+        """
+        return len(self.names)
+
+    def intern(self, name):
+        """Get the id of a string, interning it if needed
+
+        Args:
+            name (str): string to intern
+
+        Returns:
+            int: id of the string
+        """
+        i = self.ids.get(name)
+        if i is None:
+            with _interning:
+                i = self.ids.get(name)
+                if i is None:
+                    i = self.ids[name] = len(self.names)
+                    self.names.append(name)
+        return i
+
+    def lookup(self, i):
+        """Get the string with the given id
+
+        Args:
+            i (int): id of the string
+
+        Returns:
+            str
+        """
+        return self.names[i]
+
+# process-wide symbol table, and canonical instances of the logical classes.
+# Lookups take no lock; making a new instance holds _interning, so threads
+# (e.g. readers of mvcc versions parsing their asks) agree on one instance
+_interning = threading.RLock()
+symbols = SymbolTable()
+_statements = weakref.WeakValueDictionary()
+_variables = {}
+_constants = {}
+
 class Fact(object):
     """Represents a fact in our knowledge base. Has a statement containing the
         content of the fact, e.g. (isa Sorceress Wizard) and fields tracking
@@ -15,6 +80,9 @@ class Fact(object):
         supports_facts (listof Fact): Facts that this fact supports
         supports_rules (listof Rule): Rules that this fact supports
     """
+    __slots__ = ('statement', 'asserted', 'supported_by', 'supports_facts', 'supports_rules')
+    name = "fact"
+
     def __init__(self, statement, supported_by=[]):
         """Constructor for Fact setting up useful flags and generating appropriate statement
 
@@ -25,7 +93,6 @@ class Fact(object):
                 the statement
         """
         super(Fact, self).__init__()
-        self.name = "fact"
         self.statement = statement if isinstance(statement, Statement) else Statement(statement)
         self.asserted = not supported_by
         #self.supported_by = supported_by
@@ -73,6 +140,11 @@ class Fact(object):
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return hash(self.statement)
+
 class Rule(object):
     """Represents a rule in our knowledge base. Has a list of statements (the LHS)
         containing the statements that need to be in our KB for us to infer the
@@ -81,7 +153,7 @@ class Rule(object):
 
     Attributes:
         name (str): 'rule', the name of this class
-        lhs (listof Statement): LHS statements of this rule
+        lhs (tupleof Statement): LHS statements of this rule
         rhs (Statement): RHS statment of this rule
         asserted (bool): boolean flag indicating if rule was asserted instead of
             inferred from other rules/facts in the KB
@@ -90,6 +162,9 @@ class Rule(object):
         supports_facts (listof Fact): Facts that this rule supports
         supports_rules (listof Rule): Rules that this rule supports
     """
+    __slots__ = ('lhs', 'rhs', 'asserted', 'supported_by', 'supports_facts', 'supports_rules')
+    name = "rule"
+
     def __init__(self, rule, supported_by=[]):
         """Constructor for Rule setting up useful flags and generating appropriate LHS & RHS
 
@@ -100,8 +175,7 @@ class Rule(object):
                 the statement
         """
         super(Rule, self).__init__()
-        self.name = "rule"
-        self.lhs = [statement if isinstance(statement, Statement) else Statement(statement) for statement in rule[0]]
+        self.lhs = tuple(statement if isinstance(statement, Statement) else Statement(statement) for statement in rule[0])
         self.rhs = rule[1] if isinstance(rule[1], Statement) else Statement(rule[1])
         self.asserted = not supported_by
         self.supported_by = []
@@ -152,17 +226,28 @@ class Rule(object):
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return hash((self.lhs, self.rhs))
+
 class Statement(object):
     """Represents a statement in our knowledge base, e.g. (attacked Ai Nosliw),
         (diamonds Loot), (isa Sorceress Wizard), etc. These statements show up
-        in Facts or on the LHS and RHS of Rules
+        in Facts or on the LHS and RHS of Rules. Statements are immutable and
+        hash-consed: building a statement equal to an existing one returns the
+        existing (canonical) instance.
 
     Attributes:
-        terms (listof Term): List of terms (Variable or Constant) in the
+        terms (tupleof Term): Terms (Variable or Constant) in the
             statement, e.g. 'Nosliw' or '?d'
         predicate (str): The predicate of the statement, e.g. isa, hero, needs
+        key (tupleof int): symbol ids of the predicate and terms, identifying
+            the statement
     """
-    def __init__(self, statement_list=[]):
+    __slots__ = ('predicate', 'terms', 'key', '_hash', '__weakref__')
+
+    def __new__(cls, statement_list=[]):
         """Constructor for Statements with optional list of Statements that are
             converted to appropriate terms (and one predicate)
 
@@ -171,19 +256,44 @@ class Statement(object):
                 index 0 is the predicate of the statement (a str) while the rest of
                 the list is either instantiated Terms or strings to be passed to the
                 Term constructor
-        """
-        super(Statement, self).__init__()
-        self.terms = []
-        self.predicate = ""
 
+        Returns:
+            Statement: the canonical statement for the given predicate and terms
+        """
+        predicate = ""
+        terms = ()
         if statement_list:
-            self.predicate = statement_list[0]
-            self.terms = [t if isinstance(t, Term) else Term(t) for t in statement_list[1:]]
+            predicate = statement_list[0]
+            terms = tuple([t if t.__class__ is Term else Term(t) for t in statement_list[1:]])
+
+        key = (symbols.intern(predicate),) + tuple([t.term.id for t in terms])
+        self = _statements.get(key)
+        if self is None:
+            with _interning:
+                self = _statements.get(key)
+                if self is None:
+                    self = super(Statement, cls).__new__(cls)
+                    object.__setattr__(self, 'predicate', symbols.lookup(key[0]))
+                    object.__setattr__(self, 'terms', terms)
+                    object.__setattr__(self, 'key', key)
+                    object.__setattr__(self, '_hash', hash(key))
+                    _statements[key] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Statements are shared between facts and rules, so they can't change
+        """
+        raise AttributeError("Statement is immutable")
+
+    def __reduce__(self):
+        """Copy and pickle statements through the constructor so they stay canonical
+        """
+        return (Statement, ([self.predicate] + list(self.terms),))
 
     def __repr__(self):
         """Define internal string representation
         """
-        return 'Statement({!r}, {!r})'.format(self.predicate, self.terms)
+        return 'Statement({!r}, {!r})'.format(self.predicate, list(self.terms))
 
     def __str__(self):
         """Define external representation when printed
@@ -193,38 +303,65 @@ class Statement(object):
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        if self.predicate != other.predicate:
-            return False
-
-        for self_term, other_term in zip(self.terms, other.terms):
-            if self_term != other_term:
-                return False
-
-        return True
+        return self is other or isinstance(other, Statement) and self.key == other.key
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return self._hash
+
 class Term(object):
     """Represents a term (a Variable or Constant) in our knowledge base. Can
         sorta be thought of as a super class of Variable and Constant, though
         there is no inheritance implemented in the code.
 
+        Like statements, terms are immutable and interned.
+
     Attributes:
         term (Variable|Constant): The Variable or Constant that this term holds (represents)
     """
-    def __init__(self, term):
+    __slots__ = ('term',)
+
+    def __new__(cls, term):
         """Constructor for Term which converts term to appropriate form
 
         Args:
             term (Variable|Constant|string): Either an instantiated Variable or
                 Constant, or a string to be passed to the appropriate constructor
-        """
-        super(Term, self).__init__()
-        is_var_or_const = isinstance(term, Variable) or isinstance(term, Constant)
-        self.term = term if is_var_or_const else (Variable(term) if is_var(term) else Constant(term))
+
+        Returns:
+            Term: the canonical term for the Variable or Constant
+        """
+        if term.__class__ is str:
+            # most terms come from parsing, and most of those were seen before
+            term = (_constants.get(term) or _variables.get(term)
+                    or (Variable(term) if is_var(term) else Constant(term)))
+        elif not (isinstance(term, Variable) or isinstance(term, Constant)):
+            term = Variable(term) if is_var(term) else Constant(term)
+        self = term._term
+        if self is None:
+            with _interning:
+                self = term._term
+                if self is None:
+                    self = super(Term, cls).__new__(cls)
+                    object.__setattr__(self, 'term', term)
+                    object.__setattr__(term, '_term', self)
+        return self
+
+    def __setattr__(self, name, value):
+        """Terms are shared between statements, so they can't change
+        """
+        raise AttributeError("Term is immutable")
+
+    def __reduce__(self):
+        """Copy and pickle terms through the constructor so they stay canonical
+        """
+        return (Term, (self.term,))
 
     def __repr__(self):
         """Define internal string representation
@@ -249,20 +386,53 @@ class Term(object):
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return hash(self.term.element)
+
 class Variable(object):
     """Represents a variable used in statements
 
+        Variables and constants are immutable and interned.
+
     Attributes:
         element (str): The name of the variable, e.g. '?x'
+        id (int): symbol id of the element
     """
-    def __init__(self, element):
+    __slots__ = ('element', 'id', '_term')
+
+    def __new__(cls, element):
         """Constructor for Variable
 
         Args:
             element (str): The name of the variable, e.g. '?x'
+
+        Returns:
+            Variable: the canonical variable for the element
         """
-        super(Variable, self).__init__()
-        self.element = element
+        self = _variables.get(element)
+        if self is None:
+            with _interning:
+                self = _variables.get(element)
+                if self is None:
+                    self = super(Variable, cls).__new__(cls)
+                    i = symbols.intern(element)
+                    object.__setattr__(self, 'element', symbols.lookup(i))
+                    object.__setattr__(self, 'id', i)
+                    object.__setattr__(self, '_term', None)
+                    _variables[element] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Variables are shared between terms, so they can't change
+        """
+        raise AttributeError("Variable is immutable")
+
+    def __reduce__(self):
+        """Copy and pickle through the constructor so the variable stays canonical
+        """
+        return (Variable, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -278,29 +448,62 @@ class Variable(object):
         """Define behavior of == when applied to this object
         """
         return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
+            or isinstance(other, Term) and self.element == other.term.element
             or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+                and self.element == other.element))
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return hash(self.element)
+
 class Constant(object):
     """Represents a constant used in statements
 
+        Variables and constants are immutable and interned.
+
     Attributes:
         element (str): The value of the constant, e.g. 'Nosliw'
+        id (int): symbol id of the element
     """
-    def __init__(self, element):
+    __slots__ = ('element', 'id', '_term')
+
+    def __new__(cls, element):
         """Constructor for Constant
 
         Args:
             element (str): The value of the constant, e.g. 'Nosliw'
+
+        Returns:
+            Constant: the canonical constant for the element
+        """
+        self = _constants.get(element)
+        if self is None:
+            with _interning:
+                self = _constants.get(element)
+                if self is None:
+                    self = super(Constant, cls).__new__(cls)
+                    i = symbols.intern(element)
+                    object.__setattr__(self, 'element', symbols.lookup(i))
+                    object.__setattr__(self, 'id', i)
+                    object.__setattr__(self, '_term', None)
+                    _constants[element] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Constants are shared between terms, so they can't change
+        """
+        raise AttributeError("Constant is immutable")
+
+    def __reduce__(self):
+        """Copy and pickle through the constructor so the constant stays canonical
         """
-        super(Constant, self).__init__()
-        self.element = element
+        return (Constant, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -316,15 +519,20 @@ class Constant(object):
         """Define behavior of == when applied to this object
         """
         return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
+            or isinstance(other, Term) and self.element == other.term.element
             or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+                and self.element == other.element))
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
         return not self == other
 
+    def __hash__(self):
+        """Define hash of this object, consistent with ==
+        """
+        return hash(self.element)
+
 class Binding(object):
     """Represents a binding of a constant to a variable, e.g. 'Nosliw' might be
         bound to'?d'
@@ -333,6 +541,8 @@ class Binding(object):
         variable (Variable): The name of the variable associated with this binding
         constant (Constant): The value of the variable
     """
+    __slots__ = ('variable', 'constant')
+
     def __init__(self, variable, constant):
         """Constructor for Binding
 
@@ -363,6 +573,8 @@ class Bindings(object):
             bound variable and value is bound value,
             e.g. some_bindings.bindings_dict['?d'] => 'Nosliw'
     """
+    __slots__ = ('bindings', 'bindings_dict')
+
     def __init__(self):
         """Constructor for Bindings creating initially empty instance
         """
@@ -409,10 +621,11 @@ class Bindings(object):
         Returns:
             Variable|Constant|False: returns bound term if variable is bound else False
         """
-        if variable.element in self.bindings_dict.keys():
-            value = self.bindings_dict[variable.element]
-            if value:
-                return Variable(value) if is_var(value) else Constant(value)
+        value = self.bindings_dict.get(variable.element)
+        if value:
+            # interned, so this is a lookup rather than a new instance
+            return (_variables.get(value) or _constants.get(value)
+                    or (Variable(value) if is_var(value) else Constant(value)))
 
         return False
 
@@ -443,6 +656,8 @@ class ListOfBindings(object):
         Attributes:
             list_of_bindings (listof Bindings): collects Bindings
     """
+    __slots__ = ('list_of_bindings',)
+
     def __init__(self):
         """Constructor for ListOfBindings
         """
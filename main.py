@@ -1,7 +1,15 @@
 import unittest
+import os, tempfile, io, contextlib
 import read, copy
 from logical_classes import *
-from student_code import KnowledgeBase
+from student_code import KnowledgeBase, FIFO, LIFO
+from rete import ReteEngine
+from datalog import DatalogEngine
+from parallel import ParallelDatalogEngine
+from tokens import TokenEngine
+import snapshot, query, closure
+from metrics import Metrics
+from tms import SupportCounting, DRed
 from util import * 
 
 class KBTest(unittest.TestCase):
@@ -235,8 +243,9 @@ class KBTest(unittest.TestCase):
         self.assertEqual(str(answer[0]), "?Y : ada")
         r2 = read.parse_input("fact: (kindto ada chen)")
         self.KB.kb_retract(r2)
+        # nothing supports (cooksfor ada chen) any more
         answer = self.KB.kb_ask(ask1)
-        self.assertEqual(str(answer[0]), "?Y : ada")
+        self.assertFalse(answer)
 
 
     # def test6(self):
@@ -329,6 +338,920 @@ class KBTest(unittest.TestCase):
     #     self.assertEqual(str(answer[0]), "?X : profHammond")
 
 
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        file = 'statements_kb4.txt'
+        self.KB = KnowledgeBase([], [])
+        for item in read.read_tokenize(file):
+            self.KB.kb_assert(item)
+
+    def test_index_matches_facts(self):
+        # every fact is indexed under its predicate and arity, and nothing else is
+        r1 = read.parse_input("fact: (motherof ada bing)")
+        self.KB.kb_retract(r1)
+        indexed = [f for bucket in self.KB._fact_index.values() for f in bucket]
+        self.assertEqual(len(indexed), len(self.KB.facts))
+        for fact in self.KB.facts:
+            self.assertIn(fact, self.KB._facts_for(fact.statement))
+        ask1 = read.parse_input("fact: (parentof ?X ?Y)")
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(len(answer), 3)
+        ask2 = read.parse_input("fact: (parentof ?X)")
+        self.assertFalse(self.KB.kb_ask(ask2))
+
+
+class StatementTest(unittest.TestCase):
+
+    def test_statements_are_interned(self):
+        s1 = read.parse_input("fact: (isa cube block)").statement
+        s2 = Statement(["isa", "cube", "block"])
+        self.assertIs(s1, s2)
+        self.assertIs(copy.deepcopy(s1), s1)
+        self.assertNotEqual(s1, Statement(["isa", "cube"]))
+        self.assertEqual(len({Fact(s1), Fact(s2)}), 1)
+        with self.assertRaises(AttributeError):
+            s1.predicate = "inst"
+
+    def test_compact_terms(self):
+        s1 = Statement(["isa", "cube", "?x"])
+        self.assertIs(s1.terms[0], Term("cube"))
+        self.assertIs(s1.terms[0].term, Constant("cube"))
+        self.assertIs(s1.terms[1].term, Variable("?x"))
+        self.assertEqual(s1.key, (symbols.intern("isa"), Constant("cube").id, Variable("?x").id))
+        self.assertEqual(symbols.lookup(s1.key[0]), "isa")
+        for obj in (s1, s1.terms[0], Fact(s1), read.parse_input("rule: ((a ?x)) -> (b ?x)")):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(Fact(s1).name, "fact")
+
+    def test_repeated_variable(self):
+        # binding the same variable twice compares the bound constants
+        rule = read.parse_input("rule: ((likes ?x ?x)) -> (narcissist ?x)")
+        self.assertTrue(match(rule.lhs[0], Statement(["likes", "a", "a"])))
+        self.assertFalse(match(rule.lhs[0], Statement(["likes", "a", "b"])))
+
+    def test_match_plan(self):
+        # compiled plans agree with match, including non-ground statements
+        pattern = Statement(["rel", "?x", "c", "?x", "?y"])
+        plan = compile_pattern(pattern)
+        self.assertIs(compile_pattern(pattern), plan)
+        for terms in (["a", "c", "a", "b"], ["a", "c", "b", "b"], ["a", "d", "a", "b"],
+                      ["?z", "c", "a", "b"], ["a", "?z", "a", "?z"], ["a", "c", "a"]):
+            statement = Statement(["rel"] + terms)
+            expected = match(pattern, statement)
+            self.assertEqual(str(plan.match(statement)), str(expected))
+            self.assertEqual(bool(plan.match(statement)), bool(expected))
+        bindings = plan.match(Statement(["rel", "a", "c", "a", "b"]))
+        self.assertIs(bindings.bound_to(Variable("?x")), Constant("a"))
+        self.assertIs(instantiate(pattern, bindings), Statement(["rel", "a", "c", "a", "b"]))
+        ground = Statement(["rel", "a"])
+        self.assertIs(instantiate(ground, bindings), ground)
+
+    def test_match_plan_freed(self):
+        # the cached plan does not keep its statement alive
+        import weakref
+        statement = Statement(["unusedpredicate", "?x", "b"])
+        compile_pattern(statement).match(Statement(["unusedpredicate", "a", "b"]))
+        ref = weakref.ref(statement)
+        del statement
+        self.assertIsNone(ref())
+
+
+class ReteTest(unittest.TestCase):
+
+    def setUp(self):
+        file = 'statements_kb4.txt'
+        self.KB = KnowledgeBase([], [], engine=ReteEngine())
+        for item in read.read_tokenize(file):
+            self.KB.kb_assert(item)
+
+    def test_infer(self):
+        # same facts as the curried engine, without growing the rule list
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(str(answer[0]), "?X : felix")
+        self.assertEqual(str(answer[1]), "?X : chen")
+        self.assertEqual(len(self.KB.rules), 5)
+        fact = self.KB._get_fact(read.parse_input("fact: (grandmotherof ada chen)"))
+        self.assertEqual(len(fact.supported_by[0]), 3)
+
+    def test_retract(self):
+        r1 = read.parse_input("fact: (motherof ada bing)")
+        self.KB.kb_retract(r1)
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(len(answer), 1)
+        self.assertEqual(str(answer[0]), "?X : felix")
+        self.assertFalse(self.KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)")))
+        self.KB.kb_assert(r1)
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(len(answer), 2)
+
+    def test_retract_rules(self):
+        engine = self.KB.ie
+        sizes = (len(engine.alpha_nodes), len(engine.join_nodes), len(engine._token_index))
+        rule = read.parse_input("rule: ((motherof ?x ?y) (sisters ?y ?z) (fairyof ?z ?w)) -> (odd ?x ?w)")
+        self.KB.kb_assert(rule)
+        self.assertGreater(len(engine.join_nodes), sizes[1])
+        self.KB.kb_retract(rule)
+        # nodes shared with the other rules stay, the others go
+        self.assertEqual((len(engine.alpha_nodes), len(engine.join_nodes), len(engine._token_index)), sizes)
+        for rule in list(self.KB.rules):
+            self.KB.kb_retract(rule)
+        self.assertEqual((engine.alpha_nodes, engine.join_nodes, engine._alpha_index, engine._token_index),
+                         ({}, {}, {}, {}))
+
+
+class TokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [], engine=TokenEngine())
+        for item in read.read_tokenize('statements_kb4.txt'):
+            self.KB.kb_assert(item)
+
+    def test_infer(self):
+        # same facts as the curried engine, with no curried rules
+        KB = KnowledgeBase([], [])
+        KB.load('statements_kb4.txt')
+        self.assertEqual(set(KB.facts), set(self.KB.facts))
+        self.assertEqual(len(self.KB.rules), 5)
+        fact = self.KB._get_fact(read.parse_input("fact: (grandmotherof ada chen)"))
+        self.assertEqual(len(fact.supported_by[0]), 3)
+
+    def test_retract(self):
+        r1 = read.parse_input("fact: (motherof ada bing)")
+        self.KB.kb_retract(r1)
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        answer = self.KB.kb_ask(ask1)
+        self.assertEqual(len(answer), 1)
+        self.assertEqual(str(answer[0]), "?X : felix")
+        self.assertFalse(self.KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)")))
+        for memory in self.KB.ie.memories.values():
+            for level in memory.levels:
+                for tokens in level.values():
+                    for _, facts in tokens:
+                        self.assertNotIn(r1, facts)
+        self.KB.kb_assert(r1)
+        self.assertEqual(len(self.KB.kb_ask(ask1)), 2)
+
+    def test_retract_rules(self):
+        engine = self.KB.ie
+        for rule in list(self.KB.rules):
+            self.KB.kb_retract(rule)
+        self.assertEqual((engine.memories, engine._conditions, engine._token_index), ({}, {}, {}))
+
+
+class TmsTest(unittest.TestCase):
+
+    def cycle(self, tms):
+        KB = KnowledgeBase([], [], tms=tms)
+        KB.kb_assert(read.parse_input("rule: ((isa ?x ?y) (isa ?y ?z)) -> (isa ?x ?z)"))
+        KB.kb_assert(read.parse_input("fact: (isa a b)"))
+        KB.kb_assert(read.parse_input("fact: (isa b a)"))
+        KB.kb_retract(read.parse_input("fact: (isa a b)"))
+        return KB
+
+    def test_counting_keeps_cycles(self):
+        KB = self.cycle(None)
+        self.assertIn(read.parse_input("fact: (isa a b)"), KB.facts)
+
+    def test_dred(self):
+        KB = self.cycle(DRed())
+        self.assertEqual([str(f.statement) for f in KB.facts], ["(isa b a)"])
+        self.assertEqual(len(KB.rules), 2)
+
+    def test_dred_rederives(self):
+        KB = KnowledgeBase([], [], tms=DRed())
+        for item in read.read_tokenize('statements_kb4.txt'):
+            KB.kb_assert(item)
+        KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertTrue(KB.kb_ask(read.parse_input("fact: (cooksfor ada chen)")))
+        self.assertEqual(len(KB.kb_ask(read.parse_input("fact: (grandmotherof ada ?X)"))), 1)
+        self.assertFalse(KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)")))
+
+
+class AgendaTest(unittest.TestCase):
+
+    def test_deep_chain(self):
+        # derivation chains longer than the recursion limit
+        for strategy in (FIFO, LIFO):
+            KB = KnowledgeBase([], [], strategy=strategy)
+            for i in range(2000):
+                KB.kb_assert(read.parse_input("rule: ((s%d ?x)) -> (s%d ?x)" % (i, i + 1)))
+            KB.kb_assert(read.parse_input("fact: (s0 a)"))
+            self.assertEqual(len(KB.facts), 2001)
+            answer = KB.kb_ask(read.parse_input("fact: (s2000 ?X)"))
+            self.assertEqual(str(answer[0]), "?X : a")
+
+
+class RetractTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [])
+        for item in read.read_tokenize('statements_kb4.txt'):
+            self.KB.kb_assert(item)
+
+    def test_curried_rules_cascade(self):
+        # facts inferred through curried rules go with the fact they came from
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertFalse(self.KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)")))
+        for rule in self.KB.rules:
+            for pair in rule.supported_by:
+                for fact_rule in pair:
+                    self.assertTrue(self.KB._contains(fact_rule))
+
+    def test_retract_rule(self):
+        rule = read.parse_input("rule: ((kindto ?x ?y)) -> (cooksfor ?x ?y)")
+        ask1 = read.parse_input("fact: (cooksfor ?X chen)")
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertTrue(self.KB.kb_ask(ask1))
+        self.KB.kb_retract(rule)
+        self.assertNotIn(rule, self.KB.rules)
+        self.assertFalse(self.KB.kb_ask(ask1))
+        self.KB.kb_assert(rule)
+        self.assertTrue(self.KB.kb_ask(ask1))
+
+    def test_supported_fact_stays(self):
+        # an asserted fact that is also inferred stays, but only as inferred
+        fact = read.parse_input("fact: (cooksfor ada chen)")
+        self.KB.kb_assert(fact)
+        self.KB.kb_retract(fact)
+        self.assertFalse(self.KB.facts[fact].asserted)
+        self.KB.kb_retract(read.parse_input("fact: (kindto ada chen)"))
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertNotIn(fact, self.KB.facts)
+
+    def test_retract_then_reassert(self):
+        # the very same instances, retracted and asserted again, are asserted
+        KB = KnowledgeBase([], [])
+        rule = read.parse_input("rule: ((a ?x)) -> (b ?x)")
+        b = read.parse_input("fact: (b c)")
+        a = read.parse_input("fact: (a c)")
+        KB.kb_assert(rule)
+        KB.kb_assert(a)
+        KB.kb_retract(rule)
+        KB.kb_assert(rule)
+        self.assertTrue(KB.rules[rule].asserted)
+        KB.kb_retract(a)
+        KB.kb_assert(b)
+        KB.kb_retract(b)
+        KB.kb_assert(b)
+        self.assertTrue(KB.facts[b].asserted)
+        KB.kb_assert(a)
+        KB.kb_retract(a)
+        self.assertIn(b, KB.facts)
+        self.assertEqual(KB.facts[b].supported_by, [])
+
+    def test_deep_chain(self):
+        KB = KnowledgeBase([], [])
+        for i in range(2000):
+            KB.kb_assert(read.parse_input("rule: ((s%d ?x)) -> (s%d ?x)" % (i, i + 1)))
+        KB.kb_assert(read.parse_input("fact: (s0 a)"))
+        KB.kb_retract(read.parse_input("fact: (s0 a)"))
+        self.assertEqual(len(KB.facts), 0)
+        self.assertEqual(len(KB.rules), 2000)
+
+
+class BulkTest(unittest.TestCase):
+
+    def test_load_matches_incremental(self):
+        for file in ('statements_kb2.txt', 'statements_kb4.txt'):
+            KB1 = KnowledgeBase([], [])
+            for item in read.read_tokenize(file):
+                KB1.kb_assert(item)
+            KB2 = KnowledgeBase([], [])
+            KB2.load(file)
+            self.assertEqual(set(KB1.facts), set(KB2.facts))
+            self.assertEqual(set(KB1.rules), set(KB2.rules))
+            for fact in KB1.facts:
+                self.assertEqual(len(fact.supported_by), len(KB2.facts[fact].supported_by))
+                self.assertEqual(set(fact.supports_facts), set(KB2.facts[fact].supports_facts))
+
+    def test_retract_many_matches_incremental(self):
+        for file in ('statements_kb2.txt', 'statements_kb4.txt'):
+            KB1 = KnowledgeBase([], [])
+            KB1.load(file)
+            KB2 = KnowledgeBase([], [])
+            KB2.load(file)
+            items = [item for item in read.read_tokenize(file) if isinstance(item, Fact)][::2]
+            for item in items:
+                KB1.kb_retract(item)
+            KB2.kb_retract_many(items)
+            self.assertEqual(set(KB1.facts), set(KB2.facts))
+            self.assertEqual(set(KB1.rules), set(KB2.rules))
+            for fact in KB1.facts:
+                self.assertEqual(len(fact.supported_by), len(KB2.facts[fact].supported_by))
+
+
+class TransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [])
+        self.KB.load('statements_kb4.txt')
+
+    def summary(self):
+        return sorted((str(x), x.asserted, len(x.supported_by))
+                      for x in list(self.KB.facts) + list(self.KB.rules))
+
+    def test_rollback(self):
+        before = self.summary()
+        self.KB.begin()
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.KB.kb_assert(read.parse_input("fact: (sisters ada eve)"))
+        self.KB.kb_assert(read.parse_input("fact: (cooksfor ada chen)"))
+        self.assertEqual(len(self.KB.kb_ask(read.parse_input("fact: (grandmotherof ada ?X)"))), 1)
+        self.KB.rollback()
+        self.assertEqual(self.summary(), before)
+        self.assertEqual(len(self.KB.kb_ask(read.parse_input("fact: (grandmotherof ada ?X)"))), 2)
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertFalse(self.KB.kb_ask(read.parse_input("fact: (auntof ?X ?Y)")))
+        self.assertRaises(ValueError, self.KB.rollback)
+
+    def test_nested(self):
+        before = self.summary()
+        self.KB.begin()
+        self.KB.kb_assert(read.parse_input("fact: (sisters ada eve)"))
+        middle = self.summary()
+        self.KB.begin()
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.KB.rollback()
+        self.assertEqual(self.summary(), middle)
+        self.KB.begin()
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.KB.commit()
+        self.KB.rollback()
+        self.assertEqual(self.summary(), before)
+
+    def test_engine_recalls(self):
+        for engine in (ReteEngine(), TokenEngine(), DatalogEngine()):
+            KB = KnowledgeBase([], [], engine=engine)
+            KB.load('statements_kb4.txt')
+            KB.begin()
+            KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+            KB.rollback()
+            KB.kb_assert(read.parse_input("fact: (sisters ada eve)"))
+            self.assertTrue(KB.kb_ask(read.parse_input("fact: (auntof eve ?X)")))
+
+
+class VersionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [], versioned=True)
+        self.KB.load('statements_kb4.txt')
+        self.ask = read.parse_input("fact: (grandmotherof ada ?X)")
+
+    def test_versions_do_not_change(self):
+        version = self.KB.versions.current
+        self.assertEqual(len(version.kb_ask(self.ask)), 2)
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertEqual(len(version.kb_ask(self.ask)), 2)
+        self.assertEqual(len(self.KB.versions.current.kb_ask(self.ask)), 1)
+        self.assertGreater(self.KB.versions.current.number, version.number)
+
+    def test_buckets_shared(self):
+        ask = read.parse_input("fact: (motherof ?X ?Y)")
+        version = self.KB.versions.current
+        self.KB.kb_assert(read.parse_input("fact: (motherof eve fay)"))
+        current = self.KB.versions.current
+        key = index_key(ask.statement)
+        # appending shares the list, and the old version still sees its facts
+        self.assertIs(current.index[key].facts, version.index[key].facts)
+        self.assertEqual(len(current.kb_ask(ask)), len(version.kb_ask(ask)) + 1)
+        self.KB.kb_retract(read.parse_input("fact: (motherof eve fay)"))
+        self.assertEqual(len(self.KB.versions.current.kb_ask(ask)), len(version.kb_ask(ask)))
+        self.assertEqual(len(current.kb_ask(ask)), len(version.kb_ask(ask)) + 1)
+
+    def test_invalid_ask(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            rule = read.parse_input("rule: ((motherof ?x ?y)) -> (parentof ?x ?y)")
+            self.assertIs(self.KB.versions.current.kb_ask(rule), False)
+            self.assertIs(self.KB.kb_ask(rule), False)
+
+    def test_interning_from_threads(self):
+        import threading
+        made = []
+        def make():
+            made.append(Statement(['freshpredicate', 'freshconstant', '?freshvar']))
+        threads = [threading.Thread(target=make) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for statement in made:
+            self.assertIs(statement, made[0])
+
+    def test_transactions_publish_on_commit(self):
+        version = self.KB.versions.current
+        self.KB.begin()
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertIs(self.KB.versions.current, version)
+        self.KB.commit()
+        self.assertEqual(len(self.KB.versions.current.kb_ask(self.ask)), 1)
+
+    def test_concurrent_readers(self):
+        import threading
+        stop, counts = [], []
+        def read_versions():
+            while not stop:
+                version = self.KB.versions.current
+                mothers = version.kb_ask(read.parse_input("fact: (motherof ?X ?Y)")) or []
+                parents = version.kb_ask(read.parse_input("fact: (parentof ?X ?Y)")) or []
+                counts.append((len(mothers), len(parents)))
+        readers = [threading.Thread(target=read_versions) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        for i in range(50):
+            self.KB.kb_assert(read.parse_input("fact: (motherof m%d m%d)" % (i, i + 1)))
+        stop.append(True)
+        for reader in readers:
+            reader.join()
+        # readers only ever see versions with inference done
+        for mothers, parents in counts:
+            self.assertEqual(mothers, parents)
+
+
+class ServerTest(unittest.TestCase):
+
+    def test_clients(self):
+        import asyncio
+        from server import KBServer, Client
+
+        async def run():
+            server = KBServer()
+            listening = await server.start()
+            port = listening.sockets[0].getsockname()[1]
+            clients = [await Client.connect(port=port) for _ in range(4)]
+            first = clients[0]
+            self.assertEqual(await first.request("assert rule: ((isa ?x ?y)) -> (inst ?x ?y)"), "ok")
+
+            async def work(client, k):
+                for i in range(10):
+                    response = await client.request("assert fact: (isa c%d c%d)" % (k, i))
+                    self.assertEqual(response, "ok")
+                return await client.request("ask fact: (inst c%d ?X)" % k)
+            answers = await asyncio.gather(*[work(c, k) for k, c in enumerate(clients)])
+            for answer in answers:
+                self.assertTrue(answer.startswith("yes ?X : "))
+                self.assertEqual(len(answer.split(" | ")), 10)
+
+            self.assertEqual(await first.request("retract fact: (isa c0 c0)"), "ok")
+            self.assertEqual(await first.request("ask fact: (inst c0 c0)"), "no")
+            self.assertEqual(await first.request("ask fact: (inst c0 c1)"), "yes")
+            self.assertTrue((await first.request("frob")).startswith("error"))
+            self.assertTrue((await first.request("stats")).startswith("ask n=6 "))
+            # concurrent asserts were applied together
+            self.assertLess(server.batches, server.changes)
+            for client in clients:
+                await client.close()
+            await server.close()
+        asyncio.run(run())
+
+    def test_failed_run(self):
+        import asyncio
+        from server import KBServer
+
+        async def run():
+            server = KBServer()
+            await server.start()
+
+            def fail(items):
+                raise ValueError("no retracting")
+            server.kb.kb_retract_many = fail
+            answers = await asyncio.gather(
+                server.request("assert fact: (isa cube block)"),
+                server.request("retract fact: (isa cube block)"),
+                server.request("assert fact: (isa sphere block)"))
+            self.assertEqual(answers, ["ok", "error no retracting", "ok"])
+            self.assertEqual(server._ask(read.parse_input("fact: (isa ?X block)")),
+                             "yes ?X : cube | ?X : sphere")
+            await server.close()
+        asyncio.run(run())
+
+    def test_close_while_applying(self):
+        import asyncio, threading
+        from server import KBServer
+
+        async def run():
+            server = KBServer()
+            await server.start()
+            started, release = threading.Event(), threading.Event()
+            assert_many = server.kb.kb_assert_many
+            def slow(items):
+                started.set()
+                release.wait(5)
+                assert_many(items)
+            server.kb.kb_assert_many = slow
+            first = asyncio.ensure_future(server.request("assert fact: (isa cube block)"))
+            while not started.is_set():
+                await asyncio.sleep(0.001)
+            second = asyncio.ensure_future(server.request("retract fact: (isa cube block)"))
+            closing = asyncio.ensure_future(server.close())
+            await asyncio.sleep(0.01)
+            release.set()
+            await closing
+            # the run being applied was applied, the one queued was not
+            self.assertEqual(await first, "ok")
+            self.assertEqual(await second, "error server closed")
+            self.assertIn(read.parse_input("fact: (isa cube block)"), server.kb.facts)
+        asyncio.run(run())
+
+    def test_close_with_idle_client(self):
+        import asyncio
+        from server import KBServer, Client
+
+        async def run():
+            server = KBServer()
+            listening = await server.start()
+            client = await Client.connect(port=listening.sockets[0].getsockname()[1])
+            self.assertEqual(await client.request("assert fact: (isa cube block)"), "ok")
+            await asyncio.wait_for(server.close(), 5)
+            # the server hung up
+            self.assertEqual(await client.reader.readline(), b'')
+            await client.close()
+        asyncio.run(run())
+
+    def test_percentile(self):
+        from server import percentile
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile([1, 2, 3, 4, 5, 6], 90), 6)
+        self.assertEqual(percentile(list(range(1, 26)), 90), 23)
+        self.assertEqual(percentile([7], 0), 7)
+        self.assertEqual(percentile([1, 2, 3], 100), 3)
+
+
+class DatalogTest(unittest.TestCase):
+
+    def test_closure_matches_curried(self):
+        for file in ('statements_kb2.txt', 'statements_kb4.txt'):
+            KB1 = KnowledgeBase([], [])
+            KB1.load(file)
+            KB2 = KnowledgeBase([], [], engine=DatalogEngine())
+            KB2.load(file)
+            self.assertEqual(set(KB1.facts), set(KB2.facts))
+
+    def test_retract(self):
+        KB = KnowledgeBase([], [], engine=DatalogEngine())
+        for item in read.read_tokenize('statements_kb4.txt'):
+            KB.kb_assert(item)
+        r1 = read.parse_input("fact: (motherof ada bing)")
+        KB.kb_retract(r1)
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        answer = KB.kb_ask(ask1)
+        self.assertEqual(len(answer), 1)
+        self.assertEqual(str(answer[0]), "?X : felix")
+        KB.kb_assert(r1)
+        self.assertEqual(len(KB.kb_ask(ask1)), 2)
+
+
+class ParallelTest(unittest.TestCase):
+
+    def kb(self, engine, file):
+        KB = KnowledgeBase([], [], engine=engine)
+        for item in read.read_tokenize(file):
+            KB.kb_assert(item)
+        return KB
+
+    def test_same_as_datalog(self):
+        for file in ('statements_kb2.txt', 'statements_kb4.txt'):
+            engine = ParallelDatalogEngine(processes=2, parts=3)
+            KB1 = self.kb(DatalogEngine(), file)
+            KB2 = self.kb(engine, file)
+            for KB in (KB1, KB2):
+                KB.kb_retract(read.read_tokenize(file)[0])
+            engine.close()
+            self.assertEqual([f.statement for f in KB1.facts], [f.statement for f in KB2.facts])
+            self.assertEqual([[[str(m) for m in pair] for pair in f.supported_by] for f in KB1.facts],
+                             [[[str(m) for m in pair] for pair in f.supported_by] for f in KB2.facts])
+
+    def test_rollback_then_assert(self):
+        for close in (False, True):
+            engine = ParallelDatalogEngine(processes=2)
+            KBs = [KnowledgeBase([], [], engine=DatalogEngine()), KnowledgeBase([], [], engine=engine)]
+            for KB in KBs:
+                KB.kb_assert(read.parse_input("rule: ((p ?x ?y) (q ?y ?z)) -> (r ?x ?z)"))
+                KB.kb_assert(read.parse_input("fact: (p a b)"))
+                KB.kb_assert(read.parse_input("fact: (q b c)"))
+                KB.begin()
+                KB.kb_retract(read.parse_input("fact: (p a b)"))
+                KB.rollback()
+                if close and KB.ie is engine:
+                    engine.close()
+                KB.kb_assert(read.parse_input("fact: (q b d)"))
+            engine.close()
+            self.assertTrue(KBs[1].kb_ask(read.parse_input("fact: (r a d)")))
+            self.assertEqual(set(KBs[0].facts), set(KBs[1].facts))
+
+    def test_worker_error(self):
+        import parallel
+        failing = [True]
+        round = parallel.Replica.round
+        def fail(replica, message):
+            # workers are forked, so only those started while failing fail
+            if failing and any(data[0] == 'boom' for _, data in message[3]):
+                raise ValueError("boom")
+            return round(replica, message)
+        parallel.Replica.round = fail
+        self.addCleanup(setattr, parallel.Replica, 'round', round)
+
+        engine = ParallelDatalogEngine(processes=2)
+        KBs = [KnowledgeBase([], [], engine=DatalogEngine()), KnowledgeBase([], [], engine=engine)]
+        for KB in KBs:
+            KB.kb_assert(read.parse_input("rule: ((p ?x ?y) (boom ?y)) -> (r ?x ?y)"))
+            KB.kb_assert(read.parse_input("fact: (p a b)"))
+        with self.assertRaises(ValueError):
+            KBs[1].kb_assert(read.parse_input("fact: (boom b)"))
+        failing.clear()
+        KBs[0].kb_assert(read.parse_input("fact: (boom b)"))
+        for KB in KBs:
+            KB.kb_assert(read.parse_input("fact: (p c b)"))
+        engine.close()
+        self.assertEqual(set(KBs[0].facts), set(KBs[1].facts))
+        self.assertTrue(KBs[1].kb_ask(read.parse_input("fact: (r c b)")))
+
+    def test_dead_worker(self):
+        engine = ParallelDatalogEngine(processes=2)
+        KBs = [KnowledgeBase([], [], engine=DatalogEngine()), KnowledgeBase([], [], engine=engine)]
+        for KB in KBs:
+            KB.kb_assert(read.parse_input("rule: ((p ?x ?y) (q ?y)) -> (r ?x ?y)"))
+            KB.kb_assert(read.parse_input("fact: (p a b)"))
+        process, _ = engine._workers[0]
+        process.kill()
+        process.join()
+        with self.assertRaises((EOFError, OSError)):
+            KBs[1].kb_assert(read.parse_input("fact: (q b)"))
+        self.assertEqual(engine._workers, [])
+        KBs[0].kb_assert(read.parse_input("fact: (q b)"))
+        for KB in KBs:
+            KB.kb_assert(read.parse_input("fact: (p c b)"))
+        # close copes with a worker that died too
+        engine._workers[1][0].kill()
+        engine._workers[1][0].join()
+        engine.close()
+        self.assertEqual(set(KBs[0].facts), set(KBs[1].facts))
+        self.assertTrue(KBs[1].kb_ask(read.parse_input("fact: (r c b)")))
+
+
+class ClosureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [], lazy=['inst', 'isa'])
+        self.KB.load('statements_kb2.txt')
+        self.KB2 = KnowledgeBase([], [])
+        self.KB2.load('statements_kb2.txt')
+
+    def answers(self, KB, ask):
+        return sorted(str(b) for b in KB.kb_ask(read.parse_input(ask)) or [])
+
+    def test_recognize(self):
+        rules = [r for r in read.read_tokenize('statements_kb2.txt') if isinstance(r, Rule)]
+        self.assertEqual(closure.inheritance(rules[0]), ('inst', 'isa'))
+        self.assertEqual(closure.transitive(rules[1]), 'isa')
+        self.assertIsNone(closure.transitive(rules[2]))
+        self.assertEqual(len(self.KB.closure.rules), 2)
+
+    def test_same_answers(self):
+        for ask in ("fact: (isa ?X ?Y)", "fact: (inst ?X ?Y)", "fact: (inst ?X Dragon)",
+                    "fact: (isa Dragon ?X)", "fact: (inst Nosliw ?X)"):
+            self.assertEqual(self.answers(self.KB, ask), self.answers(self.KB2, ask))
+        # nothing materialized
+        self.assertNotIn('isa', [f.statement.predicate for f in self.KB.facts if not f.asserted])
+
+    def test_incremental(self):
+        for KB in (self.KB, self.KB2):
+            KB.kb_assert(read.parse_input("fact: (isa Sorcerer Wizard)"))
+            KB.kb_assert(read.parse_input("fact: (inst Merlin Sorcerer)"))
+        ask = "fact: (inst Merlin ?X)"
+        self.assertEqual(self.answers(self.KB, ask), self.answers(self.KB2, ask))
+        for KB in (self.KB, self.KB2):
+            KB.kb_retract(read.parse_input("fact: (isa Sorcerer Wizard)"))
+        self.assertEqual(self.answers(self.KB, ask), ["?X : Sorcerer"])
+        self.assertEqual(self.answers(self.KB, ask), self.answers(self.KB2, ask))
+
+
+class BackwardTest(unittest.TestCase):
+
+    def test_lazy_predicate(self):
+        KB = KnowledgeBase([], [], lazy=['inst'])
+        KB.load('statements_kb.txt')
+        # the flat rule uses inst, so it is lazy too
+        self.assertEqual(len(KB.lazy_rules), 2)
+        self.assertEqual(KB.lazy_predicates, set(['inst', 'flat']))
+        ask1 = read.parse_input("fact: (inst cube1 ?X)")
+        answer = KB.kb_ask(ask1)
+        self.assertEqual(str(answer[0]), "?X : cube")
+        self.assertEqual(str(answer[1]), "?X : block")
+        self.assertNotIn(Fact(Statement(["inst", "cube1", "block"])), KB.facts)
+
+    def test_rules_using_lazy_predicates(self):
+        # conclusions of rules using a lazy predicate are still found, whether
+        # the rules come before or after those they use
+        for lazy in (['inst'], ['inst', 'isa']):
+            KB = KnowledgeBase([], [], lazy=lazy)
+            KB.load('statements_kb2.txt')
+            self.assertTrue(KB.kb_ask(read.parse_input("fact: (safe HappyDale)")))
+            self.assertTrue(KB.kb_ask(read.parse_input("fact: (magicCastUpon Ai)")))
+            self.assertIn('strong', KB.lazy_predicates)
+
+    def test_recursive_rule_terminates(self):
+        KB = KnowledgeBase([], [], lazy=['isa'])
+        for i in range(10):
+            KB.kb_assert(read.parse_input("fact: (isa c%d c%d)" % (i, (i + 1) % 10)))
+        KB.kb_assert(read.parse_input("rule: ((isa ?x ?y) (isa ?y ?z)) -> (isa ?x ?z)"))
+        answer = KB.kb_ask(read.parse_input("fact: (isa c3 ?X)"))
+        self.assertEqual(len(answer), 10)
+        answer = KB.kb_ask(read.parse_input("fact: (isa ?X ?X)"))
+        self.assertEqual(len(answer), 10)
+
+    def test_deep_chain(self):
+        import inspect, sys
+        KB = KnowledgeBase([], [], lazy=['anc'])
+        KB.kb_assert(read.parse_input("rule: ((par ?x ?y)) -> (anc ?x ?y)"))
+        KB.kb_assert(read.parse_input("rule: ((par ?x ?y) (anc ?y ?z)) -> (anc ?x ?z)"))
+        KB.kb_assert_many([read.parse_input("fact: (par a%d a%d)" % (i, i + 1)) for i in range(300)])
+        ask1 = read.parse_input("fact: (anc a0 a300)")
+        # a chain of subgoals longer than the stack left to the prover
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(len(inspect.stack(0)) + 100)
+        try:
+            answer = KB.kb_ask(ask1)
+            answers = list(KB.kb_ask_iter(ask1))
+        finally:
+            sys.setrecursionlimit(limit)
+        self.assertTrue(answer)
+        self.assertEqual(len(answers), 1)
+
+
+class AskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [], ask_cache_size=2)
+        self.KB.load('statements_kb4.txt')
+
+    def test_hits_and_invalidation(self):
+        ask1 = read.parse_input("fact: (grandmotherof ada ?X)")
+        answer = self.KB.kb_ask(ask1)
+        # a hit gives the same answers, in a list of its own
+        again = self.KB.kb_ask(ask1)
+        self.assertIsNot(again, answer)
+        self.assertEqual(str(again), str(answer))
+        answer.list_of_bindings.pop()
+        self.assertEqual(len(self.KB.kb_ask(ask1)), 2)
+        # same pattern with other variable names
+        answer2 = self.KB.kb_ask(read.parse_input("fact: (grandmotherof ada ?Y)"))
+        self.assertEqual(str(answer2[0]), "?Y : felix")
+        self.assertEqual((self.KB.ask_cache_hits, self.KB.ask_cache_misses), (3, 1))
+        # facts of other predicates leave the answer cached
+        self.KB.kb_assert(read.parse_input("fact: (kindto bing ada)"))
+        self.assertEqual(len(self.KB.kb_ask(ask1)), 2)
+        self.assertEqual(self.KB.ask_cache_misses, 1)
+        self.KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertEqual(len(self.KB.kb_ask(ask1)), 1)
+        self.assertEqual(self.KB.ask_cache_misses, 2)
+
+    def test_bounded(self):
+        for statement in ("(motherof ?X ?Y)", "(parentof ?X ?Y)", "(cooksfor ?X ?Y)"):
+            self.KB.kb_ask(read.parse_input("fact: " + statement))
+        self.assertEqual(len(self.KB._ask_cache), 2)
+        self.KB.kb_ask(read.parse_input("fact: (motherof ?X ?Y)"))
+        self.assertEqual((self.KB.ask_cache_hits, self.KB.ask_cache_misses), (0, 4))
+
+
+class AskIterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [])
+        self.KB.load('statements_kb4.txt')
+
+    def test_ask_iter(self):
+        ask1 = read.parse_input("fact: (motherof ?X ?Y)")
+        answers = [str(b) for b in self.KB.kb_ask(ask1)]
+        self.assertEqual([str(b) for b in self.KB.kb_ask_iter(ask1)], answers)
+        self.assertEqual([str(b) for b in self.KB.kb_ask_iter(ask1, limit=2, offset=1)], answers[1:3])
+        self.assertEqual(list(self.KB.kb_ask_iter(ask1, limit=0)), [])
+        first = next(self.KB.kb_ask_iter(read.parse_input("fact: (auntof ?X ?Y)")))
+        self.assertTrue(first['?X'])
+
+
+class ConjunctionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.KB = KnowledgeBase([], [])
+        self.KB.load('statements_kb4.txt')
+
+    def test_join(self):
+        query = [read.parse_input("fact: (grandmotherof ?a ?b)"),
+                 read.parse_input("fact: (motherof ?a ?c)").statement, ["motherof", "?c", "?d"]]
+        answer = self.KB.kb_ask(query)
+        self.assertEqual(str(answer[0]), "?A : ada, ?B : felix, ?C : bing, ?D : chen")
+        self.assertEqual(len(answer), 2)
+        self.assertEqual([f.statement.predicate for f in answer.list_of_bindings[0][1]],
+                         ["grandmotherof", "motherof", "motherof"])
+        self.assertEqual(self.KB.kb_ask([["motherof", "?x", "?y"], ["sisters", "?y", "ada"]]), [])
+
+    def test_join_order(self):
+        statements = query.conjunction([["a", "?x"], ["b", "?y"], ["c", "?x", "?y"]])
+        self.assertEqual(query.join_order(statements, [5, 1, 100]), [1, 2, 0])
+
+
+class ReadTest(unittest.TestCase):
+
+    def write(self, text):
+        f = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        f.write(text)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_iter_statements(self):
+        file = self.write("# comment\nfact: (isa cube block)\n\nrule: ((inst ?x ?y)\n"
+                          "    (isa ?y ?z)) -> (inst ?x ?z)\n")
+        for use_mmap in (False, True):
+            items = list(read.iter_statements(file, use_mmap))
+            self.assertEqual(items, [read.parse_input("fact: (isa cube block)"),
+                read.parse_input("rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)")])
+        self.assertEqual(read.read_tokenize('statements_kb4.txt'),
+                         list(read.iter_statements('statements_kb4.txt', True)))
+
+    def test_parse_error(self):
+        file = self.write("fact: (isa cube block)\n\nrule: ((inst ?x ?y))\n  (inst ?y ?x)\n")
+        with self.assertRaises(read.ParseError) as raised:
+            list(read.iter_statements(file))
+        self.assertEqual(raised.exception.line, 3)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        f = tempfile.NamedTemporaryFile(suffix='.snap', delete=False)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        for engine in (lambda: None, ReteEngine, DatalogEngine):
+            KB = KnowledgeBase([], [], engine=engine(), lazy=['auntof'])
+            KB.load('statements_kb4.txt')
+            snapshot.save(KB, f.name)
+            KB2 = snapshot.load(f.name, engine=engine())
+            self.assertEqual(list(KB.facts), list(KB2.facts))
+            self.assertEqual(list(KB.rules), list(KB2.rules))
+            self.assertEqual(list(KB.lazy_rules), list(KB2.lazy_rules))
+            for fact in KB.facts:
+                self.assertEqual(fact.asserted, KB2.facts[fact].asserted)
+                self.assertEqual(fact.supported_by, KB2.facts[fact].supported_by)
+            # same retraction and inference afterwards
+            for kb in (KB, KB2):
+                kb.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+                kb.kb_assert(read.parse_input("fact: (motherof chen dana)"))
+            self.assertEqual(list(KB.facts), list(KB2.facts))
+            ask1 = read.parse_input("fact: (grandmotherof ?X dana)")
+            self.assertEqual(str(KB2.kb_ask(ask1)[0]), "?X : bing")
+
+    def test_settings(self):
+        f = tempfile.NamedTemporaryFile(suffix='.snap', delete=False)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        KB = KnowledgeBase([], [], strategy=LIFO, tms=DRed(), ask_cache_size=8)
+        KB.load('statements_kb4.txt')
+        snapshot.save(KB, f.name)
+        KB2 = snapshot.load(f.name)
+        self.assertIs(KB2.strategy, LIFO)
+        self.assertIsInstance(KB2.tms, DRed)
+        self.assertEqual(KB2.ask_cache_size, 8)
+        tms = SupportCounting()
+        self.assertIs(snapshot.load(f.name, tms=tms).tms, tms)
+
+    def test_not_a_snapshot(self):
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.load('statements_kb4.txt')
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counters(self):
+        for engine in (None, DatalogEngine()):
+            metrics = Metrics(timing=True)
+            KB = KnowledgeBase([], [], engine=engine, metrics=metrics)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                KB.load('statements_kb4.txt')
+            self.assertEqual(out.getvalue(), '')
+            counters = metrics.counters
+            self.assertEqual(counters['derived_facts'], len([f for f in KB.facts if not f.asserted]))
+            self.assertEqual(counters['derived_rules'], len([r for r in KB.rules if not r.asserted]))
+            self.assertGreaterEqual(counters['rule_firings'], counters['derived_facts'])
+            KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+            self.assertEqual(metrics.cascade_sizes, [counters['cascade_removed']])
+        self.assertEqual(metrics.rule_seconds, {})
+
+    def test_curried_engine(self):
+        metrics = Metrics(timing=True)
+        KB = KnowledgeBase([], [], metrics=metrics)
+        KB.load('statements_kb4.txt')
+        self.assertEqual(metrics.counters['match_attempts'], 35)
+        self.assertEqual(metrics.counters['bindings'], metrics.counters['rule_firings'])
+        self.assertTrue(metrics.rule_seconds)
+        self.assertTrue(set(metrics.rule_seconds) <= set(KB.rules))
+        KB.kb_retract(read.parse_input("fact: (motherof ada bing)"))
+        self.assertEqual(metrics.cascade_sizes, [6])
+
 def pprint_justification(answer):
     """Pretty prints (hence pprint) justifications for the answer.
     """
@@ -360,7 +1283,5 @@ def pprint_support(fact_rule, indent):
                 for next in pair:
                     pprint_support(next, indent+2)
 
-
-
 if __name__ == '__main__':
     unittest.main()
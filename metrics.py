@@ -0,0 +1,103 @@
+from collections import Counter
+from logical_classes import *
+
+verbose = 0
+
+class Metrics(object):
+    """Counters of the inference work done by a KB and its engine. A KB only
+        collects them when its metrics attribute is set to an instance, e.g.
+        KnowledgeBase(metrics=Metrics()); otherwise the hot paths pay a single
+        attribute check. The on_ methods are the events the KB and engines
+        report, subclass and override them to watch inference as it happens.
+
+        Match attempts and bindings are counted by the curried-rule engine,
+        which matches one fact against one rule at a time; every engine
+        reports rule firings and derived facts.
+
+    Attributes:
+        counters (Counter): match_attempts, bindings (successful matches),
+            rule_firings, derived_facts and derived_rules (new to the KB),
+            cascades and cascade_removed (facts/rules removed by retractions)
+        cascade_sizes (listof int): facts/rules removed by each retraction
+            that removed anything
+        timing (bool): whether to time the rules
+        rule_seconds (dictof float): time spent matching and firing each rule,
+            when timing
+    """
+    def __init__(self, timing=False):
+        """Constructor for Metrics
+
+        Args:
+            timing (bool): also time each rule, which costs two clock reads
+                per match attempt
+        """
+        super(Metrics, self).__init__()
+        self.timing = timing
+        self.reset()
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Metrics({!r})'.format(dict(self.counters))
+
+    def reset(self):
+        """Zero all counters and timings
+        """
+        self.counters = Counter()
+        self.cascade_sizes = []
+        self.rule_seconds = {}
+
+    def on_match(self, fact, rule, bindings):
+        """A fact was matched against the first LHS statement of a rule
+
+        Args:
+            fact (Fact): the fact
+            rule (Rule): the rule
+            bindings (Bindings|False): the bindings, False if it did not match
+        """
+        self.counters['match_attempts'] += 1
+        if bindings:
+            self.counters['bindings'] += 1
+
+    def on_fire(self, rule, new, added):
+        """A rule fired, inferring a fact or a curried rule
+
+        Args:
+            rule (Rule): the rule
+            new (Fact|Rule): the KB's instance of what it inferred
+            added (bool): whether that was new to the KB, rather than another
+                justification of something already there
+        """
+        self.counters['rule_firings'] += 1
+        if added:
+            self.counters['derived_facts' if isinstance(new, Fact) else 'derived_rules'] += 1
+
+    def on_cascade(self, removed):
+        """A retraction removed facts/rules from the KB
+
+        Args:
+            removed (listof Fact|Rule): everything it removed
+        """
+        self.counters['cascades'] += 1
+        self.counters['cascade_removed'] += len(removed)
+        self.cascade_sizes.append(len(removed))
+
+    def on_rule_time(self, rule, seconds):
+        """Time was spent matching a fact against a rule and firing it
+
+        Args:
+            rule (Rule): the rule
+            seconds (float): the time spent
+        """
+        self.rule_seconds[rule] = self.rule_seconds.get(rule, 0.0) + seconds
+
+    def slowest_rules(self, n=10):
+        """The rules that took the most time, when timing
+
+        Args:
+            n (int): number of rules
+
+        Returns:
+            listof (Rule, float): rules and their time in seconds, slowest first
+        """
+        return sorted(self.rule_seconds.items(), key=lambda item: -item[1])[:n]
@@ -0,0 +1,198 @@
+import itertools, threading
+from logical_classes import *
+from util import *
+from backward import TabledProver
+from query import conjunction, ask_conjunction
+
+verbose = 0
+
+class Bucket(object):
+    """The facts of one index key as of a version: the first size facts of a
+        list that the writer only ever appends to, so later versions share it
+
+    Attributes:
+        facts (listof Fact): facts of the key, in the order they were stored
+        size (int): how many of them are in the version
+    """
+    __slots__ = ('facts', 'size')
+
+    def __init__(self, facts, size):
+        """Constructor for Bucket
+
+        Args:
+            facts (listof Fact): facts of the key, only ever appended to
+            size (int): how many of them are in the version
+        """
+        self.facts = facts
+        self.size = size
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Bucket({} facts)'.format(self.size)
+
+    def __len__(self):
+        """Define behavior of len, the number of facts in the version
+        """
+        return self.size
+
+    def __iter__(self):
+        """Iterate over the facts in the version
+        """
+        return itertools.islice(self.facts, self.size)
+
+class Version(object):
+    """An immutable version of the facts of a KB, published by its writer, to
+        ask against from any thread without taking a lock: the KB may go on
+        changing, a version never does. Facts are kept as a Bucket per index
+        key, shared with the versions before and after.
+
+        Asks are parsed and matched by the reader's thread, so they may
+        intern new symbols and statements; the interning tables of
+        logical_classes are locked for that, while lookups are not.
+
+    Attributes:
+        number (int): the versions published before this one
+        index (dictof Bucket): facts by index key, never changed
+        rules (tuple): the asserted and lazy rules, for backward chaining
+        lazy_predicates (frozenset): predicates always asked backwards
+    """
+    def __init__(self, number, index, rules, lazy_predicates):
+        """Constructor for Version
+
+        Args:
+            number (int): the versions published before this one
+            index (dictof Bucket): facts by index key
+            rules (tuple): the asserted and lazy rules
+            lazy_predicates (frozenset): predicates always asked backwards
+        """
+        super(Version, self).__init__()
+        self.number = number
+        self.index = index
+        self.rules = rules
+        self.lazy_predicates = lazy_predicates
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Version({}, {} facts)'.format(self.number, sum(len(b) for b in self.index.values()))
+
+    def _facts_for(self, statement):
+        """Get the facts that could match a statement, like
+            KnowledgeBase._facts_for
+        """
+        return self.index.get(index_key(statement), ())
+
+    def kb_ask(self, fact, backward=False):
+        """Ask if a fact was in the KB as of this version, like
+            KnowledgeBase.kb_ask. Lazy predicates are answered by backward
+            chaining, without the KB's closure index.
+
+        Args:
+            fact (Fact|listof Statement) - Statement to be asked, or statements
+                that must all hold at once
+            backward (bool) - also answer with facts that can be proved by
+                backward chaining through the asserted rules
+
+        Returns:
+            listof Bindings|False - list of Bindings if result found, False otherwise
+        """
+        printv("Asking version {} {!r}", 0, verbose, [self.number, fact])
+        if isinstance(fact, (list, tuple)):
+            statements = conjunction(fact)
+            facts_for = self._facts_for
+            if backward or any(s.predicate in self.lazy_predicates for s in statements):
+                facts_for = TabledProver(self, self.rules).prove
+            return ask_conjunction(statements, facts_for)
+        if not factq(fact):
+            print("Invalid ask:", fact)
+            return False
+        statement = fact.statement
+        if backward or statement.predicate in self.lazy_predicates:
+            facts = TabledProver(self, self.rules).prove(statement)
+        else:
+            facts = self._facts_for(statement)
+        plan = compile_pattern(statement)
+        bindings_lst = ListOfBindings()
+        for candidate in facts:
+            binding = plan.match(candidate.statement)
+            if binding:
+                bindings_lst.add_bindings(binding, [candidate])
+        return bindings_lst if bindings_lst.list_of_bindings else []
+
+class Versions(object):
+    """Multi-version concurrency control for a KB: one writer at a time
+        changes the KB, holding the lock, and publishes a new Version when a
+        change is complete (inference done, no transaction open); readers
+        ask the current version, which is swapped in with one assignment, so
+        they never wait for inference. The facts of each index key are kept
+        in a list only appended to, so publishing a key that only gained
+        facts costs O(facts added); a key that lost any is copied afresh,
+        O(facts of the key), since older versions still read the old list.
+        The asserted rules are copied if they changed.
+
+    Attributes:
+        lock (RLock): held by the writer while changing the KB
+        current (Version): the latest version published
+    """
+    def __init__(self):
+        """Constructor for Versions, with an empty version published
+        """
+        super(Versions, self).__init__()
+        self.lock = threading.RLock()
+        self.current = Version(0, {}, (), frozenset())
+        # facts stored since the current version by index key, or None for
+        # keys that lost facts
+        self.dirty = {}
+        # append-only list of the facts of each index key
+        self._lists = {}
+        # whether the asserted or lazy rules changed since then
+        self.rules_dirty = False
+
+    def stored(self, key, fact):
+        """Record that the writer stored a fact
+
+        Args:
+            key (tuple): index key of the fact
+            fact (Fact): the fact
+        """
+        if key not in self.dirty:
+            self.dirty[key] = [fact]
+        elif self.dirty[key] is not None:
+            self.dirty[key].append(fact)
+
+    def removed(self, key):
+        """Record that the writer removed a fact
+
+        Args:
+            key (tuple): index key of the fact
+        """
+        self.dirty[key] = None
+
+    def publish(self, kb):
+        """Publish the state of a KB as the new current version
+
+        Args:
+            kb (KnowledgeBase): the KB, with no inference or transaction going on
+        """
+        previous = self.current
+        index = dict(previous.index)
+        for key, stored in self.dirty.items():
+            bucket = kb._fact_index.get(key)
+            if not bucket:
+                index.pop(key, None)
+                self._lists.pop(key, None)
+                continue
+            facts = self._lists.get(key)
+            if stored is None or facts is None or len(facts) + len(stored) != len(bucket):
+                facts = self._lists[key] = list(bucket)
+            else:
+                facts.extend(stored)
+            index[key] = Bucket(facts, len(facts))
+        rules = previous.rules
+        if self.rules_dirty:
+            rules = tuple([rule for rule in kb.rules if rule.asserted] + list(kb.lazy_rules))
+        printv("Publishing version {}: {} keys changed", 1, verbose, [previous.number + 1, len(self.dirty)])
+        self.dirty = {}
+        self.rules_dirty = False
+        self.current = Version(previous.number + 1, index, rules, frozenset(kb.lazy_predicates))
@@ -0,0 +1,346 @@
+import multiprocessing
+from logical_classes import *
+from util import *
+from datalog import DatalogEngine, Relation, CompiledRule
+
+verbose = 0
+
+def encode(statement):
+    """Statement as a tuple of strings, to send to another process, whose
+        symbol ids differ
+    """
+    return (statement.predicate,) + tuple(t.term.element for t in statement.terms)
+
+def decode(data):
+    """Statement from a tuple made by encode
+    """
+    return Statement(list(data))
+
+class Replica(object):
+    """A worker process's copy of the facts and rules of a
+        ParallelDatalogEngine, kept in step with it round by round, and joining
+        its share of the rules in each round
+
+    Attributes:
+        facts (dictof Fact): facts by number
+        numbers (dictof int): number of each fact
+        old (dictof Relation): facts known before the current round, by index key
+        delta (dictof Relation): facts new in the current round, by index key
+        rules (dictof CompiledRule): rules by number
+    """
+    def __init__(self):
+        """Constructor for Replica starting with no facts or rules
+        """
+        super(Replica, self).__init__()
+        self.facts = {}
+        self.numbers = {}
+        self.old = {}
+        self.delta = {}
+        self.rules = {}
+
+    def _fact(self, n, data):
+        """Record the fact numbered n
+        """
+        fact = Fact(decode(data))
+        self.facts[n] = fact
+        self.numbers[fact] = n
+        return fact
+
+    def round(self, message):
+        """Apply the changes since the previous round, then join the given
+            tasks
+
+        Args:
+            message (tuple): facts restored as old, numbers of removed facts
+                and rules, new facts, new rules and the tasks of this replica,
+                see ParallelDatalogEngine.saturate
+
+        Returns:
+            listof (int, list): for each task, its index and the RHS and
+                fact numbers of each combination it joined
+        """
+        old_facts, removed_facts, removed_rules, delta, rules, tasks = message
+        for key, relation in self.delta.items():
+            old = self.old.setdefault(key, Relation())
+            for fact in relation.facts:
+                old.add(fact)
+        self.delta = {}
+        # removals first: facts are looked up by statement, and a fact taken
+        # back as old may equal one removed under its former number
+        for n in removed_facts:
+            fact = self.facts.pop(n)
+            del self.numbers[fact]
+            relation = self.old.get(index_key(fact.statement))
+            if relation is not None:
+                relation.remove(fact)
+        for n in removed_rules:
+            del self.rules[n]
+        for n, data in old_facts:
+            fact = self._fact(n, data)
+            self.old.setdefault(index_key(fact.statement), Relation()).add(fact)
+        for n, data in delta:
+            fact = self._fact(n, data)
+            self.delta.setdefault(index_key(fact.statement), Relation()).add(fact)
+        for n, (lhs, rhs) in rules:
+            self.rules[n] = CompiledRule(Rule([[decode(s) for s in lhs], decode(rhs)]))
+
+        results = []
+        for index, n, i, part in tasks:
+            compiled = self.rules[n]
+            size = len(compiled.conditions)
+            if i is None:
+                sources = [(self.old, self.delta)] * size
+            else:
+                sources = [(self.old,)] * i + [(self.delta,)] + [(self.old, self.delta)] * (size - i - 1)
+            joined = []
+            for facts, values in compiled.join(sources, part):
+                joined.append((encode(compiled.instantiate(values)),
+                               tuple(self.numbers[fact] for fact in facts)))
+            results.append((index, joined))
+        return results
+
+def work(conn):
+    """Main loop of a worker process: answer each round message with the
+        results of its replica, until told to stop with None
+    """
+    replica = Replica()
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        try:
+            conn.send(replica.round(message))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+class ParallelDatalogEngine(DatalogEngine):
+    """Semi-naive Datalog engine running the joins of each round in worker
+        processes. Each worker keeps a replica of the facts and rules, sent
+        once as they come, so a round only ships what changed. The joins of a
+        round (a rule, and which condition takes the new facts) are each cut
+        into contiguous slices of the candidates for their first condition,
+        spread over the workers, and their results put back in order, so the
+        KB gets exactly the facts and support links DatalogEngine gives it.
+
+    Attributes:
+        processes (int): number of worker processes
+        parts (int): slices each join is cut into
+    """
+    def __init__(self, processes=None, parts=None):
+        """Constructor for ParallelDatalogEngine. Workers are started on the
+            first round; call close() to stop them.
+
+        Args:
+            processes (int|None): number of worker processes, by default the
+                number of CPUs
+            parts (int|None): slices each join is cut into, by default the
+                number of processes
+        """
+        super(ParallelDatalogEngine, self).__init__()
+        self.processes = processes or multiprocessing.cpu_count()
+        self.parts = parts or self.processes
+        self._workers = []
+        self._facts = {}
+        self._numbers = {}
+        self._rules = {}
+        self._rule_numbers = {}
+        self._count = 0
+        # facts numbered from here on were not sent to the workers yet
+        self._sent = 0
+        # facts to send as old next round, by number
+        self._old_facts = {}
+        self._removed_facts = []
+        self._removed_rules = []
+        self._new_rules = {}
+
+    def _number(self, fact_rule):
+        """Give a new fact or rule the next number
+        """
+        n = self._count
+        self._count += 1
+        if isinstance(fact_rule, Fact):
+            self._facts[n] = fact_rule
+            self._numbers[fact_rule] = n
+        else:
+            self._rules[n] = fact_rule
+            self._rule_numbers[fact_rule] = n
+            self._new_rules[n] = ([encode(s) for s in fact_rule.lhs], encode(fact_rule.rhs))
+        return n
+
+    def infer_from_fact(self, fact, kb):
+        """Add a new fact to the delta of the next round
+
+        Args:
+            fact (Fact) - A new fact in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        super(ParallelDatalogEngine, self).infer_from_fact(fact, kb)
+        self._number(fact)
+
+    def infer_from_rule(self, rule, kb):
+        """Compile a new rule, to be joined against all facts next round
+
+        Args:
+            rule (Rule) - A new rule in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        super(ParallelDatalogEngine, self).infer_from_rule(rule, kb)
+        self._number(rule)
+
+    def forget(self, fact_rule, kb):
+        """Drop a retracted fact or rule, here and in the workers
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that was removed
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        super(ParallelDatalogEngine, self).forget(fact_rule, kb)
+        if isinstance(fact_rule, Rule):
+            n = self._rule_numbers.pop(fact_rule, None)
+            if n is not None:
+                del self._rules[n]
+                if self._new_rules.pop(n, None) is None:
+                    self._removed_rules.append(n)
+            return
+        n = self._numbers.pop(fact_rule, None)
+        if n is not None:
+            del self._facts[n]
+            # the workers only know it if it was sent, and not just queued
+            # as old for new workers
+            if self._old_facts.pop(n, None) is None and n < self._sent:
+                self._removed_facts.append(n)
+
+    def restore(self, kb):
+        """Take the facts and rules of a KB whose facts were all inferred
+            already as joined, and send them to the workers as such
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        super(ParallelDatalogEngine, self).restore(kb)
+        for fact in kb.facts:
+            self._old_facts[self._number(fact)] = encode(fact.statement)
+        for rule in kb.rules:
+            self._number(rule)
+
+    def recall(self, fact_rule, kb):
+        """Take back a fact or rule that is in the KB again as joined, and
+            send it to the workers as such
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that is back
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        super(ParallelDatalogEngine, self).recall(fact_rule, kb)
+        n = self._number(fact_rule)
+        if isinstance(fact_rule, Fact):
+            self._old_facts[n] = encode(fact_rule.statement)
+
+    def saturate(self, kb):
+        """Run one semi-naive round in the workers and assert what it infers
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if not self.delta and not self.new_rules:
+            return
+        delta, self.delta = self.delta, {}
+        new_rules, self.new_rules = self.new_rules, {}
+
+        # the joins in the order DatalogEngine.saturate makes them
+        joins = []
+        for rule, compiled in self.rules.items():
+            for i in range(len(compiled.conditions)):
+                if compiled.conditions[i][0] in delta:
+                    joins.append((self._rule_numbers[rule], i))
+        for rule in new_rules:
+            joins.append((self._rule_numbers[rule], None))
+        tasks = [[] for _ in range(self.processes)]
+        for j, (n, i) in enumerate(joins):
+            for k in range(self.parts):
+                index = j * self.parts + k
+                tasks[index % self.processes].append((index, n, i, (k, self.parts)))
+        printv('Parallel round: {} joins in {} tasks', 1, verbose, [len(joins), len(joins) * self.parts])
+
+        changes = (list(self._old_facts.items()), self._removed_facts, self._removed_rules,
+                   [(self._numbers[f], encode(f.statement)) for r in delta.values() for f in r.facts],
+                   list(self._new_rules.items()))
+        self._old_facts, self._removed_facts, self._removed_rules = {}, [], []
+        self._new_rules = {}
+        self._sent = self._count
+        if not self._workers:
+            self._start()
+        # a worker that died fails the round like a worker error
+        results, error, sent = [], None, []
+        for (_, conn), mine in zip(self._workers, tasks):
+            try:
+                conn.send(changes + (mine,))
+                sent.append(conn)
+            except (EOFError, OSError) as e:
+                error = error or e
+        # read every reply before raising, so none is left for the next round
+        for conn in sent:
+            try:
+                answer = conn.recv()
+            except (EOFError, OSError) as e:
+                answer = e
+            if isinstance(answer, Exception):
+                error = error or answer
+            else:
+                results.extend(answer)
+        if error is not None:
+            # the replicas may have applied part of the changes: put the round
+            # back, and let new workers get all the facts and rules again
+            self.delta, self.new_rules = delta, new_rules
+            self.close()
+            raise error
+        results.sort(key=lambda result: result[0])
+
+        for key, relation in delta.items():
+            old = self.old.setdefault(key, Relation())
+            for fact in relation.facts:
+                old.add(fact)
+        self.rules.update(new_rules)
+
+        for index, joined in results:
+            rule = self._rules[joins[index // self.parts][0]]
+            for data, numbers in joined:
+                self.derive(decode(data), [self._facts[n] for n in numbers], rule, kb)
+
+    def _start(self):
+        """Start the worker processes
+        """
+        for _ in range(self.processes):
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=work, args=(child,))
+            process.daemon = True
+            process.start()
+            child.close()
+            self._workers.append((process, conn))
+
+    def close(self):
+        """Stop the worker processes. Another round starts new ones, which get
+            all the facts and rules again.
+        """
+        for process, conn in self._workers:
+            if process.is_alive():
+                try:
+                    conn.send(None)
+                except (EOFError, OSError):
+                    process.terminate()
+            conn.close()
+            process.join()
+        if self._workers:
+            self._workers = []
+            # new workers know nothing yet; facts taken back since the last
+            # round are still queued as old, and facts of a round put back
+            # go as new
+            pending = set(f for r in self.delta.values() for f in r.facts)
+            old_facts = dict((n, encode(f.statement)) for n, f in self._facts.items()
+                             if n < self._sent and f not in pending)
+            old_facts.update(self._old_facts)
+            self._old_facts = old_facts
+            self._removed_facts, self._removed_rules = [], []
+            self._new_rules = dict((n, ([encode(s) for s in r.lhs], encode(r.rhs)))
+                                   for n, r in self._rules.items())
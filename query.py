@@ -0,0 +1,126 @@
+from logical_classes import *
+from util import *
+
+verbose = 0
+
+def conjunction(statements):
+    """Normalize a conjunctive query, given like the LHS of a rule
+
+    Args:
+        statements (listof Statement|Fact|list): statements that must all hold,
+            as Statements, Facts or lists of a predicate and terms
+
+    Returns:
+        listof Statement
+    """
+    normalized = []
+    for statement in statements:
+        if factq(statement):
+            statement = statement.statement
+        elif not isinstance(statement, Statement):
+            statement = Statement(statement)
+        normalized.append(statement)
+    return normalized
+
+def select(statement, facts):
+    """Match one statement of a query against its candidate facts
+
+    Args:
+        statement (Statement): statement of the query
+        facts (iterable of Fact): candidate facts
+
+    Returns:
+        listof (dictof str, Fact): variable values of each matching fact, and the fact
+    """
+    plan = compile_pattern(statement)
+    rows = []
+    for fact in facts:
+        bindings = plan.match(fact.statement)
+        if bindings:
+            rows.append((bindings.bindings_dict, fact))
+    return rows
+
+def join_order(statements, sizes):
+    """Order the statements of a query for joining: start with the one
+        matching the fewest facts, then always take the smallest of those
+        sharing a variable with the statements joined so far, so no cross
+        product is made unless the query has unconnected parts
+
+    Args:
+        statements (listof Statement): statements of the query
+        sizes (listof int): number of facts matching each statement
+
+    Returns:
+        listof int: positions of the statements in join order
+    """
+    variables = [set(t.term.element for t in s.terms if is_var(t)) for s in statements]
+    remaining = set(range(len(statements)))
+    bound = set()
+    order = []
+    while remaining:
+        connected = [i for i in remaining if variables[i] & bound]
+        i = min(connected or remaining, key=lambda i: (sizes[i], i))
+        order.append(i)
+        remaining.discard(i)
+        bound |= variables[i]
+    return order
+
+def ask_conjunction(statements, facts_for):
+    """Find the bindings satisfying all the statements of a query at once,
+        with one pass over the candidate facts of each statement and hash
+        joins in join_order
+
+    Args:
+        statements (listof Statement): statements of the query
+        facts_for (function): gets the candidate facts of a statement
+
+    Returns:
+        ListOfBindings|list: bindings of each answer with the facts matching
+            each statement, in query order, or [] if there is none
+    """
+    # scan the smallest candidate sets first, so a statement nothing matches
+    # ends the query before the larger ones are looked at
+    candidates = [facts_for(s) for s in statements]
+    relations = [None] * len(statements)
+    for i in sorted(range(len(statements)), key=lambda i: len(candidates[i])):
+        relations[i] = select(statements[i], candidates[i])
+        if not relations[i]:
+            return []
+    order = join_order(statements, [len(r) for r in relations])
+    printv('Joining {!r} in order {}', 1, verbose, [statements, order])
+
+    bound = set()
+    partial = [({}, {})]
+    for i in order:
+        variables = list(dict.fromkeys(t.term.element for t in statements[i].terms if is_var(t)))
+        shared = [v for v in variables if v in bound]
+        index = {}
+        for values, fact in relations[i]:
+            index.setdefault(tuple(values[v] for v in shared), []).append((values, fact))
+        extended = []
+        for env, facts in partial:
+            for values, fact in index.get(tuple(env[v] for v in shared), ()):
+                env2 = dict(env)
+                env2.update(values)
+                facts2 = dict(facts)
+                facts2[i] = fact
+                extended.append((env2, facts2))
+        if not extended:
+            return []
+        partial = extended
+        bound.update(variables)
+
+    # list variables in the order they appear in the query
+    names = []
+    for statement in statements:
+        for t in statement.terms:
+            if is_var(t) and t.term.element not in names:
+                names.append(t.term.element)
+    answers = ListOfBindings()
+    for env, facts in partial:
+        bindings = Bindings()
+        for name in names:
+            if name in env:
+                bindings.add_binding(Variable(name), Term(env[name]).term)
+        answers.add_bindings(bindings, [facts[i] for i in range(len(statements))])
+    return answers
@@ -1,5 +1,29 @@
+import mmap, os, re
 from logical_classes import *
 
+# matches the tokens of a statement: parentheses, the arrow of a rule, and the
+# predicates, constants and variables in between (which may contain a '-')
+_TOKEN = re.compile(r'->|[()]|(?:[^\s()-]|-(?!>))+')
+
+class ParseError(ValueError):
+    """Raised when a fact or rule can't be parsed
+
+    Attributes:
+        line (int|None): line of the file the fact or rule starts on, if read
+            from a file
+    """
+    def __init__(self, message, line=None):
+        """Constructor for ParseError
+
+        Args:
+            message (str): what is wrong
+            line (int|None): line the fact or rule starts on
+        """
+        if line is not None:
+            message = "line {}: {}".format(line, message)
+        super(ParseError, self).__init__(message)
+        self.line = line
+
 # read_tokenize takes the name of a file, reads it in and tokenizes the
 # statements and rules in that file.
 def read_tokenize(file):
@@ -16,24 +40,105 @@ def read_tokenize(file):
     Returns:
         A list of Facts and Rules.
     """
-    file = open(file, "r")
-    elements = []
-    current = ""
-    for line in file:
-        if line[0:5] in ("fact:", "rule:"):
-            elements.append(current)
-            current = line.rstrip()
+    return list(iter_statements(file))
+
+def iter_statements(file, use_mmap=False):
+    """Reads a file like read_tokenize, but yields the Facts and Rules one at a
+    time as it goes, so only the one being read is held in memory. A fact or
+    rule may continue over several lines; blank lines and lines starting with
+    '#' are skipped.
+
+    Args:
+        file (str): name of the file to read
+        use_mmap (bool): map the file into memory instead of reading it
+
+    Yields:
+        Fact|Rule: the facts and rules of the file, in order
+
+    Raises:
+        ParseError: with the line the faulty fact or rule starts on
+    """
+    with open(file, "rb" if use_mmap else "r") as f:
+        buf = None
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            lines = (line.decode() for line in iter(buf.readline, b""))
+        elif use_mmap:
+            lines = ()
         else:
-            current = current + " " + line.rstrip().strip()
-    elements.append(current)
-    output = []
-    for e in elements:
-        parsed = parse_input(e)
-        if isinstance(parsed, Fact) or isinstance(parsed, Rule):
-            output.append(parsed)
-    file.close()
-    return output
+            lines = f
+        try:
+            current, start = None, 0
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                if line[0:5] in ("fact:", "rule:"):
+                    if current is not None:
+                        yield parse_statement(current, start)
+                    current, start = line, number
+                elif current is None:
+                    raise ParseError("expected 'fact:' or 'rule:', got {!r}".format(line), number)
+                else:
+                    current = current + " " + line
+            if current is not None:
+                yield parse_statement(current, start)
+        finally:
+            if buf is not None:
+                buf.close()
+
+def parse_statement(e, line=None):
+    """Parses a fact, e.g. "fact: (isa cube block)", or a rule, e.g.
+    "rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)". As before, statements
+    are the runs of terms between parentheses, so the nesting of the
+    parentheses around them is not checked.
 
+    Args:
+        e (string): fact or rule to parse, starting with 'fact:' or 'rule:'
+        line (int|None): line it starts on, for error messages
+
+    Returns:
+        Fact|Rule
+
+    Raises:
+        ParseError: if e has not the statements of a fact or rule
+    """
+    tokens = _TOKEN.findall(e, 5)
+    if e[0:5] == "fact:":
+        statements = _group(tokens)
+        if len(statements) != 1:
+            raise ParseError("expected 1 statement in fact, got {}".format(len(statements)), line)
+        return Fact(statements[0])
+    elif e[0:5] == "rule:":
+        if tokens.count("->") != 1:
+            raise ParseError("expected 1 '->' in rule, got {}".format(tokens.count("->")), line)
+        arrow = tokens.index("->")
+        lhs = _group(tokens[:arrow])
+        rhs = _group(tokens[arrow + 1:])
+        if not lhs:
+            raise ParseError("expected statements before '->'", line)
+        if len(rhs) != 1:
+            raise ParseError("expected 1 statement after '->', got {}".format(len(rhs)), line)
+        return Rule([lhs, rhs[0]])
+    raise ParseError("expected 'fact:' or 'rule:', got {!r}".format(e[0:5]), line)
+
+def _group(tokens):
+    """Split tokens into statements, the runs of tokens between parentheses
+
+    Returns:
+        listof (listof str): predicate and terms of each statement
+    """
+    statements, current = [], []
+    for token in tokens:
+        if token == "(" or token == ")":
+            if current:
+                statements.append(current)
+                current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
 
 def parse_input(e):
     """Parses input, assigning labels and splitting rules into LHS & RHS
@@ -42,7 +147,8 @@ def parse_input(e):
         e (string): Input string to parse
 
     Returns:
-        (number, string | listof string): label, then parsed input
+        Fact|Rule|string|None: the parsed fact or rule, the text of a comment,
+            or None for an empty input
     """
     if len(e) == 0:
         #return (BLANK, None)
@@ -50,17 +156,8 @@ def parse_input(e):
     elif e[0] == '#':
         #return (COMMENT, e)
         return e[1:]
-    elif e[0:5] == "fact:":
-        e = e[5:].replace(")", "").replace("(", "").rstrip().strip().split()
-        #return (FACT, e)
-        return Fact(e)
-    elif e[0:5] == "rule:":
-        e = e[5:].split("->")
-        rhs = e[1].replace(")", "").replace("(", "").rstrip().strip().split()
-        lhs = e[0].rstrip(") ").strip("( ").replace("(", "").split(")")
-        lhs = map(lambda x: x.rstrip().strip().split(), lhs)
-        #return (RULE, [lhs, rhs])
-        return Rule([lhs, rhs])
+    elif e[0:5] in ("fact:", "rule:"):
+        return parse_statement(e)
     else:
         print("PARSE ERROR: input header", e[0:5], "not recognized.")
 
@@ -0,0 +1,372 @@
+from collections import deque
+from logical_classes import *
+from util import *
+from student_code import InferenceEngine
+
+verbose = 0
+
+class AlphaNode(object):
+    """Alpha memory of a Rete network: holds the facts that pass the
+        intra-statement tests of one rule condition, e.g. (inst ?x cube).
+        Conditions that differ only in variable names share a node.
+
+    Attributes:
+        key ((str, int)): predicate and arity of the condition
+        variant (tuple): variant key of the condition, see util.variant_key
+        constants (listof (int, Term)): positions that must hold a given constant
+        equalities (listof (int, int)): pairs of positions that must hold the
+            same term, from variables repeated in the condition
+        facts (dictof Fact): facts passing the tests
+        successors (listof JoinNode): join nodes fed by this memory
+    """
+    def __init__(self, pattern):
+        """Constructor for AlphaNode
+
+        Args:
+            pattern (Statement): condition this node tests facts against
+        """
+        super(AlphaNode, self).__init__()
+        self.key = index_key(pattern)
+        self.variant = variant_key(pattern)
+        self.constants = []
+        self.equalities = []
+        first = {}
+        for pos, term in enumerate(pattern.terms):
+            if not is_var(term):
+                self.constants.append((pos, term))
+            elif term.term.element in first:
+                self.equalities.append((pos, first[term.term.element]))
+            else:
+                first[term.term.element] = pos
+        self.facts = {}
+        self.successors = []
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'AlphaNode({!r}, {!r}, {!r})'.format(self.key, self.constants, self.equalities)
+
+    def test(self, statement):
+        """Check whether a statement passes the tests of this node
+
+        Args:
+            statement (Statement): statement to test
+
+        Returns:
+            bool
+        """
+        terms = statement.terms
+        for pos, term in self.constants:
+            if terms[pos] != term:
+                return False
+        for pos, other in self.equalities:
+            if terms[pos] != terms[other]:
+                return False
+        return True
+
+class JoinNode(object):
+    """Join node of a Rete network, together with its beta memory. A token is
+        a tuple of facts matching the first conditions of a rule; the tokens of
+        this node extend the tokens of its parent with one fact from its alpha
+        memory. Parent tokens and alpha facts are hashed on the join variables,
+        so each activation only touches compatible partners.
+
+    Attributes:
+        parent (JoinNode|None): node holding the tokens we extend, None for
+            the first condition of a rule
+        alpha (AlphaNode): alpha memory providing the new fact of each token
+        tests (tupleof (int, int, int)): join tests (i, p, q): term p of the
+            i-th fact of the parent token equals term q of the new fact
+        tokens (dictof tuple): beta memory, tokens matched so far
+        children (listof JoinNode): nodes extending our tokens
+        rules (listof Rule): rules whose whole LHS is matched by our tokens
+    """
+    def __init__(self, parent, alpha, tests):
+        """Constructor for JoinNode
+
+        Args:
+            parent (JoinNode|None): parent node
+            alpha (AlphaNode): alpha memory
+            tests (tupleof (int, int, int)): join tests
+        """
+        super(JoinNode, self).__init__()
+        self.parent = parent
+        self.alpha = alpha
+        self.tests = tests
+        self.tokens = {}
+        self.children = []
+        self.rules = []
+        self.left = {}
+        self.right = {}
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'JoinNode({!r}, {!r}, {} tokens)'.format(self.alpha, self.tests, len(self.tokens))
+
+    def left_key(self, token):
+        """Values of the join variables in a parent token
+        """
+        return tuple(token[i].statement.terms[p] for i, p, _ in self.tests)
+
+    def right_key(self, fact):
+        """Values of the join variables in an alpha fact
+        """
+        return tuple(fact.statement.terms[q] for _, _, q in self.tests)
+
+class ReteEngine(InferenceEngine):
+    """Inference engine compiling rules into a Rete match network. Instead of
+        currying rules on every partial match, partial matches are kept as
+        tokens in beta memories, conditions are shared between rules, and
+        only the changes caused by a new fact or rule are propagated.
+
+        Inferred facts are supported by all the facts of the matching token
+        plus the rule, so kb_retract works the same as with the default engine.
+        Facts are expected to be ground (free of variables).
+
+    Attributes:
+        alpha_nodes (dictof AlphaNode): alpha memories by normalized condition
+        join_nodes (dictof JoinNode): join nodes by (parent, alpha, tests)
+        productions (dictof (JoinNode, list)): for each rule, the node matching
+            its LHS and how to build its RHS from a token
+    """
+    def __init__(self):
+        """Constructor for ReteEngine creating an empty network
+        """
+        super(ReteEngine, self).__init__()
+        self.alpha_nodes = {}
+        self.join_nodes = {}
+        self.productions = {}
+        self._alpha_index = {}
+        self._token_index = {}
+        self._activations = deque()
+        self._firing = False
+
+    def infer_from_fact(self, fact, kb):
+        """Propagate a fact that was just added to the KB through the network
+
+        Args:
+            fact (Fact) - A new fact in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        printv('Propagating {!r}', 1, verbose, [fact.statement])
+        for alpha in self._alpha_index.get(index_key(fact.statement), ()):
+            if fact not in alpha.facts and alpha.test(fact.statement):
+                alpha.facts[fact] = fact
+                for node in list(alpha.successors):
+                    self._right_activate(node, fact)
+        self._fire(kb)
+
+    def infer_from_rule(self, rule, kb):
+        """Compile a rule that was just added to the KB into the network, and
+            fire it on the tokens it already matches
+
+        Args:
+            rule (Rule) - A new rule in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        printv('Compiling {!r} => {!r}', 1, verbose, [rule.lhs, rule.rhs])
+        node = None
+        first = {}
+        for i, condition in enumerate(rule.lhs):
+            tests = []
+            for q, term in enumerate(condition.terms):
+                if is_var(term):
+                    loc = first.get(term.term.element)
+                    if loc is None:
+                        first[term.term.element] = (i, q)
+                    elif loc[0] < i:
+                        tests.append((loc[0], loc[1], q))
+            node = self._join_node(node, self._alpha_node(condition, kb), tuple(tests))
+
+        rhs = [first.get(t.term.element, t) if is_var(t) else t for t in rule.rhs.terms]
+        node.rules.append(rule)
+        self.productions[rule] = (node, rhs)
+        for token in node.tokens:
+            self._activations.append((rule, token))
+        self._fire(kb)
+
+    def forget(self, fact_rule, kb):
+        """Remove a retracted fact, and every token containing it, or a
+            retracted rule from the network, along with the nodes that only
+            fed that rule
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that was removed
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if isinstance(fact_rule, Rule):
+            node, _ = self.productions.pop(fact_rule, (None, None))
+            if node is not None:
+                node.rules.remove(fact_rule)
+                self._unlink(node)
+            return
+
+        for alpha in self._alpha_index.get(index_key(fact_rule.statement), ()):
+            if alpha.facts.pop(fact_rule, None) is not None:
+                for node in alpha.successors:
+                    bucket = node.right.get(node.right_key(fact_rule))
+                    if bucket:
+                        bucket.pop(fact_rule, None)
+
+        for node, token in list(self._token_index.pop(fact_rule, ())):
+            if node.tokens.pop(token, None) is None:
+                continue
+            self._unindex(node, token)
+            for child in node.children:
+                bucket = child.left.get(child.left_key(token))
+                if bucket:
+                    bucket.pop(token, None)
+
+    def restore(self, kb):
+        """Compile the rules of a KB whose facts were all inferred already,
+        filling the memories without firing anything
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        self._firing = True
+        try:
+            for rule in kb.rules:
+                self.infer_from_rule(rule, kb)
+        finally:
+            self._firing = False
+        self._activations.clear()
+
+    def recall(self, fact_rule, kb):
+        """Put a fact or rule that is back in the KB into the network again,
+            filling the memories without firing anything
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that is back
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        self._firing = True
+        try:
+            if isinstance(fact_rule, Rule):
+                self.infer_from_rule(fact_rule, kb)
+            else:
+                self.infer_from_fact(fact_rule, kb)
+        finally:
+            self._firing = False
+        self._activations.clear()
+
+    def _alpha_node(self, condition, kb):
+        """Get the alpha memory for a condition, creating and filling it from
+            the KB facts if needed
+        """
+        key = variant_key(condition)
+        alpha = self.alpha_nodes.get(key)
+        if alpha is None:
+            alpha = AlphaNode(condition)
+            self.alpha_nodes[key] = alpha
+            self._alpha_index.setdefault(alpha.key, []).append(alpha)
+            for fact in kb._facts_for(condition):
+                if alpha.test(fact.statement):
+                    alpha.facts[fact] = fact
+        return alpha
+
+    def _join_node(self, parent, alpha, tests):
+        """Get the join node extending parent with alpha, creating it and
+            computing its tokens from the existing memories if needed
+        """
+        key = (parent, alpha, tests)
+        node = self.join_nodes.get(key)
+        if node is None:
+            node = JoinNode(parent, alpha, tests)
+            self.join_nodes[key] = node
+            alpha.successors.append(node)
+            for fact in alpha.facts:
+                node.right.setdefault(node.right_key(fact), {})[fact] = fact
+            if parent is None:
+                for fact in alpha.facts:
+                    self._emit(node, (fact,))
+            else:
+                parent.children.append(node)
+                for token in list(parent.tokens):
+                    self._left_activate(node, token)
+        return node
+
+    def _unlink(self, node):
+        """Remove a join node that no longer feeds any rule or child, then its
+            parent and alpha memory if they no longer feed anything either
+        """
+        while node is not None and not node.rules and not node.children:
+            printv('Unlinking {!r}', 1, verbose, [node])
+            del self.join_nodes[(node.parent, node.alpha, node.tests)]
+            for token in node.tokens:
+                self._unindex(node, token)
+            alpha = node.alpha
+            alpha.successors.remove(node)
+            if not alpha.successors:
+                del self.alpha_nodes[alpha.variant]
+                self._alpha_index[alpha.key].remove(alpha)
+                if not self._alpha_index[alpha.key]:
+                    del self._alpha_index[alpha.key]
+            if node.parent is not None:
+                node.parent.children.remove(node)
+            node = node.parent
+
+    def _unindex(self, node, token):
+        """Drop a token of node from the token index
+        """
+        for fact in token:
+            entries = self._token_index.get(fact)
+            if entries is not None:
+                entries.pop((node, token), None)
+                if not entries:
+                    del self._token_index[fact]
+
+    def _right_activate(self, node, fact):
+        """A new fact entered the alpha memory of node
+        """
+        if node.parent is None:
+            self._emit(node, (fact,))
+            return
+        key = node.right_key(fact)
+        node.right.setdefault(key, {})[fact] = fact
+        for token in list(node.left.get(key, ())):
+            self._emit(node, token + (fact,))
+
+    def _left_activate(self, node, token):
+        """A new token entered the beta memory of the parent of node
+        """
+        key = node.left_key(token)
+        node.left.setdefault(key, {})[token] = token
+        for fact in list(node.right.get(key, ())):
+            self._emit(node, token + (fact,))
+
+    def _emit(self, node, token):
+        """Store a new token in node and pass it on to its children and rules
+        """
+        if token in node.tokens:
+            return
+        node.tokens[token] = token
+        for fact in token:
+            self._token_index.setdefault(fact, {})[(node, token)] = None
+        for child in list(node.children):
+            self._left_activate(child, token)
+        for rule in node.rules:
+            self._activations.append((rule, token))
+
+    def _fire(self, kb):
+        """Fire pending rule activations, asserting the inferred facts. Facts
+            inferred while firing are propagated right away, but their
+            activations are queued here rather than fired recursively.
+        """
+        if self._firing:
+            return
+        self._firing = True
+        try:
+            while self._activations:
+                rule, token = self._activations.popleft()
+                node, rhs = self.productions.get(rule, (None, None))
+                if node is None or token not in node.tokens:
+                    continue
+                terms = [token[t[0]].statement.terms[t[1]] if isinstance(t, tuple) else t
+                         for t in rhs]
+                statement = Statement([rule.rhs.predicate] + terms)
+                printv('Firing {!r} => {!r}', 1, verbose, [rule.lhs, statement])
+                self.derive(statement, token, rule, kb)
+        finally:
+            self._firing = False
@@ -0,0 +1,364 @@
+"""Serve a knowledge base over TCP or a Unix socket with asyncio, one request
+per line and one response line per request:
+
+    assert fact: (isa cube block)          -> ok
+    assert rule: ((isa ?x ?y)) -> (inst ?x ?y)
+    retract fact: (isa cube block)         -> ok
+    ask fact: (isa ?X block)               -> yes ?X : cube | ?X : sphere
+                                           -> yes (ground fact), no
+    stats                                  -> latency percentiles per command
+
+Bad requests get "error <message>". Asserts and retracts of all clients are
+queued and applied in batches, each run of asserts or of retracts with one
+kb_assert_many or kb_retract_many in a worker thread, while asks are answered from the latest published version
+of the KB (see mvcc.Versions), so they never wait for inference. A request
+is answered once its run is applied, so a client sees its own changes, and
+a run that fails only fails its own requests.
+
+Usage: python server.py [--host HOST] [--port PORT] [--unix PATH] [--load FILE]
+"""
+import argparse, asyncio, math, time
+from collections import deque
+import read
+from logical_classes import *
+from util import *
+from student_code import KnowledgeBase
+
+verbose = 0
+
+COMMANDS = ['assert', 'retract', 'ask']
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty sorted list
+
+    Args:
+        values (list): sorted values
+        p (float): percentile, between 0 and 100
+
+    Returns:
+        the value at the percentile
+    """
+    rank = max(0, math.ceil(p / 100.0 * len(values)) - 1)
+    return values[rank]
+
+class KBServer(object):
+    """Line protocol server for a versioned KnowledgeBase
+
+    Attributes:
+        kb (KnowledgeBase): the KB served, publishing versions
+        max_batch (int): most changes applied in one batch
+        latencies (dictof deque): seconds taken to answer the last requests,
+            by command
+        batches (int): batches of changes applied
+        changes (int): changes applied
+    """
+    def __init__(self, kb=None, max_batch=1000, window=10000):
+        """Constructor for KBServer
+
+        Args:
+            kb (KnowledgeBase|None): the KB to serve, made with versioned=True;
+                a new empty one by default
+            max_batch (int): most changes applied in one batch
+            window (int): latencies kept per command for the percentiles
+
+        Raises:
+            ValueError: if the KB does not publish versions
+        """
+        super(KBServer, self).__init__()
+        self.kb = kb if kb is not None else KnowledgeBase([], [], versioned=True)
+        if self.kb.versions is None:
+            raise ValueError("the served KB must be made with versioned=True")
+        self.max_batch = max_batch
+        self.latencies = dict((command, deque(maxlen=window)) for command in COMMANDS)
+        self.batches = 0
+        self.changes = 0
+        self._queue = None
+        self._writer = None
+        self._server = None
+        # streams of the open connections, to close when closing
+        self._connections = set()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """Start listening, on a Unix socket if a path is given
+
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on, 0 for any free one
+            path (str|None): Unix socket to listen on instead
+
+        Returns:
+            asyncio.AbstractServer: the listening server
+        """
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.ensure_future(self._write())
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        printv("Serving on {}", 0, verbose, [self._server.sockets[0].getsockname()])
+        return self._server
+
+    async def close(self):
+        """Stop listening and applying changes. Changes still queued are not
+        applied, and their requests are answered with an error; changes being
+        applied are answered once they are.
+        """
+        if self._server is not None:
+            self._server.close()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, done = self._queue.get_nowait()
+                if not done.done():
+                    done.set_result('error server closed')
+        if self._server is not None:
+            # let the connections send the answers just given, then close
+            # them: wait_closed waits for every connection to be closed
+            await asyncio.sleep(0)
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+
+    def stats(self):
+        """Latency percentiles of the requests answered lately
+
+        Returns:
+            dictof (int, float, float, float): for each command answered, the
+                number of requests and their 50th, 90th and 99th percentile
+                latencies in seconds
+        """
+        stats = {}
+        for command in COMMANDS:
+            values = sorted(self.latencies[command])
+            if values:
+                stats[command] = (len(values), percentile(values, 50),
+                                  percentile(values, 90), percentile(values, 99))
+        return stats
+
+    async def request(self, line):
+        """Answer one request
+
+        Args:
+            line (str): the request, without the line end
+
+        Returns:
+            str: the response, without the line end
+        """
+        command, _, rest = line.strip().partition(' ')
+        if command == 'stats':
+            return self._format_stats()
+        if command not in COMMANDS:
+            return 'error unknown command {!r}'.format(command)
+        start = time.perf_counter()
+        try:
+            item = read.parse_statement(rest.strip())
+        except read.ParseError as e:
+            return 'error {}'.format(e)
+        if command == 'ask':
+            response = self._ask(item)
+        elif self._writer is None or self._writer.done():
+            return 'error server closed'
+        else:
+            done = asyncio.get_running_loop().create_future()
+            await self._queue.put((command, item, done))
+            response = await done
+        self.latencies[command].append(time.perf_counter() - start)
+        return response
+
+    def _ask(self, item):
+        """Answer an ask from the current version of the KB
+        """
+        if not isinstance(item, Fact):
+            return 'error only facts can be asked'
+        answer = self.kb.versions.current.kb_ask(item)
+        if not answer:
+            return 'no'
+        bindings = [str(binding) for binding, _ in answer.list_of_bindings if binding.bindings]
+        return 'yes ' + ' | '.join(bindings) if bindings else 'yes'
+
+    def _format_stats(self):
+        """Format the latency percentiles as a response
+        """
+        parts = []
+        for command, (n, p50, p90, p99) in sorted(self.stats().items()):
+            parts.append('{} n={} p50={:.3f}ms p90={:.3f}ms p99={:.3f}ms'.format(
+                command, n, p50 * 1000, p90 * 1000, p99 * 1000))
+        parts.append('batches={} changes={}'.format(self.batches, self.changes))
+        return ' | '.join(parts)
+
+    async def _handle(self, reader, writer):
+        """Answer the requests of one connection, in order
+        """
+        self._connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.request(line.decode('utf-8'))
+                writer.write(response.encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            # the client went away, or the server closed the connection
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _write(self):
+        """Apply the queued changes in batches, in a worker thread, taking
+        whatever was queued while the last batch was applied, and answer the
+        requests of each run of asserts or retracts once it is applied
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty() and len(batch) < self.max_batch:
+                batch.append(self._queue.get_nowait())
+            runs = self._runs(batch)
+            try:
+                while runs:
+                    run = runs.pop(0)
+                    applying = loop.run_in_executor(None, self._apply, run)
+                    try:
+                        await asyncio.shield(applying)
+                        response = 'ok'
+                    except asyncio.CancelledError:
+                        # the worker thread applies the run all the same:
+                        # answer it once it is done
+                        self._answer(run, await self._applied(applying))
+                        raise
+                    except Exception as e:
+                        response = 'error {}'.format(e)
+                    self._answer(run, response)
+            except asyncio.CancelledError:
+                for run in runs:
+                    self._answer(run, 'error server closed')
+                raise
+            self.batches += 1
+            self.changes += len(batch)
+
+    async def _applied(self, applying):
+        """Wait for a run being applied in the worker thread, and get the
+        response to its requests
+        """
+        try:
+            await applying
+            return 'ok'
+        except Exception as e:
+            return 'error {}'.format(e)
+
+    def _answer(self, run, response):
+        """Answer the requests of a run
+        """
+        for _, _, done in run:
+            if not done.done():
+                done.set_result(response)
+
+    def _runs(self, batch):
+        """Split a batch into runs of asserts and of retracts, in the order
+        they were queued
+        """
+        runs = []
+        for change in batch:
+            if runs and runs[-1][0][0] == change[0]:
+                runs[-1].append(change)
+            else:
+                runs.append([change])
+        return runs
+
+    def _apply(self, run):
+        """Apply a run of asserts or of retracts to the KB
+        """
+        printv("Applying {} changes", 1, verbose, [len(run)])
+        items = [item for _, item, _ in run]
+        if run[0][0] == 'assert':
+            self.kb.kb_assert_many(items)
+        else:
+            self.kb.kb_retract_many(items)
+
+class Client(object):
+    """Client for a KBServer, sending one request at a time
+    """
+    def __init__(self, reader, writer):
+        """Constructor for Client, see connect
+
+        Args:
+            reader (asyncio.StreamReader): stream of the responses
+            writer (asyncio.StreamWriter): stream of the requests
+        """
+        super(Client, self).__init__()
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=None, path=None):
+        """Connect to a server over TCP, or over a Unix socket if a path is
+        given
+
+        Returns:
+            Client
+        """
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, line):
+        """Send a request and wait for its response
+
+        Args:
+            line (str): the request, e.g. "ask fact: (isa ?X block)"
+
+        Returns:
+            str: the response, without the line end
+        """
+        self.writer.write(line.encode('utf-8') + b'\n')
+        await self.writer.drain()
+        response = await self.reader.readline()
+        return response.decode('utf-8').rstrip('\n')
+
+    async def close(self):
+        """Close the connection
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def serve(server, host, port, path):
+    """Run a server until cancelled
+    """
+    listening = await server.start(host, port, path)
+    print('Serving on {}'.format(listening.sockets[0].getsockname()))
+    try:
+        await listening.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a knowledge base.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4848)
+    parser.add_argument('--unix', help='Unix socket to listen on instead of TCP')
+    parser.add_argument('--load', action='append', default=[], help='statements file to load first')
+    args = parser.parse_args(argv)
+
+    kb = KnowledgeBase([], [], versioned=True)
+    for file in args.load:
+        kb.load(file)
+    try:
+        asyncio.run(serve(KBServer(kb), args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
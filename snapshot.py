@@ -0,0 +1,215 @@
+import array, struct, sys
+from logical_classes import *
+from util import *
+from student_code import KnowledgeBase, FIFO, LIFO
+from tms import SupportCounting, DRed
+
+verbose = 0
+
+# A snapshot is MAGIC followed by sections, each a little-endian uint32 count
+# and that many uint32s:
+#   symbols    utf-8 length of each symbol, then a section of their bytes
+#              (counted in bytes rather than uint32s)
+#   statements for each statement: arity, predicate symbol, term symbols
+#   facts      for each fact: statement, asserted
+#   rules      for each rule: number of LHS statements, LHS statements, RHS
+#              statement, asserted
+#   lazy       lazy predicates (symbols), then lazy rules as in rules
+#   supports   for each fact then each rule: number of justifications, then
+#              for each its size and members (facts are numbered first, then
+#              rules)
+#   meta       agenda strategy (0 FIFO, 1 LIFO), truth maintenance (0
+#              SupportCounting, 1 DRed), ask cache size
+# Symbols and statements are numbered in order of first use, so a snapshot
+# only holds the ones the KB refers to.
+MAGIC = b'KBSNAP1\n'
+
+STRATEGIES = [FIFO, LIFO]
+
+TMS = [SupportCounting, DRed]
+
+class SnapshotError(ValueError):
+    """Raised when a file is not a snapshot, or not one this version reads
+    """
+    pass
+
+def save(kb, file):
+    """Write a snapshot of a KB: its facts, rules and lazy rules, the
+    justifications of the facts and rules, and its settings. Inferred facts
+    and curried rules are saved like any other, so loading the snapshot gives
+    back the same KB without inferring anything.
+
+    Args:
+        kb (KnowledgeBase): KB to save, not in the middle of inferring
+        file (str): name of the file to write
+    """
+    if kb._agenda:
+        raise ValueError("can't snapshot a KB with facts or rules left to infer from")
+    printv('Saving {} facts and {} rules to {}', 0, verbose, [len(kb.facts), len(kb.rules), file])
+    symbol_ids, statement_ids = {}, {}
+    names, statements = [], array.array('I')
+
+    def symbol(name):
+        i = symbol_ids.get(name)
+        if i is None:
+            i = symbol_ids[name] = len(names)
+            names.append(name.encode('utf-8'))
+        return i
+
+    def statement(s):
+        i = statement_ids.get(s)
+        if i is None:
+            i = statement_ids[s] = len(statement_ids)
+            statements.append(len(s.terms))
+            statements.append(symbol(s.predicate))
+            statements.extend(symbol(t.term.element) for t in s.terms)
+        return i
+
+    def rules_section(rules):
+        section = array.array('I')
+        for rule in rules:
+            section.append(len(rule.lhs))
+            section.extend(statement(s) for s in rule.lhs)
+            section.append(statement(rule.rhs))
+            section.append(int(bool(rule.asserted)))
+        return section
+
+    facts = array.array('I')
+    for fact in kb.facts:
+        facts.append(statement(fact.statement))
+        facts.append(int(bool(fact.asserted)))
+    rules = rules_section(kb.rules)
+    lazy = array.array('I', sorted(symbol(p) for p in kb.lazy_predicates))
+    lazy_rules = rules_section(kb.lazy_rules)
+
+    # facts and rules are identified by their position, facts first
+    nodes = {}
+    for fact_rule in list(kb.facts) + list(kb.rules):
+        nodes[id(fact_rule)] = len(nodes)
+    supports = array.array('I')
+    for fact_rule in list(kb.facts) + list(kb.rules):
+        supports.append(len(fact_rule.supported_by))
+        for pair in fact_rule.supported_by:
+            supports.append(len(pair))
+            for member in pair:
+                if id(member) not in nodes:
+                    raise ValueError("{!r} is supported by {!r}, which is not in the KB".format(
+                        fact_rule, member))
+                supports.append(nodes[id(member)])
+
+    meta = array.array('I', [STRATEGIES.index(kb.strategy), TMS.index(type(kb.tms)),
+                             kb.ask_cache_size])
+    with open(file, 'wb') as f:
+        f.write(MAGIC)
+        _write(f, array.array('I', [len(name) for name in names]))
+        _write(f, b''.join(names))
+        for section in (statements, facts, rules, lazy, lazy_rules, supports, meta):
+            _write(f, section)
+
+def load(file, engine=None, tms=None):
+    """Load a KB from a snapshot written by save. The facts, rules and support
+    links are the same as in the saved KB, so later assertions and retractions
+    behave the same too.
+
+    Args:
+        file (str): name of the file to read
+        engine (InferenceEngine|None): engine for the new KB, as for the
+            KnowledgeBase constructor; its state is rebuilt from the KB
+        tms (SupportCounting|DRed|None): truth maintenance for the new KB, by
+            default a new one of the kind the saved KB used
+
+    Returns:
+        KnowledgeBase
+    """
+    with open(file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError("{} is not a KB snapshot".format(file))
+        lengths = _read(f, file)
+        blob = _read(f, file, raw=True)
+        statements, facts, rules, lazy, lazy_rules, supports, meta = [
+            _read(f, file) for _ in range(7)]
+
+    names, pos = [], 0
+    for n in lengths:
+        names.append(blob[pos:pos + n].decode('utf-8'))
+        pos += n
+    table, i = [], 0
+    while i < len(statements):
+        n = statements[i]
+        table.append(Statement([names[k] for k in statements[i + 1:i + n + 2]]))
+        i += n + 2
+
+    # snapshots written before the truth maintenance and ask cache size were
+    # saved only have the strategy
+    if tms is None:
+        tms = TMS[meta[1]]() if len(meta) > 1 else SupportCounting()
+    kb = KnowledgeBase([], [], engine=engine, strategy=STRATEGIES[meta[0]],
+                       lazy=[names[k] for k in lazy], tms=tms,
+                       ask_cache_size=meta[2] if len(meta) > 2 else 256)
+    nodes = []
+    for i in range(0, len(facts), 2):
+        fact = Fact(table[facts[i]])
+        fact.asserted = bool(facts[i + 1])
+        kb._store_fact(fact)
+        nodes.append(fact)
+    for rule in _rules(rules, table):
+        kb._store_rule(rule)
+        nodes.append(rule)
+    for rule in _rules(lazy_rules, table):
+        kb._store_lazy_rule(rule)
+
+    i = 0
+    for fact_rule in nodes:
+        for _ in range(supports[i]):
+            n = supports[i + 1]
+            pair = [nodes[k] for k in supports[i + 2:i + n + 2]]
+            fact_rule.supported_by.append(pair)
+            for member in {id(m): m for m in pair}.values():
+                if isinstance(fact_rule, Fact):
+                    member.supports_facts.append(fact_rule)
+                else:
+                    member.supports_rules.append(fact_rule)
+            i += n + 1
+        i += 1
+
+    kb.ie.restore(kb)
+    printv('Loaded {} facts and {} rules from {}', 0, verbose, [len(kb.facts), len(kb.rules), file])
+    return kb
+
+def _rules(section, table):
+    """Build the rules of a rules section
+    """
+    i = 0
+    while i < len(section):
+        n = section[i]
+        rule = Rule([[table[k] for k in section[i + 1:i + n + 1]], table[section[i + n + 1]]])
+        rule.asserted = bool(section[i + n + 2])
+        yield rule
+        i += n + 3
+
+def _write(f, section):
+    """Write a section: its length, then its uint32s (or bytes) little-endian
+    """
+    f.write(struct.pack('<I', len(section)))
+    if isinstance(section, array.array) and sys.byteorder == 'big':
+        section = array.array('I', section)
+        section.byteswap()
+    f.write(section if isinstance(section, bytes) else section.tobytes())
+
+def _read(f, file, raw=False):
+    """Read a section written by _write
+    """
+    header = f.read(4)
+    if len(header) != 4:
+        raise SnapshotError("{} is truncated".format(file))
+    n = struct.unpack('<I', header)[0]
+    data = f.read(n if raw else 4 * n)
+    if len(data) != (n if raw else 4 * n):
+        raise SnapshotError("{} is truncated".format(file))
+    if raw:
+        return data
+    section = array.array('I')
+    section.frombytes(data)
+    if sys.byteorder == 'big':
+        section.byteswap()
+    return section
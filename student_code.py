@@ -1,17 +1,76 @@
-import read, copy
+import read, copy, time, contextlib
+from collections import deque, OrderedDict
 from util import *
 from logical_classes import *
+from backward import TabledProver
+from query import conjunction, ask_conjunction
+from closure import ClosureIndex
+from tms import SupportCounting
+from mvcc import Versions
 
 verbose = 0
 
+# agenda strategies: breadth-first (oldest new fact/rule first) or depth-first
+FIFO = 'fifo'
+LIFO = 'lifo'
+
+# context for changing a KB that does not publish versions
+_NO_LOCK = contextlib.nullcontext()
+
 class KnowledgeBase(object):
-    def __init__(self, facts=[], rules=[]):
-        self.facts = facts
-        self.rules = rules
-        self.ie = InferenceEngine()
+    def __init__(self, facts=[], rules=[], engine=None, strategy=FIFO, lazy=(), ask_cache_size=256,
+                 metrics=None, tms=None, versioned=False):
+        # facts and rules map each (hashable) fact/rule to the KB's own instance,
+        # so they double as ordered sets with O(1) lookup and removal
+        self.facts = {}
+        self.rules = {}
+        # rules concluding a lazy predicate are not forward-chained; asking
+        # about the predicate chains backwards through them instead. A rule
+        # using a lazy predicate makes its conclusion lazy too, see _make_lazy
+        self.lazy_predicates = set(lazy)
+        self.lazy_rules = {}
+        # answers asks about lazy predicates defined by transitivity and
+        # inheritance rules by walking their facts
+        self.closure = ClosureIndex()
+        self.ie = engine if engine is not None else InferenceEngine()
+        self.strategy = strategy
+        # truth maintenance strategy updating the KB on retraction
+        self.tms = tms if tms is not None else SupportCounting()
+        self._fact_index = {}
+        self._rule_index = {}
+        # new facts/rules waiting to be forward-chained from; inference draws
+        # from this agenda in a loop instead of recursing through kb_assert
+        self._agenda = deque()
+        self._pending = {}
+        self._inferring = False
+        # dropped justifications per fact/rule, by id, see _cascade
+        self._stale = {}
+        # LRU cache of the facts answering kb_ask queries by variant key of the
+        # query, stamped with the generation of the facts of its predicate and
+        # arity
+        self.ask_cache_size = ask_cache_size
+        self.ask_cache_hits = 0
+        self.ask_cache_misses = 0
+        self._ask_cache = OrderedDict()
+        self._generations = {}
+        # metrics.Metrics collecting counters and events, or None
+        self.metrics = metrics
+        # undo log of the open transactions, or None, and for each of them
+        # where it starts in the log and the facts/rules it saved, see begin
+        self._undo = None
+        self._savepoints = []
+        # versions published for readers in other threads, or None
+        self.versions = Versions() if versioned else None
+        for fact in facts:
+            self._store_fact(fact)
+        for rule in rules:
+            self._store_rule(rule)
+        if self.versions is not None:
+            self.versions.rules_dirty = True
+            self.versions.publish(self)
 
     def __repr__(self):
-        return 'KnowledgeBase({!r}, {!r})'.format(self.facts, self.rules)
+        return 'KnowledgeBase({!r}, {!r})'.format(list(self.facts), list(self.rules))
 
     def __str__(self):
         string = "Knowledge Base: \n"
@@ -29,9 +88,7 @@ class KnowledgeBase(object):
         Returns:
             Fact: matching fact
         """
-        for kbfact in self.facts:
-            if fact == kbfact:
-                return kbfact
+        return self.facts.get(fact)
 
     def _get_rule(self, rule):
         """INTERNAL USE ONLY
@@ -43,9 +100,197 @@ class KnowledgeBase(object):
         Returns:
             Rule: matching rule
         """
-        for kbrule in self.rules:
-            if rule == kbrule:
-                return kbrule
+        return self.rules.get(rule)
+
+    def _facts_for(self, statement):
+        """INTERNAL USE ONLY
+        Get the facts in the KB that could match the statement argument, i.e.
+        the facts sharing its predicate and arity
+
+        Args:
+            statement (Statement): Statement we're looking up
+
+        Returns:
+            iterable of Fact: candidate facts
+        """
+        return self._fact_index.get(index_key(statement), ())
+
+    def _rules_for(self, statement):
+        """INTERNAL USE ONLY
+        Get the rules in the KB whose first LHS statement could match the
+        statement argument, i.e. shares its predicate and arity
+
+        Args:
+            statement (Statement): Statement we're looking up
+
+        Returns:
+            iterable of Rule: candidate rules
+        """
+        return self._rule_index.get(index_key(statement), ())
+
+    def _store_fact(self, fact):
+        """INTERNAL USE ONLY
+        Add the fact to the KB and to the fact index, without inferring anything
+
+        Args:
+            fact (Fact): Fact to add
+        """
+        self.facts[fact] = fact
+        if self._undo is not None:
+            self._undo.append(('store', fact))
+        key = index_key(fact.statement)
+        self._fact_index.setdefault(key, {})[fact] = fact
+        self._generations[key] = self._generations.get(key, 0) + 1
+        if self.versions is not None:
+            self.versions.stored(key, fact)
+        if key in self.closure.graphs:
+            self.closure.add_fact(fact)
+
+    def _store_rule(self, rule):
+        """INTERNAL USE ONLY
+        Add the rule to the KB and to the rule index, without inferring anything
+
+        Args:
+            rule (Rule): Rule to add
+        """
+        self.rules[rule] = rule
+        if self._undo is not None:
+            self._undo.append(('store', rule))
+        self._rule_index.setdefault(index_key(rule.lhs[0]), {})[rule] = rule
+
+    def _store_lazy_rule(self, rule):
+        """INTERNAL USE ONLY
+        Add a rule concluding a lazy predicate, which is only chained through
+        backwards when asking
+
+        Args:
+            rule (Rule): Rule to add
+        """
+        if rule not in self.lazy_rules:
+            self.lazy_rules[rule] = rule
+            self.closure.add_rule(rule, self)
+            if self._undo is not None:
+                self._undo.append(('store lazy', rule))
+        elif self._undo is not None:
+            self._touch(self.lazy_rules[rule])
+        self.lazy_rules[rule].asserted = True
+
+    def _make_lazy(self, predicate):
+        """INTERNAL USE ONLY
+        Make a predicate lazy, and so the conclusions of the asserted rules
+        using it: forward-chained, those rules would only ever see the facts of
+        the predicate that were asserted, never the ones proved when asking.
+        Such rules already in the KB are taken out, with what they inferred,
+        and kept as lazy rules instead.
+
+        Args:
+            predicate (str): predicate to make lazy
+        """
+        queue = [predicate]
+        while queue:
+            predicate = queue.pop()
+            if predicate in self.lazy_predicates:
+                continue
+            printv("Making {} lazy", 0, verbose, [predicate])
+            self.lazy_predicates.add(predicate)
+            if self._undo is not None:
+                self._undo.append(('lazy predicate', predicate))
+            using = [rule for rule in self.rules
+                     if rule.asserted and any(s.predicate == predicate for s in rule.lhs)]
+            for rule in using:
+                # it may not have been inferred from yet
+                self._pending.pop(rule, None)
+                self.tms.retract([self._unassert(rule)], self)
+                self._store_lazy_rule(rule)
+                queue.append(rule.rhs.predicate)
+
+    def _schedule(self, fact_rule):
+        """INTERNAL USE ONLY
+        Put a fact or rule that was just stored on the agenda
+
+        Args:
+            fact_rule (Fact|Rule): Fact or rule to infer from
+        """
+        self._pending[fact_rule] = fact_rule
+        self._agenda.append(fact_rule)
+
+    def _is_pending(self, fact_rule):
+        """INTERNAL USE ONLY
+        Check whether a fact or rule is in the KB but has not been inferred from
+        yet. Engines skip pending facts/rules when pairing, since each pair is
+        considered once the later of the two comes off the agenda.
+
+        Args:
+            fact_rule (Fact|Rule): Fact or rule to check
+
+        Returns:
+            bool
+        """
+        return fact_rule in self._pending
+
+    def _infer(self):
+        """INTERNAL USE ONLY
+        Forward-chain until the agenda is empty, taking facts and rules off it
+        in the order given by self.strategy. Re-entrant calls (from facts and
+        rules asserted by the engine) return right away, the outer loop picks
+        up what they scheduled. Whenever the agenda runs dry the engine gets a
+        chance to do set-at-a-time work, which may schedule more.
+        """
+        if self._inferring:
+            return
+        self._inferring = True
+        try:
+            while self._agenda:
+                while self._agenda:
+                    fact_rule = self._agenda.pop() if self.strategy == LIFO else self._agenda.popleft()
+                    if self._pending.pop(fact_rule, None) is None:
+                        continue
+                    if isinstance(fact_rule, Fact):
+                        self.ie.infer_from_fact(fact_rule, self)
+                    else:
+                        self.ie.infer_from_rule(fact_rule, self)
+                self.ie.saturate(self)
+        finally:
+            self._inferring = False
+
+    def _remove_fact(self, fact):
+        """INTERNAL USE ONLY
+        Remove the fact from the KB and from the fact index
+
+        Args:
+            fact (Fact): Fact to remove
+        """
+        del self.facts[fact]
+        if self._undo is not None:
+            self._touch(fact)
+            self._undo.append(('remove', fact))
+        key = index_key(fact.statement)
+        bucket = self._fact_index[key]
+        del bucket[fact]
+        if not bucket:
+            del self._fact_index[key]
+        self._generations[key] = self._generations.get(key, 0) + 1
+        if self.versions is not None:
+            self.versions.removed(key)
+        if key in self.closure.graphs:
+            self.closure.remove_fact(fact)
+
+    def _remove_rule(self, rule):
+        """INTERNAL USE ONLY
+        Remove the rule from the KB and from the rule index
+
+        Args:
+            rule (Rule): Rule to remove
+        """
+        del self.rules[rule]
+        if self._undo is not None:
+            self._touch(rule)
+            self._undo.append(('remove', rule))
+        key = index_key(rule.lhs[0])
+        bucket = self._rule_index[key]
+        del bucket[rule]
+        if not bucket:
+            del self._rule_index[key]
 
     def kb_add(self, fact_rule):
         """Add a fact or rule to the KB
@@ -54,33 +299,109 @@ class KnowledgeBase(object):
         Returns:
             None
         """
-        printv("Adding {!r}", 1, verbose, [fact_rule])
+        with self._writing():
+            self._add(fact_rule)
+            self._infer()
+
+    def _writing(self):
+        """INTERNAL USE ONLY
+        Get a context for changing the KB. If the KB publishes versions, it
+        holds the writer lock, and publishes a version on leaving once the
+        change is complete: inference is done and no transaction is open.
+
+        Returns:
+            context manager
+        """
+        if self.versions is None:
+            return _NO_LOCK
+        return self._publishing()
+
+    @contextlib.contextmanager
+    def _publishing(self):
+        """INTERNAL USE ONLY
+        Context for _writing when the KB publishes versions
+        """
+        with self.versions.lock:
+            yield
+            if not self._inferring and not self._savepoints:
+                self.versions.publish(self)
+
+    def _add(self, fact_rule):
+        """INTERNAL USE ONLY
+        Add a fact or rule to the KB, or merge it into the KB's instance if it
+        is already there, and schedule it for inference without inferring yet
+
+        Args:
+            fact_rule (Fact|Rule) - the fact or rule to be added
+        """
+        # hot path: skip building printv's arguments unless verbose
+        if verbose > 1:
+            printv("Adding {!r}", 1, verbose, [fact_rule])
+        if self.versions is not None and isinstance(fact_rule, Rule) and not fact_rule.supported_by:
+            self.versions.rules_dirty = True
+        if self._undo is not None:
+            # the engine links the justification to what it justifies
+            for pair in fact_rule.supported_by:
+                for supporter in pair:
+                    self._touch(supporter)
         if isinstance(fact_rule, Fact):
-            if fact_rule not in self.facts: # if the new statement (fact or rule) is not in facts
-                self.facts.append(fact_rule) # add it to the kb
-                for rule in self.rules:
-                    self.ie.fc_infer(fact_rule, rule, self) # infer new things from the new fact
+            kbfact = self._get_fact(fact_rule)
+            if kbfact is None: # if the new statement (fact or rule) is not in facts
+                self._renew(fact_rule)
+                self._store_fact(fact_rule) # add it to the kb
+                self._schedule(fact_rule) # infer new things from the new fact
             else:
+                if self._undo is not None:
+                    self._touch(kbfact)
                 if fact_rule.supported_by: # if the new statement is already in the kb and is supported_by stuff
-                    ind = self.facts.index(fact_rule) # find the index of that fact that already is inside the kb
                     for f in fact_rule.supported_by: # for every fact that supports this fact_rule
-                        self.facts[ind].supported_by.append(f)
-                else:
-                    ind = self.facts.index(fact_rule) # if the new fact-rule is already in the kb but is not supported by anything
-                    self.facts[ind].asserted = True # consider it as asserted and so cannot be removed already
+                        kbfact.supported_by.append(f)
+                else: # if the new fact-rule is already in the kb but is not supported by anything
+                    kbfact.asserted = True # consider it as asserted and so cannot be removed already
+        elif isinstance(fact_rule, Rule) and (fact_rule.rhs.predicate in self.lazy_predicates or
+                                              any(s.predicate in self.lazy_predicates for s in fact_rule.lhs)):
+            self._make_lazy(fact_rule.rhs.predicate)
+            self._store_lazy_rule(fact_rule)
         elif isinstance(fact_rule, Rule):
-            if fact_rule not in self.rules:
-                self.rules.append(fact_rule)
-                for fact in self.facts:
-                    self.ie.fc_infer(fact, fact_rule, self)
+            kbrule = self._get_rule(fact_rule)
+            if kbrule is None:
+                self._renew(fact_rule)
+                self._store_rule(fact_rule)
+                self._schedule(fact_rule)
             else:
+                if self._undo is not None:
+                    self._touch(kbrule)
                 if fact_rule.supported_by:
-                    ind = self.rules.index(fact_rule)
                     for f in fact_rule.supported_by:
-                        self.rules[ind].supported_by.append(f)
+                        kbrule.supported_by.append(f)
                 else:
-                    ind = self.rules.index(fact_rule)
-                    self.rules[ind].asserted = True
+                    kbrule.asserted = True
+
+    def _renew(self, fact_rule):
+        """INTERNAL USE ONLY
+        Get a fact or rule that is not in the KB ready to be stored. It may
+        have been in the KB and been retracted, which left it not asserted and
+        with the justifications and supports lists it had then: only the
+        justifications made of facts/rules in the KB are kept, it is asserted
+        if it came with none, and it supports nothing yet.
+
+        Args:
+            fact_rule (Fact|Rule) - the fact or rule about to be stored
+        """
+        if self._undo is not None:
+            self._touch(fact_rule)
+        if not fact_rule.supported_by:
+            fact_rule.asserted = True
+        else:
+            supported_by = [pair for pair in fact_rule.supported_by
+                            if all(self._contains(member) for member in pair)]
+            if len(supported_by) < len(fact_rule.supported_by):
+                fact_rule.supported_by = supported_by
+                fact_rule.asserted = fact_rule.asserted or not supported_by
+        if fact_rule.supports_facts or fact_rule.supports_rules:
+            fact_rule.supports_facts = []
+            fact_rule.supports_rules = []
+            self._stale.pop(id(fact_rule), None)
 
     def kb_assert(self, fact_rule):
         """Assert a fact or rule into the KB
@@ -91,83 +412,571 @@ class KnowledgeBase(object):
         printv("Asserting {!r}", 0, verbose, [fact_rule])
         self.kb_add(fact_rule)
 
-    def kb_ask(self, fact):
+    def kb_assert_many(self, facts_rules):
+        """Assert many facts and rules into the KB at once. Everything is added
+        first and inference runs once afterwards: each rule is joined against
+        the facts already there in one go, and what that infers is chained
+        from until nothing new comes up. The KB ends up with the same facts,
+        rules and support as when asserting one by one.
+
+        Args:
+            facts_rules (iterable of Fact|Rule): Facts and Rules we're asserting
+        """
+        with self._writing():
+            for fact_rule in facts_rules:
+                printv("Asserting {!r}", 0, verbose, [fact_rule])
+                self._add(fact_rule)
+            self._infer()
+
+    def load(self, file, use_mmap=False):
+        """Assert all the facts and rules of a statements file, e.g.
+        statements_kb.txt, into the KB with kb_assert_many. The file is parsed
+        as the KB takes in its facts and rules, so it is never held in memory
+        as a whole.
+
+        Args:
+            file (str): name of the file to read
+            use_mmap (bool): map the file into memory instead of reading it
+        """
+        self.kb_assert_many(read.iter_statements(file, use_mmap))
+
+    def kb_ask(self, fact, backward=False):
         """Ask if a fact is in the KB
 
         Args:
-            fact (Fact) - Statement to be asked (will be converted into a Fact)
+            fact (Fact|listof Statement) - Statement to be asked (will be
+                converted into a Fact), or statements that must all hold at
+                once, like the LHS of a rule; bindings of a conjunction are
+                listed with the facts matching each of its statements
+            backward (bool) - also answer with facts that can be proved by
+                backward chaining through the asserted rules, even if they were
+                never inferred; always done for lazy predicates
 
         Returns:
             listof Bindings|False - list of Bindings if result found, False otherwise
         """
-        print("Asking {!r}".format(fact))
+        printv("Asking {!r}", 0, verbose, [fact])
+        if isinstance(fact, (list, tuple)):
+            statements = conjunction(fact)
+            facts_for = self._facts_for
+            if backward or any(s.predicate in self.lazy_predicates for s in statements):
+                facts_for = self._prover()
+            return ask_conjunction(statements, facts_for)
         if factq(fact):
             f = Fact(fact.statement)
-            bindings_lst = ListOfBindings()
-            # ask matched facts
-            for fact in self.facts:
-                binding = match(f.statement, fact.statement)
-                if binding:
-                    bindings_lst.add_bindings(binding, [fact])
+            if backward or f.statement.predicate in self.lazy_predicates:
+                return self._answer(f.statement, self._prover()(f.statement))[0]
 
-            return bindings_lst if bindings_lst.list_of_bindings else []
+            # answers only change with the facts of the asked predicate, whose
+            # generation is bumped whenever one is stored or removed
+            key = variant_key(f.statement)
+            generation = self._generations.get(index_key(f.statement), 0)
+            entry = self._ask_cache.get(key)
+            if entry is not None and entry[0] == generation:
+                self._ask_cache.move_to_end(key)
+                self.ask_cache_hits += 1
+                # bind the facts that matched again, so each ask gets answers
+                # of its own, with its own variable names
+                return self._answer(f.statement, entry[1])[0]
+            self.ask_cache_misses += 1
+            answer, facts = self._answer(f.statement, self._facts_for(f.statement))
+            if self.ask_cache_size > 0:
+                self._ask_cache[key] = (generation, facts)
+                self._ask_cache.move_to_end(key)
+                if len(self._ask_cache) > self.ask_cache_size:
+                    self._ask_cache.popitem(last=False)
+            return answer
 
         else:
-            print("Invalid ask:", fact.statement)
-            return []
+            print("Invalid ask:", fact)
+            return False
+
+    def kb_ask_iter(self, fact, limit=None, offset=0, backward=False):
+        """Ask if a fact is in the KB, getting the answers one at a time as
+        the facts are looked up, e.g. to stop at the first one or page
+        through them. The KB must not change while the answers are iterated.
+
+        Args:
+            fact (Fact) - Statement to be asked
+            limit (int|None) - most answers to yield, None for all of them
+            offset (int) - number of answers to skip first
+            backward (bool) - as for kb_ask; the answers proved by backward
+                chaining are all found before the first one is yielded
+
+        Yields:
+            Bindings - bindings of each answer, in the order kb_ask lists them
+        """
+        printv("Asking {!r}", 0, verbose, [fact])
+        if not factq(fact) or limit is not None and limit <= 0:
+            return
+        statement = fact.statement
+        if backward or statement.predicate in self.lazy_predicates:
+            facts = self._prover()(statement)
+        else:
+            entry = self._ask_cache.get(variant_key(statement))
+            if entry is not None and entry[0] == self._generations.get(index_key(statement), 0):
+                facts = entry[1]
+            else:
+                facts = self._facts_for(statement)
+        for binding, _ in self._matches(statement, facts):
+            if offset > 0:
+                offset -= 1
+                continue
+            yield binding
+            if limit is not None:
+                limit -= 1
+                if limit == 0:
+                    return
+
+    def _prover(self):
+        """INTERNAL USE ONLY
+        Get a function proving statements backwards through the asserted and
+        lazy rules, using the closure index for the predicates it answers
+
+        Returns:
+            function: takes a Statement, returns the listof Fact matching it
+        """
+        prover = []
+        def prove(statement):
+            facts = self.closure.answer(statement, self)
+            if facts is not None:
+                return facts
+            if not prover:
+                rules = [rule for rule in self.rules if rule.asserted] + list(self.lazy_rules)
+                prover.append(TabledProver(self, rules))
+            return prover[0].prove(statement)
+        return prove
+
+    def _answer(self, statement, facts):
+        """INTERNAL USE ONLY
+        Match the asked statement against candidate facts
+
+        Args:
+            statement (Statement) - Statement asked
+            facts (iterable of Fact) - Candidate facts
+
+        Returns:
+            (ListOfBindings|list, listof Fact) - what kb_ask returns, and the
+                facts that matched
+        """
+        bindings_lst = ListOfBindings()
+        matched = []
+        for binding, fact in self._matches(statement, facts):
+            bindings_lst.add_bindings(binding, [fact])
+            matched.append(fact)
+        return (bindings_lst if bindings_lst.list_of_bindings else []), matched
+
+    def _matches(self, statement, facts):
+        """INTERNAL USE ONLY
+        Match the asked statement against candidate facts, one at a time
+
+        Args:
+            statement (Statement) - Statement asked
+            facts (iterable of Fact) - Candidate facts
+
+        Yields:
+            (Bindings, Fact) - bindings of each matching fact, and the fact
+        """
+        plan = compile_pattern(statement)
+        for fact in facts:
+            binding = plan.match(fact.statement)
+            if binding:
+                yield binding, fact
 
     def kb_retract(self, fact_or_rule):
+        """Retract a fact or rule from the KB. If it is also inferred from facts
+        and rules still in the KB it stays, but only as inferred; otherwise it
+        is removed along with everything inferred from it that is left without
+        support. Only the removed facts/rules and the facts/rules they support
+        are visited, however large the KB. How support is judged is up to
+        self.tms, see tms.SupportCounting (the default) and tms.DRed.
+
+        Args:
+            fact_or_rule (Fact|Rule) - Fact or Rule to retract
+        """
+        with self._writing():
+            item = self._unassert(fact_or_rule)
+            if item is not None:
+                self.tms.retract([item], self)
+
+    def kb_retract_many(self, facts_rules):
+        """Retract many facts and rules from the KB at once. They all lose their
+        asserted status first, and the loss of support then goes through the
+        KB in a single pass, so facts/rules that several of them support are
+        visited once rather than once per retraction. The KB ends up with the
+        same facts, rules and support as when retracting one by one.
+
+        Args:
+            facts_rules (iterable of Fact|Rule): Facts and Rules to retract
+        """
+        with self._writing():
+            items = []
+            for fact_or_rule in facts_rules:
+                item = self._unassert(fact_or_rule)
+                if item is not None:
+                    items.append(item)
+            if items:
+                self.tms.retract(items, self)
+
+    def _unassert(self, fact_or_rule):
+        """INTERNAL USE ONLY
+        Take away the asserted status of the KB's instance of a fact or rule
+        being retracted. Lazy rules have no support, so they are dropped here.
+
+        Args:
+            fact_or_rule (Fact|Rule) - Fact or Rule to retract
+
+        Returns:
+            Fact|Rule|None: the KB's instance, or None if there is nothing
+                more to do
+        """
         printv("Retracting {!r}", 0, verbose, [fact_or_rule])
-        ####################################################
-        # Student code goes here
-        
-        if (isinstance(fact_or_rule, Rule)):
-            return 
-        
-        elif (isinstance(fact_or_rule, Fact)):
-            if fact_or_rule not in self.facts: # if the new statement (fact or rule) is not in facts
-                print('the fact is not in the kb!')
-                return 
+        if self.versions is not None and isinstance(fact_or_rule, Rule):
+            self.versions.rules_dirty = True
+        if isinstance(fact_or_rule, Fact):
+            item = self._get_fact(fact_or_rule)
+        elif isinstance(fact_or_rule, Rule) and fact_or_rule in self.lazy_rules:
+            rule = self.lazy_rules.pop(fact_or_rule)
+            self.closure.remove_rule(rule)
+            if self._undo is not None:
+                self._undo.append(('remove lazy', rule))
+            return None
+        elif isinstance(fact_or_rule, Rule):
+            item = self._get_rule(fact_or_rule)
+        else:
+            item = None
+        if item is None:
+            printv("{!r} is not in the KB", 0, verbose, [fact_or_rule])
+            return None
+        if self._undo is not None:
+            self._touch(item)
+        item.asserted = False
+        return item
+
+    def _contains(self, fact_rule):
+        """INTERNAL USE ONLY
+        Check whether this very fact or rule instance is in the KB
+
+        Args:
+            fact_rule (Fact|Rule): Fact or rule to check
+
+        Returns:
+            bool
+        """
+        store = self.facts if isinstance(fact_rule, Fact) else self.rules
+        return store.get(fact_rule) is fact_rule
+
+    def _cascade(self, roots):
+        """INTERNAL USE ONLY
+        Remove facts/rules without support, then, following their supports
+        edges, whatever is left without support, until nothing more goes. A
+        justification dies as soon as one of its facts/rules is removed; the
+        justifications of each fact/rule reached are indexed by the id of
+        their members the first time it is reached, so each justification is
+        scanned once and each edge costs O(1) after that.
 
+        Args:
+            roots (listof Fact|Rule): unsupported facts/rules of the KB to remove
+        """
+        removed = {}
+        # id of a dependent -> [dependent, justification indexes by member id, dead indexes]
+        touched = {}
+        queue = deque(roots)
+        while queue:
+            item = queue.popleft()
+            if id(item) in removed:
+                continue
+            removed[id(item)] = item
+            for dependent in item.supports_facts + item.supports_rules:
+                if id(dependent) in removed:
+                    continue
+                entry = touched.get(id(dependent))
+                if entry is None:
+                    if not self._contains(dependent):
+                        continue
+                    index = {}
+                    for i, pair in enumerate(dependent.supported_by):
+                        for supporter in pair:
+                            index.setdefault(id(supporter), []).append(i)
+                    entry = touched[id(dependent)] = [dependent, index, set()]
+                dead = entry[2]
+                dead.update(entry[1].pop(id(item), ()))
+                if len(dead) == len(dependent.supported_by) and not dependent.asserted:
+                    queue.append(dependent)
+            printv("Removing {!r}", 1, verbose, [item])
+            if isinstance(item, Fact):
+                self._remove_fact(item)
             else:
-                to_remove = self.facts[self.facts.index(fact_or_rule)]
+                self._remove_rule(item)
+            self._stale.pop(id(item), None)
+            self.ie.forget(item, self)
+        if self.metrics is not None:
+            self.metrics.on_cascade(list(removed.values()))
 
-                supports = to_remove.supported_by
+        for dependent, _, dead in touched.values():
+            if not dead:
+                continue
+            if self._undo is not None:
+                self._touch(dependent)
+            kept = []
+            for i, pair in enumerate(dependent.supported_by):
+                if i not in dead:
+                    kept.append(pair)
+                    continue
+                for supporter in pair:
+                    if id(supporter) not in removed:
+                        self._unlink(supporter)
+            dependent.supported_by = kept
+        self._compact()
 
-                if supports:
-                    print('the fact is supported!')
-                    return 
+    def _unlink(self, supporter):
+        """INTERNAL USE ONLY
+        Count a justification of supporter that was dropped. The fact/rule it
+        justified stays in the supports lists of supporter until they are
+        compacted, and is skipped by _cascade until then.
 
-                child_facts = to_remove.supports_facts
-                child_rules = to_remove.supports_rules
+        Args:
+            supporter (Fact|Rule): Fact or rule that was part of the justification
+        """
+        if self._undo is not None:
+            self._touch(supporter)
+        entry = self._stale.get(id(supporter))
+        if entry is None:
+            entry = self._stale[id(supporter)] = [supporter, 0]
+        entry[1] += 1
 
-                # print('here are the child facts')
-                # for cf in child_facts:
-                #     cf.__str__()
+    def _compact(self):
+        """INTERNAL USE ONLY
+        Rebuild the supports lists of the facts/rules in which at least half of
+        the entries are stale, so compacting costs O(1) per dropped
+        justification in the long run
+        """
+        for key, (supporter, stale) in list(self._stale.items()):
+            if 2 * stale < len(supporter.supports_facts) + len(supporter.supports_rules):
+                continue
+            def supported(dependent):
+                return self._contains(dependent) and any(
+                    s is supporter for pair in dependent.supported_by for s in pair)
+            if self._undo is not None:
+                self._touch(supporter)
+            supporter.supports_facts = [f for f in supporter.supports_facts if supported(f)]
+            supporter.supports_rules = [r for r in supporter.supports_rules if supported(r)]
+            del self._stale[key]
 
-                # print('here are the child rules')
-                # for r in child_rules:
-                #     r.__str__()
+    def begin(self):
+        """Start a transaction. Until it is committed or rolled back, the KB
+        logs how to undo each change made to it: every fact/rule stored or
+        removed, and the asserted status, justifications and supports lists
+        of a fact/rule the first time one of them changes. Supports lists and
+        justifications only grow in place or get replaced, so saving their
+        length is enough. Rolling back replays the log backwards, costing time
+        proportional to the changes made rather than to the size of the KB.
+        Transactions nest: rolling back an inner one undoes its changes only,
+        committing it leaves them to the outer one.
+        """
+        printv("Beginning transaction {}", 0, verbose, [len(self._savepoints) + 1])
+        with self._writing():
+            if self._undo is None:
+                self._undo = []
+            self._savepoints.append((len(self._undo), {}))
 
-                for f in child_facts: # f is one of the child fact(s) of the fact to be removed 
-                    supporting_pairs = self.facts[self.facts.index(f)].supported_by # find 
-                    for pair in supporting_pairs:
-                        if fact_or_rule in pair:
-                            supporting_pairs.remove(pair)
-                    if len(supporting_pairs) == 0 and not f.asserted: # if there are no more supporting pairs to the child fact f 
-                        self.kb_retract(f)
+    def commit(self):
+        """Keep the changes made since the last begin
 
-                for r in child_rules:
-                    supporting_pairs = self.rules[self.rules.index(r)].supported_by
-                    for pair in supporting_pairs:
-                        if fact_or_rule in pair:
-                            supporting_pairs.remove(pair)
-                    if not supporting_pairs and not r.asserted:
-                        self.rules.remove(r)
+        Raises:
+            ValueError: if no transaction is open
+        """
+        if not self._savepoints:
+            raise ValueError("no transaction to commit")
+        printv("Committing transaction {}", 0, verbose, [len(self._savepoints)])
+        with self._writing():
+            _, touched = self._savepoints.pop()
+            if self._savepoints:
+                # saved for the inner transaction are saved for the outer one too
+                self._savepoints[-1][1].update(touched)
+            else:
+                self._undo = None
 
-                self.facts.remove(fact_or_rule)
+    def rollback(self):
+        """Undo the changes made since the last begin. Facts and rules that
+        come back are stored after the others and given back to the engine
+        without inferring from them again, see InferenceEngine.recall.
+
+        Raises:
+            ValueError: if no transaction is open
+        """
+        if not self._savepoints:
+            raise ValueError("no transaction to roll back")
+        printv("Rolling back transaction {}", 0, verbose, [len(self._savepoints)])
+        with self._writing():
+            start, _ = self._savepoints.pop()
+            log, self._undo = self._undo, None
+            while len(log) > start:
+                entry = log.pop()
+                change, item = entry[0], entry[1]
+                if change == 'store':
+                    if isinstance(item, Fact):
+                        self._remove_fact(item)
+                    else:
+                        self._remove_rule(item)
+                    self.ie.forget(item, self)
+                elif change == 'remove':
+                    if isinstance(item, Fact):
+                        self._store_fact(item)
+                    else:
+                        self._store_rule(item)
+                    self.ie.recall(item, self)
+                elif change == 'store lazy':
+                    self.closure.remove_rule(self.lazy_rules.pop(item))
+                elif change == 'remove lazy':
+                    self._store_lazy_rule(item)
+                elif change == 'lazy predicate':
+                    self.lazy_predicates.discard(item)
+                else:
+                    _, _, asserted, lists, stale = entry
+                    item.asserted = asserted
+                    for name, (values, n) in zip(('supported_by', 'supports_facts', 'supports_rules'), lists):
+                        del values[n:]
+                        setattr(item, name, values)
+                    if stale is None:
+                        self._stale.pop(id(item), None)
+                    else:
+                        self._stale[id(item)] = list(stale)
+            if self._savepoints:
+                self._undo = log
+            if self.versions is not None:
+                self.versions.rules_dirty = True
+
+    def _touch(self, fact_rule):
+        """INTERNAL USE ONLY
+        Save the asserted status, justifications and supports lists of a
+        fact/rule about to change, unless the innermost transaction saved
+        them already
+
+        Args:
+            fact_rule (Fact|Rule): Fact or rule about to change
+        """
+        touched = self._savepoints[-1][1]
+        if id(fact_rule) in touched:
+            return
+        touched[id(fact_rule)] = None
+        lists = [(values, len(values)) for values in
+                 (fact_rule.supported_by, fact_rule.supports_facts, fact_rule.supports_rules)]
+        stale = self._stale.get(id(fact_rule))
+        self._undo.append(('fields', fact_rule, fact_rule.asserted, lists,
+                           list(stale) if stale is not None else None))
 
 class InferenceEngine(object):
+    def infer_from_fact(self, fact, kb):
+        """Forward-chain from a fact that was just added to the KB
+
+        Args:
+            fact (Fact) - A new fact in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        for rule in list(kb._rules_for(fact.statement)):
+            if not kb._is_pending(rule):
+                self.fc_infer(fact, rule, kb)
+
+    def infer_from_rule(self, rule, kb):
+        """Forward-chain from a rule that was just added to the KB
+
+        Args:
+            rule (Rule) - A new rule in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        for fact in list(kb._facts_for(rule.lhs[0])):
+            if not kb._is_pending(fact):
+                self.fc_infer(fact, rule, kb)
+
+    def saturate(self, kb):
+        """Called by the KB whenever its agenda is empty, for engines that
+        infer set-at-a-time rather than per fact or rule. The curried-rule
+        engine infers everything eagerly, so there is nothing to do here.
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        pass
+
+    def restore(self, kb):
+        """Rebuild the engine state for a KB whose facts and rules were loaded
+        already fully inferred, e.g. from a snapshot, without inferring
+        anything again. The curried-rule engine keeps all its state in the
+        KB, so there is nothing to do here.
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        pass
+
+    def derive(self, statement, facts, rule, kb):
+        """Assert a fact inferred from a rule whose whole LHS matched, and
+        record the support links
+
+        Args:
+            statement (Statement) - The instantiated RHS of the rule
+            facts (listof Fact) - The facts that matched the LHS, in order
+            rule (Rule) - The rule
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Fact: the KB's instance of the inferred fact
+        """
+        new = Fact(statement, [list(facts) + [rule]])
+        metrics = kb.metrics
+        added = metrics is not None and kb._get_fact(new) is None
+        kb.kb_assert(new)
+        new = kb._get_fact(new)
+        if metrics is not None:
+            metrics.on_fire(rule, new, added)
+        for fact in dict.fromkeys(facts):
+            fact.supports_facts.append(new)
+        rule.supports_facts.append(new)
+        return new
+
+    def forget(self, fact_rule, kb):
+        """Drop any engine state about a fact or rule removed from the KB. The
+        curried-rule engine keeps all its state in the KB, so there is nothing
+        to do here.
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that was removed
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        pass
+
+    def recall(self, fact_rule, kb):
+        """Take back a fact or rule that is in the KB again after the engine
+        forgot it, e.g. when a transaction is rolled back, without inferring
+        anything from it: what it infers is back in the KB as well. The
+        curried-rule engine keeps all its state in the KB, so there is nothing
+        to do here.
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that is back
+            kb (KnowledgeBase) - A KnowledgeBase
+
+        Returns:
+            Nothing
+        """
+        pass
+
     def fc_infer(self, fact, rule, kb):
         """Forward-chaining to infer new facts and rules
 
@@ -179,64 +988,48 @@ class InferenceEngine(object):
         Returns:
             Nothing            
         """
-        printv('Attempting to infer from {!r} and {!r} => {!r}', 1, verbose,
-            [fact.statement, rule.lhs, rule.rhs])
-
-        # check firs statement of LHS against the fact and see if there can be any bindings produced
-        bindings = match(rule.lhs[0], fact.statement) # bindings is of type == Bindings 
-        new = None
-
-        # other checks 
-        f_pred = fact.statement.predicate
-        f_terms = fact.statement.terms
-        f_constant = True 
-        for term in f_terms:
-            if isinstance(term, Variable):
-                f_constant = False 
-
-        r_pred = rule.lhs[0].predicate
-        r_terms = rule.lhs[0].terms
-        r_constant = True 
-        for term in r_terms:
-            if isinstance(term, Variable):
-                r_constant = False
+        metrics = kb.metrics
+        start = time.perf_counter() if metrics is not None and metrics.timing else None
+        if verbose > 1:
+            printv('Attempting to infer from {!r} and {!r} => {!r}', 1, verbose,
+                [fact.statement, rule.lhs, rule.rhs])
 
+        # check first statement of LHS against the fact and see if there can be any bindings produced
+        bindings = compile_pattern(rule.lhs[0]).match(fact.statement) # bindings is of type == Bindings
+        if metrics is not None:
+            metrics.on_match(fact, rule, bindings)
 
-        # check if there are bindings 
+        # check if there are bindings
         if bindings:
             new_lhs = list()
-        
+
             for i in range(len(rule.lhs) - 1):
                 new_lhs.append(instantiate(rule.lhs[i+1], bindings))
-                
+
             new_rhs = instantiate(rule.rhs, bindings)
 
             if len(new_lhs):
-                # now to make the new rule after adding a new fact 
+                # now to make the new rule after adding a new fact
                 new = Rule([new_lhs, new_rhs],  supported_by=[[fact, rule]])
+                added = metrics is not None and kb._get_rule(new) is None
+                kb.kb_assert(new)
+                new = kb._get_rule(new)
+                if verbose > 1:
+                    printv('New rule is {}', 1, verbose, [new])
+                fact.supports_rules.append(new)
+                rule.supports_rules.append(new)
 
             else:
                 new = Fact(new_rhs, [[fact, rule]])
+                added = metrics is not None and kb._get_fact(new) is None
+                kb.kb_assert(new)
+                new = kb._get_fact(new)
+                if verbose > 1:
+                    printv('New fact is {}', 1, verbose, [new])
+                fact.supports_facts.append(new)
+                rule.supports_facts.append(new)
 
-        elif (f_pred == r_pred and r_terms == f_terms and f_constant == True and r_constant == True): # it could be that both fact and first lhs of rule only have constants and are exactly the same and so we are creating a new fact instead 
-            lhs_count = len(rule.lhs)
-            if lhs_count == 1: # if so, create a new fact 
-                new = Fact(rule.rhs, [fact, rule])
-
-            elif lhs_count > 1 : #if so, create new rule 
-                new = Rule([rule.lhs[:1], rule.rhs], [fact, rule])            
-
-        if (new and isinstance(new, Fact)): 
-            kb.kb_assert(new)
-            print('new fact is ')
-            print(new.__str__())
-            fact.supports_facts.append(new)
-            rule.supports_facts.append(new)
-        
-        elif (new and isinstance(new, Rule)):
-            kb.kb_assert(new)
-            print('new rule is ')
-            print(new.__str__())
-            fact.supports_rules.append(new)
-            rule.supports_rules.append(new)
-
+            if metrics is not None:
+                metrics.on_fire(rule, new, added)
+        if start is not None:
+            metrics.on_rule_time(rule, time.perf_counter() - start)
@@ -0,0 +1,76 @@
+from collections import deque
+from logical_classes import *
+from util import *
+
+verbose = 0
+
+class SupportCounting(object):
+    """Truth maintenance by counting justifications: a fact/rule that loses
+        its asserted status goes once it has no justification left, and so
+        does everything left without one after it, see
+        KnowledgeBase._cascade. Each removal costs O(1) per support edge. It
+        is exact for non-recursive programs; with recursive rules, facts
+        justified only by each other (e.g. through a cycle of isa facts) stay.
+    """
+    def retract(self, items, kb):
+        """Update a KB after facts/rules lost their asserted status
+
+        Args:
+            items (listof Fact|Rule): facts/rules of the KB no longer asserted
+            kb (KnowledgeBase): the KB
+        """
+        roots = []
+        for item in items:
+            if item.supported_by:
+                printv("{!r} is still supported", 0, verbose, [item])
+            else:
+                roots.append(item)
+        if roots:
+            kb._cascade(roots)
+
+class DRed(object):
+    """Delete-and-rederive truth maintenance for recursive programs. Everything
+        derived from the retracted facts/rules is deleted first, following
+        the support edges; then whatever has a justification made only of
+        facts/rules that were not deleted (or were rederived) is restored,
+        until nothing more is. Justifications are recorded for every
+        derivation, so rederiving only checks them and no rule is run again.
+        Facts justified only through a cycle that the retraction broke go,
+        unlike with SupportCounting.
+    """
+    def retract(self, items, kb):
+        """Update a KB after facts/rules lost their asserted status
+
+        Args:
+            items (listof Fact|Rule): facts/rules of the KB no longer asserted
+            kb (KnowledgeBase): the KB
+        """
+        # overdelete: everything not asserted that depends on the items
+        deleted = {}
+        queue = deque(items)
+        while queue:
+            item = queue.popleft()
+            if id(item) in deleted or item.asserted:
+                continue
+            deleted[id(item)] = item
+            for dependent in item.supports_facts + item.supports_rules:
+                if id(dependent) not in deleted and kb._contains(dependent):
+                    queue.append(dependent)
+        printv("Overdeleted {} facts/rules", 1, verbose, [len(deleted)])
+
+        # rederive: restore what is still justified by what is left
+        queue = deque(deleted.values())
+        while queue:
+            item = queue.popleft()
+            if id(item) not in deleted:
+                continue
+            if any(all(id(m) not in deleted for m in pair) for pair in item.supported_by):
+                del deleted[id(item)]
+                for dependent in item.supports_facts + item.supports_rules:
+                    if id(dependent) in deleted:
+                        queue.append(dependent)
+        printv("Removing {} facts/rules after rederiving", 1, verbose, [len(deleted)])
+
+        # what is left has no justification outside itself
+        if deleted:
+            kb._cascade(list(deleted.values()))
@@ -0,0 +1,230 @@
+from logical_classes import *
+from util import *
+from student_code import InferenceEngine
+from datalog import Relation, CompiledRule
+
+verbose = 0
+
+class RuleMemory(object):
+    """Partial matches of one rule, as tokens: the binding vector of the
+        rule's variables and the facts that matched its first conditions.
+        Tokens waiting for condition i are hashed on the values condition i
+        looks up, so a new fact only meets the tokens it can extend.
+
+    Attributes:
+        compiled (CompiledRule): the rule, compiled to a binding vector
+        levels (listof dict): for each condition i > 0, lookup key ->
+            tokens ((values, facts) tuples) that matched conditions 0..i-1
+    """
+    def __init__(self, rule):
+        """Constructor for RuleMemory
+
+        Args:
+            rule (Rule): the rule
+        """
+        super(RuleMemory, self).__init__()
+        self.compiled = CompiledRule(rule)
+        self.levels = [{} for _ in rule.lhs]
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'RuleMemory({!r}, {} tokens)'.format(
+            self.compiled.rule, sum(len(b) for level in self.levels for b in level.values()))
+
+    def token_key(self, i, values):
+        """Values condition i looks up, given the binding vector of a token
+        """
+        return tuple(values[k] if isinstance(k, int) else k for k in self.compiled.conditions[i][2])
+
+    def fact_key(self, i, fact):
+        """Terms of a fact at the positions condition i looks up
+        """
+        terms = fact.statement.terms
+        return tuple(terms[p] for p in self.compiled.conditions[i][1])
+
+class TokenEngine(InferenceEngine):
+    """Inference engine matching rules like the default engine, one fact
+        against one partial match as they come off the agenda, but keeping
+        partial matches as tokens in a memory per rule instead of asserting a
+        curried Rule for each. The KB only holds the asserted rules, and a
+        partial match costs a binding vector rather than new Statements for
+        the rest of the LHS.
+
+        Inferred facts are supported by the facts that matched the LHS plus
+        the rule, as with rete.ReteEngine, so kb_retract works the same as
+        with the default engine. Facts are expected to be ground (free of
+        variables).
+
+    Attributes:
+        memories (dictof RuleMemory): memory of each rule inferred from
+        relations (dictof Relation): facts inferred from, by index key
+    """
+    def __init__(self):
+        """Constructor for TokenEngine
+        """
+        super(TokenEngine, self).__init__()
+        self.memories = {}
+        self.relations = {}
+        # index key -> (rule, condition) pairs it can match
+        self._conditions = {}
+        # fact -> (rule, level, token) entries holding it
+        self._token_index = {}
+        self._restoring = False
+
+    def infer_from_fact(self, fact, kb):
+        """Match a fact that was just added to the KB against the tokens
+            waiting for it, then start new tokens with it
+
+        Args:
+            fact (Fact) - A new fact in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        key = index_key(fact.statement)
+        # take the waiting tokens first, so the tokens this fact makes are
+        # not matched against it again
+        waiting = []
+        for rule, i in self._conditions.get(key, ()):
+            memory = self.memories[rule]
+            if i > 0:
+                bucket = memory.levels[i].get(memory.fact_key(i, fact))
+                if bucket:
+                    waiting.append((memory, i, list(bucket)))
+            elif memory.fact_key(0, fact) == tuple(memory.compiled.conditions[0][2]):
+                waiting.append((memory, 0, [((None,) * memory.compiled.size, ())]))
+        self.relations.setdefault(key, Relation()).add(fact)
+        for memory, i, tokens in waiting:
+            for values, facts in tokens:
+                self._extend(memory, i, values, facts, fact, kb)
+
+    def infer_from_rule(self, rule, kb):
+        """Start the memory of a rule that was just added to the KB, matching
+            its first condition against the facts inferred from so far
+
+        Args:
+            rule (Rule) - A new rule in the KnowledgeBase
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        memory = self.memories[rule] = RuleMemory(rule)
+        for i, condition in enumerate(memory.compiled.conditions):
+            self._conditions.setdefault(condition[0], []).append((rule, i))
+        self._left_activate(memory, 0, (None,) * memory.compiled.size, (), kb)
+
+    def forget(self, fact_rule, kb):
+        """Drop a retracted fact, and every token holding it, or a retracted
+            rule and its memory
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that was removed
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        if isinstance(fact_rule, Rule):
+            memory = self.memories.pop(fact_rule, None)
+            if memory is not None:
+                for condition in memory.compiled.conditions:
+                    pairs = self._conditions.get(condition[0])
+                    if pairs is None:
+                        continue
+                    pairs[:] = [pair for pair in pairs if pair[0] is not fact_rule]
+                    if not pairs:
+                        del self._conditions[condition[0]]
+                for i, level in enumerate(memory.levels):
+                    for bucket in level.values():
+                        for token in bucket:
+                            self._unindex(fact_rule, i, token)
+            return
+
+        relation = self.relations.get(index_key(fact_rule.statement))
+        if relation is not None:
+            relation.remove(fact_rule)
+        for rule, i, token in self._token_index.pop(fact_rule, ()):
+            memory = self.memories.get(rule)
+            if memory is None:
+                continue
+            values, facts = token
+            bucket = memory.levels[i].get(memory.token_key(i, values))
+            if not bucket or token not in bucket:
+                continue
+            del bucket[token]
+            self._unindex(rule, i, token)
+
+    def restore(self, kb):
+        """Rebuild the memories for a KB whose facts were all inferred
+        already, without firing anything
+
+        Args:
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        for fact in kb.facts:
+            self.relations.setdefault(index_key(fact.statement), Relation()).add(fact)
+        self._restoring = True
+        try:
+            for rule in kb.rules:
+                self.infer_from_rule(rule, kb)
+        finally:
+            self._restoring = False
+
+    def recall(self, fact_rule, kb):
+        """Take back a fact or rule that is in the KB again, rebuilding the
+        tokens it is part of without firing anything
+
+        Args:
+            fact_rule (Fact|Rule) - The fact or rule that is back
+            kb (KnowledgeBase) - A KnowledgeBase
+        """
+        self._restoring = True
+        try:
+            if isinstance(fact_rule, Rule):
+                self.infer_from_rule(fact_rule, kb)
+            else:
+                self.infer_from_fact(fact_rule, kb)
+        finally:
+            self._restoring = False
+
+    def _unindex(self, rule, i, token):
+        """Drop a token of a rule waiting for condition i from the token index
+        """
+        entry = (rule, i, token)
+        for fact in token[1]:
+            entries = self._token_index.get(fact)
+            if entries is not None:
+                entries.pop(entry, None)
+                if not entries:
+                    del self._token_index[fact]
+
+    def _extend(self, memory, i, values, facts, fact, kb):
+        """Extend a token matching conditions 0..i-1 with a fact for
+            condition i, whose lookup key is known to agree with it
+        """
+        _, _, _, binds, checks = memory.compiled.conditions[i]
+        terms = fact.statement.terms
+        if any(terms[p] != terms[q] for p, q in checks):
+            return
+        values = list(values)
+        for pos, slot in binds:
+            values[slot] = terms[pos]
+        facts = facts + (fact,)
+        if i + 1 < len(memory.levels):
+            self._left_activate(memory, i + 1, tuple(values), facts, kb)
+        elif not self._restoring:
+            statement = memory.compiled.instantiate(values)
+            printv('Firing {!r} => {!r}', 1, verbose, [memory.compiled.rule.lhs, statement])
+            self.derive(statement, list(facts), memory.compiled.rule, kb)
+
+    def _left_activate(self, memory, i, values, facts, kb):
+        """Store a token waiting for condition i (unless it is the empty
+            token for the first one) and match it against the facts inferred
+            from so far
+        """
+        key = memory.token_key(i, values)
+        if i > 0:
+            token = (values, facts)
+            memory.levels[i].setdefault(key, {})[token] = None
+            entry = (memory.compiled.rule, i, token)
+            for fact in facts:
+                self._token_index.setdefault(fact, {})[entry] = None
+        condition = memory.compiled.conditions[i]
+        relation = self.relations.get(condition[0])
+        if relation is not None:
+            for fact in list(relation.lookup(condition[1], key)):
+                self._extend(memory, i, values, facts, fact, kb)
@@ -1,3 +1,4 @@
+import weakref
 import logical_classes as lc
 
 def is_var(var):
@@ -11,7 +12,10 @@ def is_var(var):
     Returns:
         bool
     """
-    if type(var) == str:
+    cls = var.__class__
+    if cls is lc.Term:
+        return var.term.__class__ is lc.Variable
+    if cls is str:
         return var[0] == "?"
     if isinstance(var, lc.Term):
         return isinstance(var.term, lc.Variable)
@@ -36,8 +40,8 @@ def match(state1, state2, bindings=None):
         bindings = lc.Bindings()
     return match_recursive(state1.terms, state2.terms, bindings)
 
-def match_recursive(terms1, terms2, bindings):  # recursive...
-    """Recursive helper for match
+def match_recursive(terms1, terms2, bindings):
+    """Helper for match, matching the terms pairwise
 
     Args:
         terms1 (listof Term): terms to match with terms2
@@ -47,17 +51,148 @@ def match_recursive(terms1, terms2, bindings):  # recursive...
     Returns:
         Bindings|False: either associated bindings or no match found
     """
-    if len(terms1) == 0:
-        return bindings
-    if is_var(terms1[0]):
-        if not bindings.test_and_bind(terms1[0], terms2[0]):
+    for term1, term2 in zip(terms1, terms2):
+        if is_var(term1):
+            if not bindings.test_and_bind(term1, term2):
+                return False
+        elif is_var(term2):
+            if not bindings.test_and_bind(term2, term1):
+                return False
+        elif term1 != term2:
             return False
-    elif is_var(terms2[0]):
-        if not bindings.test_and_bind(terms2[0], terms1[0]):
+    return bindings
+
+class MatchPlan(object):
+    """A statement pattern compiled for matching: the positions that must hold
+        a given constant, the position where each variable is first bound, and
+        the positions that must hold the same term as an earlier one because a
+        variable repeats. Terms are interned, so every test is an identity
+        check, and matching a ground statement walks the plan without
+        recursion or intermediate lists. A plan does not refer to its
+        pattern, so that the plans cached by compile_pattern go along with
+        their statements.
+
+    Attributes:
+        predicate (int): symbol id of the predicate of the pattern
+        terms (tupleof Term): terms of the pattern
+        constants (tupleof (int, Term)): positions that must hold a constant
+        binds (tupleof (int, Variable)): first position of each variable
+        repeats (tupleof (int, int)): pairs of positions that must hold the
+            same term, the second being where the variable was first bound
+    """
+    __slots__ = ('predicate', 'terms', 'constants', 'binds', 'repeats')
+
+    def __init__(self, pattern):
+        """Constructor for MatchPlan, use compile_pattern to get the shared plan
+            of a statement
+
+        Args:
+            pattern (Statement): statement to compile
+        """
+        constants, binds, repeats = [], [], []
+        first = {}
+        for pos, term in enumerate(pattern.terms):
+            if not is_var(term):
+                constants.append((pos, term))
+            elif term.term.element in first:
+                repeats.append((pos, first[term.term.element]))
+            else:
+                first[term.term.element] = pos
+                binds.append((pos, term.term))
+        self.predicate = pattern.key[0]
+        self.terms = pattern.terms
+        self.constants = tuple(constants)
+        self.binds = tuple(binds)
+        self.repeats = tuple(repeats)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'MatchPlan({!r}, {!r}, {!r}, {!r})'.format(
+            list(self.terms), self.constants, self.binds, self.repeats)
+
+    def match(self, statement, bindings=None):
+        """Match a statement against the pattern, the same as
+            match(pattern, statement, bindings). Statements with variables and
+            already associated bindings are left to match.
+
+        Args:
+            statement (Statement): statement to match
+            bindings (Bindings|None): already associated bindings
+
+        Returns:
+            Bindings|False: either associated bindings or no match found
+        """
+        terms = statement.terms
+        if statement.key[0] != self.predicate or len(terms) != len(self.terms):
             return False
-    elif terms1[0] != terms2[0]:
+        if bindings:
+            return match_recursive(self.terms, terms, bindings)
+        for pos, term in self.constants:
+            if terms[pos] is not term:
+                return self._mismatch(statement, pos)
+        for pos, _ in self.binds:
+            if terms[pos].term.__class__ is not lc.Constant:
+                return match_recursive(self.terms, terms, lc.Bindings())
+        for pos, other in self.repeats:
+            if terms[pos] is not terms[other]:
+                return self._mismatch(statement, pos)
+        bindings = lc.Bindings()
+        for pos, variable in self.binds:
+            bindings.add_binding(variable, terms[pos].term)
+        return bindings
+
+    def _mismatch(self, statement, pos):
+        """A test failed at pos: no match, unless the statement has a variable
+            there that match may bind
+        """
+        if statement.terms[pos].term.__class__ is lc.Variable:
+            return match_recursive(self.terms, statement.terms, lc.Bindings())
         return False
-    return match_recursive(terms1[1:], terms2[1:], bindings)
+
+_plans = weakref.WeakKeyDictionary()
+
+def compile_pattern(statement):
+    """Get the match plan of a statement, compiling it the first time
+
+    Args:
+        statement (Statement): statement to use as a pattern
+
+    Returns:
+        MatchPlan
+    """
+    plan = _plans.get(statement)
+    if plan is None:
+        plan = _plans[statement] = MatchPlan(statement)
+    return plan
+
+def index_key(statement):
+    """Key under which a statement is indexed in the KB, i.e. its predicate and
+        arity. Only statements sharing a key can match each other.
+
+    Args:
+        statement (Statement): statement to compute the key of
+
+    Returns:
+        (str, int): predicate and number of terms of the statement
+    """
+    return (statement.predicate, len(statement.terms))
+
+def variant_key(statement):
+    """Key identifying a statement up to the names of its variables, e.g.
+        (inst ?x ?y) and (inst ?a ?b) have the same key but (inst ?x ?x) does not
+
+    Args:
+        statement (Statement): statement to compute the key of
+
+    Returns:
+        (str, tuple): predicate, then for each term either its constant value
+            or ('?', n) for the n-th distinct variable
+    """
+    names = {}
+    return (statement.predicate,
+            tuple(('?', names.setdefault(t.term.element, len(names))) if is_var(t)
+                  else t.term.element for t in statement.terms))
 
 def instantiate(statement, bindings):
     """Generate Statement from given statement and bindings. Constructed statement
@@ -67,15 +202,18 @@ def instantiate(statement, bindings):
         statement (Statement): statement to generate new statement from
         bindings (Bindings): bindings to substitute into statement
     """
-    def handle_term(term):
-        if is_var(term):
-            bound_value = bindings.bound_to(term.term)
-            return lc.Term(bound_value) if bound_value else term
-        else:
-            return term
-
-    new_terms = [handle_term(t) for t in statement.terms]
-    return lc.Statement([statement.predicate] + new_terms)
+    plan = compile_pattern(statement)
+    if not plan.binds:
+        return statement
+    values = bindings.bindings_dict
+    terms = list(statement.terms)
+    for pos, variable in plan.binds:
+        value = values.get(variable.element)
+        if value:
+            terms[pos] = lc.Term(value)
+    for pos, other in plan.repeats:
+        terms[pos] = terms[other]
+    return lc.Statement([statement.predicate] + terms)
 
 def factq(element):
     """Check if element is a fact